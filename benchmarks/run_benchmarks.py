@@ -0,0 +1,351 @@
+"""
+Benchmarks for the bot's hot path: scanning, in one process and in a ScanPool, formatting replies, the SQL helpers and a full scrape_reddit cycle
+against a synthetic MockReddit (see tests/conftest.py make_synthetic_reddit), and the import time of the entry points.
+Nothing touches the network.
+
+Run from the repository root:
+    python -m benchmarks.run_benchmarks --output results.json
+    python -m benchmarks.run_benchmarks --quick --compare results.json
+
+Results are written as JSON so runs of different versions can be compared with --compare.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+
+from conftest import MockReddit, make_synthetic_reddit  # type: ignore
+from rsarb.RedditScanAndReplyBot import RedditScanAndReplyBot  # type: ignore
+from rsarb.util.catalog_funcs import CatalogSnapshot, TitleMatcher  # type: ignore
+from rsarb.util.praw_funcs import scan_entity  # type: ignore
+from rsarb.util.requestor_funcs import configure_http_session  # type: ignore
+from rsarb.util.scan_funcs import ScanPool, match_records, scan_entities  # type: ignore
+from rsarb.util.sql_funcs import (create_database, get_sql_cursor,  # type: ignore
+                                  update_opted_in_users, update_replied_entry_table)
+
+def measure(function, repeats: int) -> list:
+    """
+    Calls function repeats times, returns the time each call took in seconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def make_result(benchmark: str, params: dict, timings: list, items: int) -> dict:
+    median = statistics.median(timings)
+    return {
+        'benchmark': benchmark,
+        'params': params,
+        'repeats': len(timings),
+        'min_seconds': min(timings),
+        'median_seconds': median,
+        'items': items,
+        'seconds_per_item': median / items if items else None
+    }
+
+def make_database(directory: str, replied: int = 0, opted_in: int = 0, titles: int = 0) -> str:
+    """
+    Creates a bot database in directory holding replied replied entries, opted_in users and titles synthetic books.
+    :returns: str path of the database.
+    """
+    path = os.path.join(directory, f"bench-{replied}-{opted_in}-{titles}.db")
+    create_database(path)
+    cur = get_sql_cursor(path)
+    cur.executemany('INSERT INTO replied_entries (reddit_id, reply_succeeded_bool) VALUES (?, 1)', ((f"r{i}",) for i in range(replied)))
+    cur.executemany('INSERT INTO opted_in_users (reddit_username) VALUES (?)', ((f"synthetic_author{i}",) for i in range(opted_in)))
+    cur.executemany('INSERT INTO books (title, author, isbn, uri, summary) VALUES (?, ?, ?, ?, ?)',
+                    ((f"synthetic book {i:06d}", f"author{i}", f"isbn{i}", f"https://example.com/{i}", "summary") for i in range(titles)))
+    cur.connection.commit()
+    cur.connection.close()
+    return path
+
+def bench_scan_entity(titles: int, comments: int, replied: int, repeats: int = 3) -> dict:
+    """
+    Scans comments synthetic comments one at a time with scan_entity, using a TitleMatcher of titles titles
+    and a replied_entries set of replied ids.
+    """
+    synthetic = make_synthetic_reddit(seed=1, submissions=max(1, comments // 100), comments=comments, titles=titles, max_depth=0)
+    matcher = TitleMatcher(synthetic.titles)
+    replied_entries = {f"r{i}" for i in range(replied)}
+    opted_in_users = set(synthetic.opted_in_users)
+    entities = synthetic.comments
+
+    def run():
+        for entity in entities:
+            scan_entity(entity, synthetic.titles, replied_entries, opted_in_users, matcher)
+
+    return make_result('scan_entity', {'titles': titles, 'comments': comments, 'replied': replied}, measure(run, repeats), len(entities))
+
+def bench_scan_entities(titles: int, comments: int, replied: int, repeats: int = 3, opted_in_ratio: float = 0.5) -> dict:
+    """
+    Scans the same batch as bench_scan_entity with the batch API used by scrape_reddit.
+    opted_in_ratio is the share of authors who have opted in; the comments of the others are skipped before being scanned.
+    """
+    synthetic = make_synthetic_reddit(seed=1, submissions=max(1, comments // 100), comments=comments, titles=titles,
+                                      opted_in_ratio=opted_in_ratio, max_depth=0)
+    matcher = TitleMatcher(synthetic.titles)
+    replied_entries = {f"r{i}" for i in range(replied)}
+    opted_in_users = set(synthetic.opted_in_users)
+    entities = synthetic.comments
+
+    def run():
+        scan_entities(entities, matcher, replied_entries, opted_in_users)
+
+    params = {'titles': titles, 'comments': comments, 'replied': replied}
+    if opted_in_ratio != 0.5: # left out at the default, so results of earlier runs still compare.
+        params['opted_in_ratio'] = opted_in_ratio
+    return make_result('scan_entities', params, measure(run, repeats), len(entities))
+
+def bench_scan_pool(workers: int, titles: int, comments: int, repeats: int = 3) -> dict:
+    """
+    Matches comments synthetic comments against titles titles in a ScanPool of workers processes, and in this
+    process with match_records. The result holds both medians and the pool's speedup over the serial scan.
+    Starting the pool is not timed: the bot keeps one running between cycles.
+    """
+    synthetic = make_synthetic_reddit(seed=1, submissions=max(1, comments // 100), comments=comments, titles=titles, max_depth=0)
+    catalog = CatalogSnapshot(0, [{'title': title} for title in synthetic.titles])
+    records = [(comment.fullname, str(comment.author).lower(), comment.body.lower()) for comment in synthetic.comments]
+    serial = measure(lambda: match_records(records, catalog.matcher), repeats)
+    pool = ScanPool(catalog, workers, threshold=1)
+    try:
+        pool.scan(records[:pool.chunk_size * workers]) # starts the workers.
+        pooled = measure(lambda: pool.scan(records), repeats)
+    finally:
+        pool.close()
+    result = make_result('scan_pool', {'workers': workers, 'titles': titles, 'comments': comments}, pooled, len(records))
+    result['serial_median_seconds'] = statistics.median(serial)
+    result['speedup'] = result['serial_median_seconds'] / result['median_seconds']
+    return result
+
+def bench_get_formatted_post_body(titles: int, books_per_post: int, repeats: int = 3, posts: int = 1000) -> dict:
+    """
+    Formats posts replies of books_per_post books each, from a catalog of titles books.
+    """
+    entries = [{'title': f"synthetic book {i:06d}", 'author': f"author{i}", 'isbn': f"isbn{i}", 'uri': f"https://example.com/{i}", 'desc': 'summary'}
+               for i in range(titles)]
+    catalog = CatalogSnapshot(0, entries)
+    rb = RedditScanAndReplyBot({'bot_subreddit': 'mock_botsubreddit'}, {'database_name': ':memory:'})
+    rb._reddit = MockReddit(username='test_username', setup=False)
+    rng = random.Random(2)
+    replies = [rng.sample(catalog.titles, min(books_per_post, titles)) for _ in range(posts)]
+
+    def run():
+        for books in replies:
+            rb.get_formatted_post_body(books, catalog)
+
+    return make_result('get_formatted_post_body', {'titles': titles, 'books_per_post': books_per_post}, measure(run, repeats), posts)
+
+def bench_update_opted_in_users(users: int, directory: str, repeats: int = 3, churn: float = 0.01) -> dict:
+    """
+    Updates an opted_in_users table of users users with a list where a churn share of the users changed.
+    Every repeat starts from a fresh copy of the table.
+    """
+    path = make_database(directory, opted_in=users)
+    changed = max(1, int(users * churn))
+    usernames = [f"synthetic_author{i}" for i in range(changed, users + changed)]
+    timings = []
+    for _ in range(repeats):
+        cur = get_sql_cursor(path)
+        cur.execute('DELETE FROM opted_in_users')
+        cur.executemany('INSERT INTO opted_in_users (reddit_username) VALUES (?)', ((f"synthetic_author{i}",) for i in range(users)))
+        cur.connection.commit()
+        timings.extend(measure(lambda: update_opted_in_users(cur, usernames), 1))
+        cur.connection.close()
+    return make_result('update_opted_in_users', {'users': users, 'churn': churn}, timings, users)
+
+def bench_update_replied_entry_table(replied: int, directory: str, repeats: int = 3, entries: int = 100) -> dict:
+    """
+    Updates a replied_entries table of replied rows with entries ids from Reddit, half of them new.
+    Every repeat starts from a fresh copy of the table.
+    """
+    path = make_database(directory, replied=replied)
+    timings = []
+    for repeat in range(repeats):
+        cur = get_sql_cursor(path)
+        cur.execute('DELETE FROM replied_entries WHERE reddit_id LIKE ?', ['new%'])
+        cur.connection.commit()
+        update = {f"r{i}": True for i in range(entries // 2)}
+        update.update({f"new{i}": True for i in range(entries - len(update))})
+        timings.extend(measure(lambda: update_replied_entry_table(cur, update), 1))
+        cur.connection.close()
+    return make_result('update_replied_entry_table', {'replied': replied, 'entries': entries}, timings, entries)
+
+def bench_scrape_reddit(comments: int, titles: int, directory: str, repeats: int = 1, hit_rate: float = 0.01) -> dict:
+    """
+    Runs full scrape_reddit cycles over a synthetic reddit of 100 submissions and comments top level comments,
+    against a database with titles books. Every repeat starts from a fresh database, so it posts the same replies.
+    """
+    synthetic = make_synthetic_reddit(seed=3, submissions=100, comments=comments, titles=titles, hit_rate=hit_rate, max_depth=0)
+    timings = []
+    for repeat in range(repeats):
+        path = make_database(directory, titles=titles)
+        rb = RedditScanAndReplyBot(
+            {'subreddits': synthetic.subreddit_names, 'bot_subreddit': 'mock_botsubreddit'},
+            {'database_name': path},
+            {'SCANNING': {'pool_workers': '1'}}
+        )
+        rb._reddit = synthetic.reddit
+        rb.cur = path
+        cur = rb.cur
+        cur.executemany('INSERT INTO opted_in_users (reddit_username) VALUES (?)', ((user,) for user in synthetic.opted_in_users))
+        cur.connection.commit()
+        timings.extend(measure(rb.scrape_reddit, 1))
+        cur.connection.close()
+        for leftover in glob.glob(path + '*'): # the database and its state snapshot.
+            os.remove(leftover)
+    return make_result('scrape_reddit', {'comments': comments, 'titles': titles, 'hit_rate': hit_rate}, timings, comments + 100)
+
+class _ListingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # the headers and body are written separately.
+    body = json.dumps({'kind': 'Listing', 'data': {'children': [], 'after': None}}).encode('utf-8')
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+def bench_http_requests(pooled: bool, fetchers: int, requests_made: int = 2000, repeats: int = 3) -> dict:
+    """
+    Makes requests_made small requests to a local HTTP server from fetchers threads, either through one session
+    configured by configure_http_session (pooled) or opening a new connection for every request.
+    The server is local and plain HTTP, so this measures the TCP setup saved; against Reddit the TLS handshake adds more.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ListingHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/comments/abc123"
+
+    def run():
+        session = configure_http_session(pool_maxsize=fetchers)
+        fetch = (lambda i: session.get(url, timeout=5).content) if pooled else (lambda i: requests.get(url, timeout=5, headers={'Connection': 'close'}).content)
+        with ThreadPoolExecutor(fetchers) as executor:
+            list(executor.map(fetch, range(requests_made)))
+        session.close()
+
+    try:
+        timings = measure(run, repeats)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return make_result('http_requests', {'pooled': pooled, 'fetchers': fetchers}, timings, requests_made)
+
+def bench_import(module: str, repeats: int = 5) -> dict:
+    """
+    Imports module in a fresh interpreter, as a cron or admin invocation would. The interpreter's own startup is included.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = measure(lambda: subprocess.run([sys.executable, '-c', f"import {module}"], cwd=root, check=True), repeats)
+    return make_result('import', {'module': module}, timings, 1)
+
+def get_scenarios(quick: bool, directory: str) -> list:
+    """
+    Returns the benchmarks to run as a list of (function, kwargs). quick keeps the smallest size of each scenario.
+    """
+    def sizes(*values):
+        return values[:1] if quick else values
+
+    scenarios = []
+    for scan in (bench_scan_entity, bench_scan_entities):
+        scenarios += [(scan, {'titles': titles, 'comments': 10000, 'replied': 1000}) for titles in sizes(10, 100, 1000, 10000)]
+        scenarios += [(scan, {'titles': 1000, 'comments': comments, 'replied': 1000}) for comments in sizes(1000, 10000, 100000)]
+        scenarios += [(scan, {'titles': 1000, 'comments': 10000, 'replied': replied}) for replied in sizes(1000, 100000, 1000000)]
+    scenarios += [(bench_scan_entities, {'titles': 1000, 'comments': 100000, 'replied': 1000, 'opted_in_ratio': ratio}) for ratio in sizes(0.05, 1.0)]
+    scenarios += [(bench_scan_pool, {'workers': workers, 'titles': 10000, 'comments': 20000}) for workers in sizes(2, 4, 8)]
+    scenarios += [(bench_get_formatted_post_body, {'titles': titles, 'books_per_post': books}) for titles in sizes(10, 1000, 10000) for books in (1, 5)]
+    scenarios += [(bench_update_opted_in_users, {'users': users, 'directory': directory}) for users in sizes(100, 1000, 10000)]
+    scenarios += [(bench_update_replied_entry_table, {'replied': replied, 'directory': directory}) for replied in sizes(1000, 100000, 1000000)]
+    scenarios += [(bench_scrape_reddit, {'comments': comments, 'titles': 1000, 'directory': directory}) for comments in sizes(1000, 10000, 100000)]
+    scenarios += [(bench_http_requests, {'pooled': pooled, 'fetchers': fetchers}) for fetchers in sizes(1, 8) for pooled in (False, True)]
+    scenarios += [(bench_import, {'module': module}) for module in ('rsarb.admin', 'rsarb.RedditScanAndReplyBot')]
+    return scenarios
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def run_benchmarks(quick: bool = False, only: str = None) -> dict:
+    """
+    Runs every scenario, or those whose benchmark name contains only.
+    :returns: dict with keys meta and results, as written to the JSON file.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for function, kwargs in get_scenarios(quick, directory):
+            name = function.__name__[len('bench_'):]
+            if only is not None and only not in name:
+                continue
+            result = function(**kwargs)
+            speedup = f"{result['speedup']:>8.2f}x" if 'speedup' in result else ''
+            print(f"{name:<28}{json.dumps(result['params']):<60}{result['median_seconds']:>10.4f}s{speedup}", flush=True)
+            results.append(result)
+    return {
+        'meta': {
+            'git_commit': get_git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'quick': quick
+        },
+        'results': results
+    }
+
+def compare_results(previous: dict, current: dict) -> list:
+    """
+    Matches the results of two runs by benchmark and params.
+    :returns: list[tuple(benchmark, params, previous median, current median, current / previous)] for results present in both.
+    """
+    def key(result):
+        return result['benchmark'], json.dumps(result['params'], sort_keys=True)
+
+    before = {key(result): result for result in previous['results']}
+    comparison = []
+    for result in current['results']:
+        if key(result) in before:
+            old = before[key(result)]['median_seconds']
+            comparison.append((result['benchmark'], result['params'], old, result['median_seconds'], result['median_seconds'] / old if old else None))
+    return comparison
+
+def main(args):
+    report = run_benchmarks(args.quick, args.only)
+    if args.output is not None:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as fd:
+            previous = json.load(fd)
+        print(f"\nCompared with {previous['meta'].get('git_commit') or args.compare}:")
+        for benchmark, params, old, new, ratio in compare_results(previous, report):
+            print(f"{benchmark:<28}{json.dumps(params):<60}{old:>10.4f}s{new:>10.4f}s{ratio:>8.2f}x")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the bot's scanning, formatting and database helpers.")
+    parser.add_argument('--output', '-o', dest='output', required=False, metavar="./results.json", help="Write the results to this JSON file.")
+    parser.add_argument('--compare', dest='compare', required=False, metavar="./previous.json", help="Compare with the results of an earlier run.")
+    parser.add_argument('--quick', dest='quick', required=False, action='store_true', help="Only run the smallest size of each scenario.")
+    parser.add_argument('--only', dest='only', required=False, metavar="scan_entity", help="Only run benchmarks whose name contains this.")
+    main(parser.parse_args())
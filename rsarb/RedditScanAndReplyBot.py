@@ -1,21 +1,62 @@
 import argparse
+import json
+import logging
 import os
+import signal
+import socket
 import sqlite3
+import sys
+import threading
 import time
 from configparser import ConfigParser, NoSectionError
+from typing import TYPE_CHECKING
 
-import praw  # type: ignore
-import schedule
-
+# praw, prawcore, requests and schedule are only imported by the code paths that talk to Reddit or run the bot,
+# so that administrative commands start quickly, see admin.py.
+from .util.api_stats_funcs import ApiCallStats  # type: ignore
 from .util.praw_funcs import (connect_to_reddit, get_comments,  # type: ignore
-                             get_submission, get_submissions,
+                             get_entity, get_submission, get_submissions,
                              get_thread_commenters, get_user_replied_entities,
-                             post_comment, scan_entity)
-from .util.sql_funcs import (add_replied_entry, create_database,  # type: ignore
-                            get_book_db_entry, get_books, get_opted_in_users,
-                            get_replied_entries, get_sql_cursor,
-                            update_opted_in_users, update_replied_entry_table)
+                             post_comment)
+from .util.backfill_funcs import backfill  # type: ignore
+from .util.breaker_funcs import CircuitBreaker  # type: ignore
+from .util.catalog_funcs import BookCatalog, format_import_result, import_catalog_file  # type: ignore
+from .util.metrics_funcs import REGISTRY, start_metrics_server  # type: ignore
+from .util.priority_funcs import PriorityQueue, get_priority  # type: ignore
+from .util.profile_funcs import CycleProfiler  # type: ignore
+from .util.shard_funcs import Coordinator  # type: ignore
+from .util.state_funcs import BotState, get_state_snapshot_path  # type: ignore
+from .util.scan_funcs import EntityRecord, ScanPool, scan_entities  # type: ignore
+from .util.sql_funcs import (acquire_job_lease, add_replied_entry,  # type: ignore
+                            add_reply_latency, claim_reply, create_database,
+                            ensure_replied_entries_index, ensure_reply_claims_table,
+                            get_job_lease, get_reply_latency_report,
+                            get_sql_cursor, record_job_run, release_job_lease,
+                            release_reply_claim, update_opted_in_users,
+                            update_replied_entry_table)
+
+if TYPE_CHECKING:
+    import praw  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+CYCLE_SECONDS = REGISTRY.histogram('rsarb_cycle_seconds', 'Time taken by a full scrape_reddit cycle.')
+SCAN_SECONDS_PER_ITEM = REGISTRY.histogram('rsarb_scan_seconds_per_item', 'Average scan time per item, observed once per cycle.',
+                                           buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
+ITEMS_TOTAL = REGISTRY.counter('rsarb_items_total', 'Comments and submissions handled, by stage.', ('stage',))
+REPLY_LATENCY_SECONDS = REGISTRY.histogram('rsarb_reply_latency_seconds', 'Time from a post or comment being created to the reply, split by stage.', ('stage',),
+                                           buckets=(1, 5, 15, 30, 60, 90, 120, 300, 600, 1800, 3600, 21600, 86400))
+JOB_SECONDS = REGISTRY.histogram('rsarb_job_seconds', 'Time taken by scheduled jobs other than the scrape cycle.', ('job',))
 
+def config_bool(value: str) -> bool:
+    """
+    Converts a config file setting to a bool, accepting the same values as ConfigParser.getboolean.
+    :raises ValueError: if value is not a boolean.
+    """
+    lowered = value.strip().lower()
+    if lowered not in ConfigParser.BOOLEAN_STATES:
+        raise ValueError(f"Not a boolean: {value}")
+    return ConfigParser.BOOLEAN_STATES[lowered]
 
 class RedditScanAndReplyBot:
     """
@@ -47,14 +88,57 @@ class RedditScanAndReplyBot:
 
         except NoSectionError as err:
             raise Exception(f"{init_file} does not contain the valid sections.")
+
+        # any other sections hold optional tuning settings, see get_option.
+        options = {section: {k:v for k, v in parser.items(section)} for section in parser.sections() if section not in ('PRAW', 'DATABASE')}
         
-        return cls(praw_config, database_config)
+        return cls(praw_config, database_config, options)
     
-    def __init__(self, praw_config=None, database_config=None):
+    def __init__(self, praw_config=None, database_config=None, options=None):
         self._praw_config = praw_config
         self._database_config = database_config
+        self._options = options if options is not None else {}
         self._cursor = None
         self._reddit = None
+        self._scan_pool = None
+        self.catalog = BookCatalog()
+        self.api_stats = ApiCallStats()
+        self.last_cycle_api_stats = None
+        # identifies this process in reply claims, so that bots sharing a database never reply to the same entity twice.
+        self.worker_id = self.get_option('CLAIMS', 'owner', f"{socket.gethostname()}:{os.getpid()}")
+        self.claim_lease_seconds = self.get_option('CLAIMS', 'lease_seconds', 600, float)
+        # whole-table jobs run by one bot at a time among those sharing the database, see run_singleton_jobs.
+        self.job_lease_seconds = self.get_option('LEASES', 'lease_seconds', 180, float)
+        self.job_heartbeat_seconds = self.get_option('LEASES', 'heartbeat_seconds', 60, float)
+        self.singleton_jobs = {
+            'repopulate_opted_in_users': (self.repopulate_opted_in_users, self.get_option('LEASES', 'repopulate_opted_in_users', 3600, float)),
+            'repopulate_replied_entries': (self.repopulate_replied_entries, self.get_option('LEASES', 'repopulate_replied_entries', 0, float))
+            }
+        self.held_job_leases = set() # jobs whose lease this bot holds, renewed by the lease heartbeat, see renew_job_leases.
+        self._job_lease_lock = threading.Lock()
+        self._lease_heartbeat = None
+        self._lease_heartbeat_stop = threading.Event()
+        self.stopping = threading.Event() # set by request_stop, see run.
+        self.stop_deadline = None
+        self.drain_seconds = self.get_option('SHUTDOWN', 'drain_seconds', 20, float)
+        self.state = BotState() # replied entries, opted in users and comment counts, see load_state.
+        self.subreddits_provider = None # optional callable returning the subreddits to scan, see get_subreddits.
+        self.session = None # optional requests Session for the Reddit connection, e.g. a RecordingSession or ReplaySession.
+        self.metrics_port = self.get_option('METRICS', 'port', None, int) # port run() serves metrics on, None for none.
+        self.cycle_seconds = self.get_option('NETWORK', 'cycle_seconds', 0, float)
+        self.rescan_seconds = self.get_option('STATE', 'rescan_seconds', 300, float)
+        self.breaker = CircuitBreaker(self.get_option('BREAKER', 'failure_threshold', 3, int), self.get_option('BREAKER', 'reset_seconds', 300, float))
+        # the order threads are fetched and replies are posted in, see get_priority.
+        self.freshness_weight = self.get_option('SCHEDULING', 'freshness_weight', 1.0, float)
+        self.activity_weight = self.get_option('SCHEDULING', 'activity_weight', 0.5, float)
+        self.half_life_seconds = self.get_option('SCHEDULING', 'half_life_seconds', 3600, float)
+        self.profiler = CycleProfiler(
+            self.get_option('PROFILING', 'directory', './profiles'),
+            self.get_option('PROFILING', 'every', 0, int),
+            self.get_option('PROFILING', 'tracemalloc', False, config_bool),
+            self.get_option('PROFILING', 'top', 25, int),
+            self.get_option('PROFILING', 'keep', 20, int)
+            )
 
     def initalize_database(self):
         """
@@ -69,6 +153,24 @@ class RedditScanAndReplyBot:
         except (sqlite3.ProgrammingError, sqlite3.OperationalError) as e:
             raise e 
         
+    def import_catalog(self, catalog_file: str, batch_size: int = 5000) -> dict:
+        """
+        Bulk loads a CSV or JSONL catalog file into the books table.
+        Existing books (matched on title) are updated, new ones are inserted. Invalid rows are skipped and reported.
+        The catalog revision is bumped, so running bots rebuild their cached catalog on their next cycle.
+        :param catalog_file: str path to a .csv, .jsonl or .ndjson file.
+        :param batch_size: number of rows written per batch.
+        :returns: dict with keys written (int distinct titles), rejected (list[CatalogRowError]), seconds (float) and books_per_second (float).
+        :raises FileNotFoundError: if the catalog file does not exist.
+        :raises sqlite3.* Exceptions: if the rows cannot be written. Nothing is written in that case.
+        """
+        if self._cursor is None:
+            self.cur = self.configs['DATABASE']['database_name']
+
+        result = import_catalog_file(self.cur, catalog_file, batch_size)
+        self.catalog.invalidate()
+        return result
+
     def setup(self):
         """
         Connects to SQL database and Reddit using pre-set configuration data.
@@ -81,81 +183,544 @@ class RedditScanAndReplyBot:
             raise Exception("No PRAW configuration specified. Cannot connect to Reddit.")
 
         self.cur = self.configs['DATABASE']['database_name']
+        ensure_replied_entries_index(self.cur)
+        ensure_reply_claims_table(self.cur)
+        self.cur.connection.commit()
+        self.reddit = self.configs['PRAW']
+        self.load_state()
+
+    def setup_replay(self, cassette: str, realtime: bool = False):
+        """
+        Connects like setup, but answers Reddit's requests from a cassette recorded with --record (see ReplaySession),
+        and works on an in-memory copy of the database with the state snapshot disabled. Replies and claims made while
+        replaying are written to the copy only, so the database and its snapshot are left as they were.
+        :param cassette: str path of the cassette.
+        :param realtime: bool, take as long to answer each request as Reddit did.
+        :raises Exception: if database name not set or praw configuration not set.
+        """
+        if self.configs['DATABASE']['database_name'] is None:
+            raise Exception("No database name specified. Cannot connect to database.")
+
+        if self.configs['PRAW'] is None:
+            raise Exception("No PRAW configuration specified. Cannot connect to Reddit.")
+        from .util.requestor_funcs import ReplaySession  # type: ignore
+
+        source = get_sql_cursor(self.configs['DATABASE']['database_name'])
+        self._cursor = get_sql_cursor(':memory:')
+        try:
+            source.connection.backup(self._cursor.connection)
+        finally:
+            source.connection.close()
+        ensure_reply_claims_table(self._cursor)
+        self._options.setdefault('STATE', {})['snapshot'] = 'false'
+        self.session = ReplaySession(cassette, realtime)
         self.reddit = self.configs['PRAW']
 
     def  scrape_reddit(self):
         """
         Retrieves latest posts from tracked subreddits, scans them for keywords, and then posts the relevant replies.
         This is the main loop of this program.
+        The requests made to Reddit during the run are left in last_cycle_api_stats, see ApiCallStats.summary.
         """
+        with CYCLE_SECONDS.time(), self.profiler.profile('scrape_reddit'):
+            self._scrape_reddit()
+        if self.profiler.last_profile is not None:
+            logger.info("Profiled cycle written to %s", self.profiler.last_profile[1])
+            self.profiler.last_profile = None
 
-        submissions = get_submissions(self.reddit, self.configs['PRAW']['subreddits'])
-        comments = {}
+    def _scrape_reddit(self):
+        self.api_stats.reset()
+        subreddits = self.get_subreddits()
+        if not subreddits:
+            logger.info("No subreddits to scan this cycle.")
+            return
+        cycle_deadline = time.monotonic() + self.cycle_seconds if self.cycle_seconds else None
         books_to_post = {}
-        books = get_books(self.cur)
-        replied_entries = get_replied_entries(self.cur)
-        opted_in_users = get_opted_in_users(self.cur)
-
-        # scrape each submission title and selftext for hits, then scrape each reply within the submission.
-        for submission in submissions:
-            books_to_post[submission] = scan_entity(submission, books, replied_entries, opted_in_users)
-            comments[submission] = get_comments(submission)
-            for comment in comments[submission]:
-                books_to_post[comment] = scan_entity(comment, books, replied_entries, opted_in_users)
-
-        #For each hit, reply to the post with a formatted post body.
-        posted = {}
-        for reddit_post in books_to_post:
-            if books_to_post[reddit_post] is None or len(books_to_post[reddit_post]) == 0:
+        catalog = self.catalog.snapshot(self.cur)
+        self.state.refresh(self.cur)
+        self.state.check_matcher(catalog.matcher.fingerprint)
+        replied_entries = self.state.replied_entries
+        opted_in_users = self.state.opted_in_users
+
+        # copy each submission and the replies within it into detached records, then let the PRAW objects go.
+        # Only the listing and comment fetches should reach Reddit; requests while copying or scanning are lazy fetches.
+        # The comments of submissions whose comment count has not changed since they were last scanned are not fetched again,
+        # until [STATE] rescan_seconds have passed, see BotState.has_new_comments.
+        records = {}
+        threads = {} # fullname -> fullname of the submission it was fetched with.
+        # merged into copies of the counts of earlier cycles, so a listing that fails or is cut short does not
+        # make the next cycle fetch every thread again. Dropping a count makes the next cycle fetch the thread.
+        comment_counts = dict(self.state.comment_counts)
+        scanned_utc = dict(self.state.scanned_utc)
+        activity = {} # submission fullname -> comments added since it was last scanned.
+        fetch_queue = PriorityQueue()
+        now = time.time()
+        for submission in self.iter_submissions(subreddits):
+            if self.stopping.is_set():
+                logger.info("Stopping, no more threads are fetched this cycle.")
+                break
+            if cycle_deadline is not None and time.monotonic() > cycle_deadline:
+                # the threads not fetched have no comment count recorded, so they are fetched next cycle.
+                logger.warning("Cycle time budget of %gs used up, no more threads are fetched this cycle.", self.cycle_seconds)
+                break
+            with self.api_stats.scanning():
+                record = EntityRecord.from_entity(submission)
+                num_comments = getattr(submission, 'num_comments', None)
+            records[record.fullname] = threads[record.fullname] = record
+            if num_comments is not None:
+                comment_counts[record.fullname] = num_comments
+                activity[record.fullname] = num_comments - self.state.comment_counts.get(record.fullname, 0)
+            if not self.state.has_new_comments(record.fullname, num_comments, now, self.rescan_seconds):
+                scanned_utc[record.fullname] = self.state.scanned_utc.get(record.fullname, 0.0)
+                ITEMS_TOTAL.inc(stage='unchanged_submission')
+                continue
+            fetch_queue.push((record, submission), self.get_priority(record.created_utc, activity.get(record.fullname, 0), now))
+
+        # fetch the freshest and most active threads first, so that a backlog delays the threads that matter least.
+        while fetch_queue:
+            if self.stopping.is_set() or (cycle_deadline is not None and time.monotonic() > cycle_deadline):
+                logger.warning("Stopping or out of time, the comments of %d threads are fetched next cycle.", len(fetch_queue))
+                for record, submission in fetch_queue.drain():
+                    comment_counts.pop(record.fullname, None)
+                break
+            record, submission = fetch_queue.pop()
+            target = ('comments', record.subreddit)
+            if not self.breaker.allow(target):
+                ITEMS_TOTAL.inc(stage='circuit_open')
+                comment_counts.pop(record.fullname, None) # fetched once the circuit closes.
                 continue
-            post_body = self.get_formatted_post_body(books_to_post[reddit_post])
-            posted[reddit_post] = post_comment(self.reddit, reddit_post, post_body)
+            try:
+                comments = get_comments(submission)
+            except Exception as e:
+                logger.warning("Could not fetch the comments of %s in r/%s: %r", record.fullname, record.subreddit, e)
+                self.breaker.record_failure(target)
+                ITEMS_TOTAL.inc(stage='fetch_failed')
+                comment_counts.pop(record.fullname, None)
+                continue
+            self.breaker.record_success(target)
+            scanned_utc[record.fullname] = now
+            with self.api_stats.scanning():
+                for comment in comments:
+                    comment_record = EntityRecord.from_entity(comment)
+                    records[comment_record.fullname] = comment_record
+                    threads[comment_record.fullname] = record
+        submission = comments = None
+        ITEMS_TOTAL.inc(len(records), stage='fetched')
+
+        # scan each submission title and selftext, and each comment body, for hits.
+        pool = self.get_scan_pool(catalog, len(records))
+        scan_start = time.perf_counter()
+        with self.api_stats.scanning():
+            matches = scan_entities(records.values(), catalog.matcher, replied_entries, opted_in_users, pool)
+        if records:
+            SCAN_SECONDS_PER_ITEM.observe((time.perf_counter() - scan_start) / len(records))
+        ITEMS_TOTAL.inc(len(matches), stage='scanned')
+        reply_queue = PriorityQueue()
+        for fullname in matches:
+            record = records[fullname]
+            books_to_post[record] = matches[fullname]
+            if books_to_post[record]:
+                thread = threads[fullname].fullname
+                reply_queue.push(record, self.get_priority(record.created_utc, activity.get(thread, 0), now))
+
+        #For each hit, reply to the post with a formatted post body, freshest and most active threads first.
+        while reply_queue:
+            record = reply_queue.pop()
+            ITEMS_TOTAL.inc(stage='matched')
+            if (self.stopping.is_set() and time.monotonic() > self.stop_deadline) or (cycle_deadline is not None and time.monotonic() > cycle_deadline):
+                # out of time to drain, or past the cycle's time budget. Left unclaimed, so it is replied to after the restart or next cycle.
+                ITEMS_TOTAL.inc(stage='deferred')
+                comment_counts.pop(threads[record.fullname].fullname, None)
+                continue
+            target = ('post', record.subreddit)
+            if not self.breaker.allow(target):
+                ITEMS_TOTAL.inc(stage='circuit_open')
+                comment_counts.pop(threads[record.fullname].fullname, None)
+                continue
+            if not claim_reply(self.cur, record.id, self.worker_id, self.claim_lease_seconds):
+                # another bot sharing the database is replying to it, or already has.
+                ITEMS_TOTAL.inc(stage='claimed_elsewhere')
+                comment_counts.pop(threads[record.fullname].fullname, None) # look at it again next cycle.
+                continue
+            post_body = self.get_formatted_post_body(books_to_post[record], catalog)
+            post_started_utc = time.time()
+            try:
+                posted = post_comment(self.reddit, get_entity(self.reddit, record.fullname), post_body)
+            except Exception as e:
+                # not given a deadline: a reply given up on might still be posted, and then be posted twice.
+                ITEMS_TOTAL.inc(stage='failed')
+                release_reply_claim(self.cur, record.id, self.worker_id)
+                logger.warning("Could not reply to %s in r/%s: %r", record.fullname, record.subreddit, e)
+                self.breaker.record_failure(target)
+                comment_counts.pop(threads[record.fullname].fullname, None)
+                continue
+            self.breaker.record_success(target)
+            # record the reply straight away, so that stopping can never leave a reply posted but not recorded.
+            add_replied_entry(self.cur, record.id, posted)
+            release_reply_claim(self.cur, record.id, self.worker_id)
+            ITEMS_TOTAL.inc(stage='posted' if posted else 'failed')
+            if posted:
+                self.record_reply_latency(record, post_started_utc, time.time())
+                if threads[record.fullname].fullname in comment_counts:
+                    comment_counts[threads[record.fullname].fullname] += 1 # the reply itself is not worth fetching the comments again.
+        # threads last fetched rescan_seconds ago are fetched again whatever their count, so their counts can go.
+        # This bounds the cache to the threads fetched in the last rescan_seconds.
+        self.state.comment_counts = {
+            fullname: count for fullname, count in comment_counts.items()
+            if now - scanned_utc.get(fullname, 0.0) < self.rescan_seconds
+        }
+        self.state.scanned_utc = {fullname: scanned_utc.get(fullname, 0.0) for fullname in self.state.comment_counts}
+
+        self.last_cycle_api_stats = self.api_stats.summary()
+        logger.info("Cycle made %d Reddit requests over %d new connections in %.2fs: %s", self.last_cycle_api_stats['total'],
+                    self.last_cycle_api_stats['connections'], self.last_cycle_api_stats['seconds'], self.last_cycle_api_stats['by_caller'])
+        if self.last_cycle_api_stats['lazy_fetches']:
+            logger.warning("Lazy fetches while scanning: %s", self.last_cycle_api_stats['lazy_fetches'])
+        if self.breaker.get_open_targets():
+            logger.warning("Circuits open after this cycle: %s", self.breaker.get_open_targets())
+
+    def get_priority(self, created_utc: float, activity: int, now: float) -> float:
+        """
+        Scores fetching a thread or replying in it with the [SCHEDULING] weights, see priority_funcs.get_priority.
+        :param created_utc: float unix timestamp the submission or comment was created at.
+        :param activity: int comments added to its thread since the last cycle.
+        :param now: float unix timestamp of the start of the cycle.
+        """
+        return get_priority(created_utc, activity, now, self.freshness_weight, self.activity_weight, self.half_life_seconds)
+
+    def iter_submissions(self, subreddits: str):
+        """
+        Yields the newest submissions of subreddits, see get_submissions.
+        The listing is guarded by the circuit breaker: while its circuit is open nothing is listed, and if listing fails
+        the submissions listed before the failure are kept.
+        :param subreddits: str subreddit names joined by '+'.
+        """
+        target = ('listing', subreddits)
+        if not self.breaker.allow(target):
+            logger.warning("Not listing %s, its circuit is open.", subreddits)
+            return
+        try:
+            for submission in get_submissions(self.reddit, subreddits):
+                yield submission
+        except Exception as e:
+            logger.warning("Could not list %s: %r", subreddits, e)
+            self.breaker.record_failure(target)
+            return
+        self.breaker.record_success(target)
+
+    def get_state_path(self):
+        """
+        Returns the path of the state snapshot file: [STATE] path, by default next to the database file.
+        Returns None if [STATE] snapshot is false or the database is in memory.
+        """
+        if not self.get_option('STATE', 'snapshot', True, config_bool):
+            return None
+        path = self.get_option('STATE', 'path')
+        if path is not None:
+            return path
+        database_name = self.configs['DATABASE'] and self.configs['DATABASE'].get('database_name')
+        if not database_name or database_name == ':memory:':
+            return None
+        return get_state_snapshot_path(database_name)
+
+    def load_state(self) -> bool:
+        """
+        Loads the state snapshot written by save_state when the bot last stopped, if the database has not changed since.
+        Otherwise the state is read from the database on the first cycle.
+        :returns: True if the snapshot was loaded.
+        """
+        path = self.get_state_path()
+        state = BotState.load(path, self.cur) if path is not None else None
+        if state is None:
+            return False
+        self.state = state
+        logger.info("Loaded state snapshot %s: %d replied entries, %d opted in users, %d submissions with known comment counts.",
+                    path, len(state.replied_entries), len(state.opted_in_users), len(state.comment_counts))
+        return True
+
+    def save_state(self) -> None:
+        """
+        Writes the state to its snapshot file, see get_state_path. Called when the bot stops.
+        """
+        path = self.get_state_path()
+        if path is None or not self.state.marks:
+            return
+        try:
+            self.state.refresh(self.cur) # picks up this bot's own writes since the last cycle.
+            self.state.save(path)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Could not write state snapshot %s: %s", path, e)
+
+    def backfill(self, dump_files: list, batch_size: int = 20000, progress=None) -> dict:
+        """
+        Scans Reddit dump files (newline-delimited JSON, optionally .gz or .zst compressed) for the catalog's titles,
+        in a pool of [SCANNING] pool_workers processes. Nothing is posted. See backfill_funcs.backfill.
+        :param dump_files: list of str paths.
+        :param batch_size: number of items scanned at a time. Bounds memory use.
+        :param progress: optional callable, called after each batch with (items scanned so far, seconds elapsed).
+        :returns: dict of aggregated mentions per title, see backfill_funcs.backfill.
+        """
+        if self._cursor is None:
+            self.cur = self.configs['DATABASE']['database_name']
+        catalog = self.catalog.snapshot(self.cur)
+        workers = self.get_option('SCANNING', 'pool_workers', 1, int)
+        pool = ScanPool(catalog, workers, threshold=1) if workers > 1 else None
+        try:
+            return backfill(dump_files, catalog.matcher, pool, batch_size, progress)
+        finally:
+            if pool is not None:
+                pool.close()
+
+    def record_reply_latency(self, record: EntityRecord, post_started_utc: float, posted_utc: float) -> None:
+        """
+        Stores how long a successful reply took, from the entity being created to the reply being posted, see get_reply_latency_report.
+        :param record: EntityRecord replied to.
+        :param post_started_utc: float unix timestamp posting the reply started at.
+        :param posted_utc: float unix timestamp the reply was posted at.
+        """
+        add_reply_latency(self.cur, record.id, record.subreddit, record.created_utc, record.fetched_utc, post_started_utc, posted_utc)
+        REPLY_LATENCY_SECONDS.observe(record.fetched_utc - record.created_utc, stage='poll')
+        REPLY_LATENCY_SECONDS.observe(post_started_utc - record.fetched_utc, stage='queue')
+        REPLY_LATENCY_SECONDS.observe(posted_utc - post_started_utc, stage='post')
+        REPLY_LATENCY_SECONDS.observe(posted_utc - record.created_utc, stage='total')
 
-        #for each post, add to the list of posts that have been replied to.
-        for post in posted:
-            add_replied_entry(self.cur, post.id, posted[post])
+    def get_latency_report(self, days: float = 7) -> dict:
+        """
+        Returns p50/p95/p99 reply latency per subreddit over the last days days, see get_reply_latency_report.
+        :param days: float size of the rolling window, in days.
+        :returns: dict[subreddit] = {'count': int, 'total'|'poll'|'queue'|'post': dict[percent] = seconds}
+        """
+        if self._cursor is None:
+            self.cur = self.configs['DATABASE']['database_name']
+        return get_reply_latency_report(self.cur, time.time() - days * 86400)
 
     def run(self):
         """
         Schedules and runs periodic tasks. This is the main loop.
         """
-        schedule.every(1).minutes.do(self.scrape_reddit)
-        schedule.every().hour.do(self.repopulate_opted_in_users)
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        if self.metrics_port is not None:
+            server = start_metrics_server(self.metrics_port, self.get_option('METRICS', 'host', '127.0.0.1'))
+            logger.info("Serving metrics at http://%s:%d/metrics", *server.server_address[:2])
+        if hasattr(signal, 'SIGUSR1'):
+            # kill -USR1 <pid> profiles the next cycle, see CycleProfiler.
+            signal.signal(signal.SIGUSR1, self.profiler.request)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.request_stop)
+        import schedule
+
+        self.schedule_jobs(schedule)
+        try:
+            while not self.stopping.is_set():
+                schedule.run_pending()
+                self.stopping.wait(1)
+        finally:
+            self.shutdown()
+
+    def request_stop(self, *args) -> None:
+        """
+        Asks the bot to stop. Takes and ignores any arguments, so it can be used as a signal handler.
+        A cycle in progress fetches no more threads, and keeps replying to what it found for up to
+        [SHUTDOWN] drain_seconds (default 20). Then run returns, see shutdown.
+        """
+        if self.stopping.is_set():
+            return
+        self.stop_deadline = time.monotonic() + self.drain_seconds
+        self.stopping.set()
+        logger.info("Stopping within %ss.", self.drain_seconds)
+
+    def shutdown(self) -> None:
+        """
+        Commits anything pending, releases the job leases and checkpoints the state, see save_state.
+        Then stops the scan pool and closes the Reddit session, which finishes a cassette being recorded.
+        """
+        if self._cursor is not None:
+            self.cur.connection.commit()
+        self.release_job_leases()
+        self.save_state()
+        if self._scan_pool is not None:
+            self._scan_pool.close()
+            self._scan_pool = None
+        if self.session is not None:
+            self.session.close()
+
+    def schedule_jobs(self, scheduler) -> None:
+        """
+        Adds this bot's periodic tasks to scheduler.
+        :param scheduler: the schedule module, or a schedule.Scheduler shared with other bots, see TenantRuntime.
+        """
+        scheduler.every(1).minutes.do(self.scrape_reddit)
+        scheduler.every(self.job_heartbeat_seconds).seconds.do(self.run_singleton_jobs)
+        self.start_lease_heartbeat()
+
+    def run_singleton_jobs(self, now: float = None) -> list:
+        """
+        Runs the whole-table jobs in singleton_jobs that are due, if this bot holds their lease.
+        Of the bots sharing a database only the lease holder runs a job; the others read its results from the database.
+        Called every heartbeat_seconds. The leases held are renewed from a thread of their own (see start_lease_heartbeat),
+        so a long scrape cycle or job does not let them expire. If the holder dies, another bot takes a job over
+        at its first heartbeat after the lease expires, so within lease_seconds + heartbeat_seconds.
+        A job that raises is logged and recorded as run, so it is retried after its interval and the jobs after it still run.
+        A job with an interval of 0 is disabled.
+        :param now: float unix timestamp to use as the current time. Defaults to time.time().
+        :returns: list of the names of the jobs run, including those that failed.
+        """
+        ran = []
+        for job, (function, interval) in self.singleton_jobs.items():
+            if interval <= 0:
+                continue
+            current = time.time() if now is None else now
+            with self._job_lease_lock:
+                acquired = acquire_job_lease(self.cur, job, self.worker_id, self.job_lease_seconds, current)
+                if acquired:
+                    self.held_job_leases.add(job)
+                else:
+                    self.held_job_leases.discard(job)
+            if not acquired:
+                continue
+            if current - get_job_lease(self.cur, job)['last_run_utc'] < interval:
+                continue
+            logger.info("Running %s as the holder of its lease.", job)
+            try:
+                function()
+            except Exception:
+                logger.exception("Singleton job %s failed.", job)
+            if not record_job_run(self.cur, job, self.worker_id, now):
+                logger.warning("Lost the lease on %s while running it.", job)
+            ran.append(job)
+        return ran
+
+    def renew_job_leases(self, session: sqlite3.Cursor = None, now: float = None) -> None:
+        """
+        Renews the leases this bot holds. Leases another bot has taken over in the meantime are dropped.
+        :param session: sqlite3.Cursor to renew them with. Defaults to the bot's own cursor.
+        :param now: float unix timestamp to use as the current time. Defaults to time.time().
+        """
+        session = self.cur if session is None else session
+        with self._job_lease_lock:
+            for job in list(self.held_job_leases):
+                if not acquire_job_lease(session, job, self.worker_id, self.job_lease_seconds, now):
+                    logger.warning("Lost the lease on %s to another bot.", job)
+                    self.held_job_leases.discard(job)
+
+    def start_lease_heartbeat(self) -> None:
+        """
+        Starts a thread renewing the leases held every [LEASES] heartbeat_seconds, on a database connection of its own,
+        see renew_job_leases. It runs until shutdown. An in-memory database cannot be shared with the thread,
+        so its leases are only renewed by run_singleton_jobs.
+        """
+        database = self._database_config.get('database_name') if self._database_config else None
+        if self._lease_heartbeat is not None or database in (None, ':memory:'):
+            return
+        self._lease_heartbeat_stop.clear()
+        self._lease_heartbeat = threading.Thread(target=self._heartbeat_job_leases, args=(database,),
+                                                 name=f'lease-heartbeat-{self.worker_id}', daemon=True)
+        self._lease_heartbeat.start()
+
+    def _heartbeat_job_leases(self, database: str) -> None:
+        session = get_sql_cursor(database)
+        try:
+            while not self._lease_heartbeat_stop.wait(self.job_heartbeat_seconds):
+                try:
+                    self.renew_job_leases(session)
+                except sqlite3.Error:
+                    logger.exception("Could not renew the job leases, retrying in %ss.", self.job_heartbeat_seconds)
+        finally:
+            session.connection.close()
+
+    def release_job_leases(self) -> None:
+        """
+        Stops the lease heartbeat and releases the leases this bot holds, so that another bot takes the jobs over at its next heartbeat.
+        """
+        self._lease_heartbeat_stop.set()
+        if self._lease_heartbeat is not None:
+            self._lease_heartbeat.join()
+            self._lease_heartbeat = None
+        if self._cursor is None:
+            return
+        with self._job_lease_lock:
+            self.held_job_leases.clear()
+            for job in self.singleton_jobs:
+                release_job_lease(self.cur, job, self.worker_id)
 
-    def get_formatted_post_body(self, books_to_post: list) -> str:
+    def get_formatted_post_body(self, books_to_post: list, catalog=None) -> str:
         """
         Takes a list of books to be posted.
         Returns a Reddit Markdown formatted post body with book information and header/footer.
         
         :param books_to_post: list of books as string.
+        :param catalog: optional CatalogSnapshot to look the books up in. Defaults to the current snapshot.
         :returns: Formatted string representing post body to be posted as a reply on Reddit.
         """
+        if catalog is None:
+            catalog = self.catalog.snapshot(self.cur)
         header = f"Hello, I am {self.reddit.user.me()}. I am a bot that posts information on books that you have mentioned.\n\n------------------------\n"
         
         body = ""
         for book in books_to_post:
-            book_info = get_book_db_entry(self.cur, book)
-            book_info_formatted = '\n\n'.join([
-                f"Title:  {book_info['title']}",
-                f"Author: {book_info['author']}",
-                f"ISBN:   {book_info['isbn']}",
-                f"URI:    {book_info['uri']}"
-            ])
-            body = body + book_info_formatted + '\n\n------------------------\n\n' 
+            body = body + catalog.get_book_block(book) + '\n\n------------------------\n\n' 
 
         footer = f"This post was made by a bot.\nFor more information, or to give feedback or suggestions, please visit /r/{self.configs['PRAW']['bot_subreddit']}."
         formatted_body = '\n'.join([header,body,footer])
         return formatted_body
 
+    def get_scan_pool(self, catalog, batch_size: int):
+        """
+        Returns the process pool to scan a batch of batch_size records with, or None to scan in this process.
+        The pool is started the first time a batch reaches [SCANNING] pool_threshold records (default 2000),
+        with [SCANNING] pool_workers processes (default 1, which disables the pool).
+        It is restarted when the catalog titles change.
+        :param catalog: the CatalogSnapshot being scanned against.
+        :param batch_size: int number of records in the batch.
+        :returns: ScanPool or None.
+        """
+        workers = self.get_option('SCANNING', 'pool_workers', 1, int)
+        threshold = self.get_option('SCANNING', 'pool_threshold', 2000, int)
+        if workers < 2 or batch_size < threshold:
+            return None
+
+        if self._scan_pool is not None and self._scan_pool.fingerprint != catalog.matcher.fingerprint:
+            self._scan_pool.close()
+            self._scan_pool = None
+        if self._scan_pool is None:
+            self._scan_pool = ScanPool(catalog, workers, threshold)
+        return self._scan_pool
+
+    def get_subreddits(self) -> str:
+        """
+        Returns the subreddits to scan, joined with '+'. These are [PRAW] subreddits unless subreddits_provider is set,
+        e.g. by a Coordinator worker scanning only its shard.
+        """
+        if self.subreddits_provider is not None:
+            return self.subreddits_provider()
+        return self.configs['PRAW']['subreddits']
+
+    def get_option(self, section: str, key: str, default=None, cast=str):
+        """
+        Returns an optional setting from the config file, or default if it is not set.
+        :param section: str config file section, e.g. 'SCANNING'.
+        :param key: str key within the section.
+        :param default: value returned if the setting is absent.
+        :param cast: callable applied to the setting's string value, e.g. int.
+        :raises Exception: if the setting cannot be converted with cast.
+        """
+        value = self._options.get(section, {}).get(key)
+        if value is None:
+            return default
+        try:
+            return cast(value)
+        except ValueError:
+            raise Exception(f"Config setting [{section}] {key} = {value} is not valid.")
+
     def repopulate_opted_in_users(self):
         """
         Connects to reddit, scrapes the opt-in thread for usersnames, then adds them to the opted_in_users table.
         :raises Exception: if praw is not connected to reddit.
         :raises Exception: if sql database is not connected.
         """
+        with JOB_SECONDS.time(job='repopulate_opted_in_users'):
+            self._repopulate_opted_in_users()
+
+    def _repopulate_opted_in_users(self):
         submission = get_submission(self.reddit, URI=self.configs['PRAW']['opt_in_thread'])
 
         if submission is None:
@@ -183,10 +748,11 @@ class RedditScanAndReplyBot:
         configs = {}
         configs['DATABASE'] = self._database_config
         configs['PRAW'] = self._praw_config
+        configs.update(self._options)
         return configs
 
     @property
-    def reddit(self) -> praw.Reddit:
+    def reddit(self) -> 'praw.Reddit':
         if self._reddit == None:
             raise Exception("Not connected to reddit.")
         return self._reddit
@@ -201,14 +767,42 @@ class RedditScanAndReplyBot:
         """
         if not {'client_id','client_secret','password','username','user_agent','subreddits'}.issubset(reddit_config):
             raise Exception("Reddit config missing required fields. Check config data.")
+        from .util.requestor_funcs import InstrumentedRequestor  # type: ignore
+
         self._reddit = connect_to_reddit(
             reddit_config['client_id'], 
             reddit_config['client_secret'], 
             reddit_config['password'], 
             reddit_config['username'], 
             reddit_config['user_agent'], 
+            requestor_class=InstrumentedRequestor,
+            requestor_kwargs=self.get_requestor_kwargs()
             )
 
+    def get_requestor_kwargs(self) -> dict:
+        """
+        Returns the keyword arguments the Reddit connection's InstrumentedRequestor is created with.
+        Unless self.session is a stand-in such as a ReplaySession, the session is given a pool of kept-alive
+        connections with the [NETWORK] settings, see configure_http_session.
+        Every request, listings included, is bounded by connect_timeout and read_timeout, and its attempts by the
+        connection retries of the session and the retries of prawcore, so no call to Reddit can hang a cycle.
+        """
+        import requests
+        from .util.requestor_funcs import configure_http_session  # type: ignore
+
+        if self.session is None or isinstance(self.session, requests.Session):
+            self.session = configure_http_session(
+                self.session,
+                self.get_option('NETWORK', 'pool_connections', 4, int),
+                self.get_option('NETWORK', 'pool_maxsize', 10, int),
+                self.get_option('NETWORK', 'retries', 2, int),
+                self.get_option('NETWORK', 'backoff_factor', 0.5, float),
+                self.get_option('NETWORK', 'compress', True, config_bool),
+                self.api_stats
+            )
+        timeout = (self.get_option('NETWORK', 'connect_timeout', 5, float), self.get_option('NETWORK', 'read_timeout', 16, float))
+        return {'stats': self.api_stats, 'session': self.session, 'timeout': timeout}
+
     @property
     def cur(self) -> sqlite3.Cursor:
         if self._cursor == None:
@@ -219,24 +813,111 @@ class RedditScanAndReplyBot:
     def cur(self, db_file: str):
         self._cursor = get_sql_cursor(db_file)
 
+def format_latency_report(report: dict, days: float) -> str:
+    """
+    Formats the output of RedditScanAndReplyBot.get_latency_report as a text table, one line per subreddit and stage.
+    """
+    lines = [f"Reply latency over the last {days:g} days, in seconds.",
+             "poll: waiting for the next cycle. queue: scanning and earlier replies in the cycle. post: the reply request.",
+             f"{'subreddit':<24}{'stage':<8}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}"]
+    if not report:
+        lines.append("No replies recorded.")
+    for subreddit, stages in report.items():
+        for stage in ('total', 'poll', 'queue', 'post'):
+            p50, p95, p99 = (stages[stage][percent] for percent in (50, 95, 99))
+            lines.append(f"{subreddit:<24}{stage:<8}{stages['count']:>7}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+    return '\n'.join(lines)
+
+def print_backfill_progress(items: int, seconds: float) -> None:
+    print(f"Scanned {items} items ({items / seconds if seconds else 0:.0f} items/s).", file=sys.stderr, flush=True)
+
 def main(args):
-    config = args.config
+    configs = args.config
     initalize = args.initialize
-    if config is None:
+    if not configs:
         raise Exception("No configuration file specified.")
-    if not os.path.isfile(config):
-        raise FileNotFoundError(f"Config file {config} not found.")
-    if initalize:
+    for config in configs:
+        if not os.path.isfile(config):
+            raise FileNotFoundError(f"Config file {config} not found.")
+    config = configs[0]
+    if len(configs) > 1:
+        # host several accounts in this process, sharing the catalog, see TenantRuntime.
+        if initalize or args.import_catalog or args.latency_report or args.backfill or args.workers or args.record or args.replay:
+            raise Exception("Several config files can only be given to run their bots together.")
+        from .util.tenant_funcs import TenantRuntime  # type: ignore
+
+        TenantRuntime.from_files(configs).run()
+    elif initalize:
         rb = RedditScanAndReplyBot().from_file(config)
         rb.initalize_database()
+    elif args.import_catalog is not None:
+        rb = RedditScanAndReplyBot().from_file(config)
+        result = rb.import_catalog(args.import_catalog, args.batch_size or 5000)
+        print(format_import_result(result))
+    elif args.latency_report:
+        rb = RedditScanAndReplyBot().from_file(config)
+        print(format_latency_report(rb.get_latency_report(args.days), args.days))
+    elif args.backfill is not None:
+        rb = RedditScanAndReplyBot().from_file(config)
+        result = rb.backfill(args.backfill, args.batch_size or 20000, print_backfill_progress)
+        for path, invalid in result['invalid_lines'].items():
+            print(f"Skipped {invalid} invalid lines in {path}.", file=sys.stderr)
+        print(f"Scanned {result['items']} items in {result['seconds']:.2f}s ({result['items_per_second']:.0f} items/s), "
+              f"{result['matched_items']} mentioned {len(result['titles'])} titles.", file=sys.stderr)
+        if args.output is None:
+            json.dump(result, sys.stdout, indent=2)
+        else:
+            with open(args.output, 'w') as fd:
+                json.dump(result, fd, indent=2)
+    elif args.workers is not None and args.workers > 1:
+        # split the subreddits between worker processes, see Coordinator.
+        rb = RedditScanAndReplyBot().from_file(config)
+        subreddits = [subreddit for subreddit in rb.configs['PRAW']['subreddits'].split('+') if subreddit]
+        Coordinator(config, subreddits, args.workers).run()
+    elif args.replay is not None:
+        # serve Reddit's responses from a cassette recorded with --record, without network access.
+        rb = RedditScanAndReplyBot().from_file(config)
+        rb.setup_replay(args.replay, args.realtime)
+        for cycle in range(args.cycles):
+            start = time.perf_counter()
+            rb.scrape_reddit()
+            print(f"Cycle {cycle + 1}: {time.perf_counter() - start:.2f}s, {rb.last_cycle_api_stats['total']} requests replayed.")
+        print(f"{rb.session.remaining} recorded responses left unused.")
     else:
         rb = RedditScanAndReplyBot().from_file(config)
+        if args.record is not None:
+            from .util.requestor_funcs import RecordingSession  # type: ignore
+
+            rb.session = RecordingSession(args.record)
         rb.setup()
         rb.run()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Scrapes reddit for hits on given keywords and posts relevant information as a reply.")
-    parser.add_argument('--config', '-c', dest='config', required=True, metavar="./config_file.ini")
+    parser.add_argument('--config', '-c', dest='config', required=True, nargs='+', metavar="./config_file.ini",
+                        help="Config file of the bot. Give several to run one bot per config file in this process.")
     parser.add_argument('--initialize', '-i', dest='initialize', required=False, action='store_true')
+    parser.add_argument('--import-catalog', dest='import_catalog', required=False, metavar="./books.csv",
+                        help="Bulk load books from a .csv or .jsonl file into the database, then exit.")
+    parser.add_argument('--batch-size', dest='batch_size', required=False, type=int, default=None,
+                        help="Rows written per batch when importing a catalog (default 5000), or items scanned per batch when backfilling (default 20000).")
+    parser.add_argument('--backfill', dest='backfill', required=False, nargs='+', metavar="./RC_2022-01.zst",
+                        help="Scan Reddit dump files (newline-delimited JSON, optionally .gz or .zst) for catalog titles, then exit.")
+    parser.add_argument('--output', '-o', dest='output', required=False, metavar="./mentions.json",
+                        help="Write the backfill results to this file instead of standard output.")
+    parser.add_argument('--latency-report', dest='latency_report', required=False, action='store_true',
+                        help="Print p50/p95/p99 reply latency per subreddit, then exit.")
+    parser.add_argument('--days', dest='days', required=False, type=float, default=7,
+                        help="Size of the rolling window of the latency report, in days.")
+    parser.add_argument('--record', dest='record', required=False, metavar="./cassette.jsonl.gz",
+                        help="Run normally, recording every Reddit request and response to this file.")
+    parser.add_argument('--replay', dest='replay', required=False, metavar="./cassette.jsonl.gz",
+                        help="Run scrape cycles against the responses recorded in this file instead of Reddit, then exit.")
+    parser.add_argument('--realtime', dest='realtime', required=False, action='store_true',
+                        help="When replaying, take as long to answer each request as Reddit did.")
+    parser.add_argument('--cycles', dest='cycles', required=False, type=int, default=1,
+                        help="Number of scrape cycles to replay.")
+    parser.add_argument('--workers', dest='workers', required=False, type=int, default=None,
+                        help="Split the subreddits between this many bot processes sharing the database.")
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,82 @@
+"""
+Administrative commands that only touch the bot's database: init, import-catalog, stats and prune.
+They never import praw, prawcore, requests or schedule, so they start quickly from cron jobs and shells.
+
+Run from the repository root:
+    python -m rsarb.admin --config ./config_file.ini stats
+    python -m rsarb.admin --config ./config_file.ini prune --days 90 --vacuum
+"""
+import argparse
+import json
+import os
+import time
+from configparser import ConfigParser, NoOptionError, NoSectionError
+
+from .util.catalog_funcs import format_import_result, import_catalog_file  # type: ignore
+from .util.sql_funcs import create_database, get_database_stats, get_sql_cursor, prune_database  # type: ignore
+
+def get_database_name(config_file: str) -> str:
+    """
+    Reads the database path from the [DATABASE] section of a bot config file. The other sections are not checked.
+    :param config_file: str path to the config file.
+    :returns: str database_name
+    :raises FileNotFoundError: if the config file does not exist.
+    :raises Exception: if the config file has no [DATABASE] database_name.
+    """
+    if not os.path.isfile(config_file):
+        raise FileNotFoundError(f"Config file {config_file} not found.")
+    parser = ConfigParser()
+    parser.read(config_file)
+    try:
+        return parser.get('DATABASE', 'database_name')
+    except (NoSectionError, NoOptionError):
+        raise Exception(f"{config_file} section [DATABASE] does not contain required key=value pairs.")
+
+def format_database_stats(stats: dict) -> str:
+    """
+    Formats the output of get_database_stats as text, one line per value.
+    """
+    lines = [f"{key:<20}{value}" for key, value in stats.items() if key != 'job_leases']
+    for job, lease in stats['job_leases'].items():
+        lines.append(f"{'job ' + job:<20}owner {lease['owner']}, expires {lease['expires_utc']:.0f}, last run {lease['last_run_utc']:.0f}")
+    return '\n'.join(lines)
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Maintains the bot's database without connecting to Reddit.")
+    parser.add_argument('--config', '-c', dest='config', required=True, metavar="./config_file.ini", help="Config file of the bot.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('init', help="Create the database if it does not exist.")
+    import_parser = commands.add_parser('import-catalog', help="Bulk load books from a .csv or .jsonl file.")
+    import_parser.add_argument('catalog_file', metavar="./books.csv")
+    import_parser.add_argument('--batch-size', dest='batch_size', type=int, default=5000, help="Rows written per batch.")
+    stats_parser = commands.add_parser('stats', help="Print row counts and the size of the database.")
+    stats_parser.add_argument('--json', dest='json', action='store_true', help="Print the stats as JSON.")
+    prune_parser = commands.add_parser('prune', help="Delete old reply latency rows and expired reply claims.")
+    prune_parser.add_argument('--days', dest='days', type=float, default=90, help="Keep latency rows of replies posted in the last this many days.")
+    prune_parser.add_argument('--vacuum', dest='vacuum', action='store_true', help="Rebuild the database file afterwards to return the freed space.")
+    args = parser.parse_args(argv)
+
+    database_name = get_database_name(args.config)
+    if args.command == 'init':
+        create_database(database_name)
+        print(f"Database {database_name} is ready.")
+        return
+
+    cur = get_sql_cursor(database_name)
+    try:
+        if args.command == 'import-catalog':
+            result = import_catalog_file(cur, args.catalog_file, args.batch_size)
+            print(format_import_result(result))
+        elif args.command == 'stats':
+            stats = get_database_stats(cur)
+            print(json.dumps(stats, indent=2) if args.json else format_database_stats(stats))
+        elif args.command == 'prune':
+            deleted = prune_database(cur, time.time() - args.days * 86400)
+            if args.vacuum:
+                cur.execute('VACUUM')
+            print(f"Deleted {deleted['reply_latency_rows']} reply latency rows and {deleted['expired_claims']} expired reply claims.")
+    finally:
+        cur.connection.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import re
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from .metrics_funcs import REGISTRY
+
+API_REQUEST_SECONDS = REGISTRY.histogram('rsarb_reddit_api_request_seconds', 'Time taken by requests to the Reddit API.', ('endpoint',))
+
+# Path segments that identify a single object are replaced, so that requests are counted per endpoint.
+_ENDPOINT_PATTERNS = [
+    (re.compile(r'/comments/[^/]+(/[^/]+)?'), '/comments/{id}'),
+    (re.compile(r'/r/[^/]+'), '/r/{subreddit}'),
+    (re.compile(r'/(user|u)/[^/]+'), '/user/{username}'),
+    (re.compile(r'/api/info(\.json)?'), '/api/info'),
+]
+
+# Modules whose frames are skipped when looking for the code that caused a request.
+_LIBRARY_PREFIXES = ('praw.', 'prawcore.', 'requests.', 'urllib3.', 'contextlib', __name__, __name__.rpartition('.')[0] + '.requestor_funcs')
+
+def get_endpoint(method: str, url: str) -> str:
+    """
+    Takes an HTTP method and url, returns the Reddit API endpoint it belongs to, e.g. 'GET /r/{subreddit}/new'.
+    :param method: str HTTP method.
+    :param url: str full or relative url.
+    :returns: str
+    """
+    path = urlsplit(url).path.rstrip('/') or '/'
+    for pattern, replacement in _ENDPOINT_PATTERNS:
+        path = pattern.sub(replacement, path)
+    return f"{method.upper()} {path}"
+
+def get_caller() -> str:
+    """
+    Returns the function that caused the current request: the innermost praw_funcs function if there is one,
+    otherwise the innermost function outside of praw, prawcore and requests.
+    :returns: str 'module.function'
+    """
+    frame = sys._getframe(1)
+    fallback = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.endswith('praw_funcs'):
+            return f"praw_funcs.{frame.f_code.co_name}"
+        if fallback is None and not module.startswith(_LIBRARY_PREFIXES):
+            fallback = f"{module.rpartition('.')[2]}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return fallback or 'unknown'
+
+class ApiCallStats:
+    """
+    Counts the requests made to Reddit, per endpoint and per calling function, and the connections opened for them.
+    Requests made while scanning() is active are flagged as lazy fetches: scanning should only
+    read attributes that are already loaded, so any request there is an accidental lazy load.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scanning = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Clears all counts, e.g. at the start of a cycle.
+        """
+        with self._lock:
+            self.total = 0
+            self.seconds = 0.0
+            self.by_endpoint = Counter()
+            self.by_caller = Counter()
+            self.lazy_fetches = Counter()
+            self.connections = 0
+
+    def record(self, method: str, url: str, seconds: float) -> None:
+        """
+        Counts one request.
+        :param method: str HTTP method.
+        :param url: str url requested.
+        :param seconds: float time the request took.
+        """
+        endpoint = get_endpoint(method, url)
+        caller = get_caller()
+        API_REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+        with self._lock:
+            self.total += 1
+            self.seconds += seconds
+            self.by_endpoint[endpoint] += 1
+            self.by_caller[caller] += 1
+            if getattr(self._scanning, 'active', False):
+                self.lazy_fetches[f"{caller} {endpoint}"] += 1
+
+    def record_connection(self) -> None:
+        """
+        Counts one new connection. Requests that reuse a kept-alive connection are not counted here, see PooledHTTPAdapter.
+        """
+        with self._lock:
+            self.connections += 1
+
+    @contextmanager
+    def scanning(self):
+        """
+        Context manager marking code that must not make requests. Requests made inside it are counted as lazy fetches.
+        """
+        previous = getattr(self._scanning, 'active', False)
+        self._scanning.active = True
+        try:
+            yield
+        finally:
+            self._scanning.active = previous
+
+    def summary(self) -> dict:
+        """
+        Returns a copy of the counts.
+        :returns: dict with keys total, seconds, by_endpoint, by_caller, lazy_fetches and connections.
+        """
+        with self._lock:
+            return {
+                'total': self.total,
+                'seconds': self.seconds,
+                'by_endpoint': dict(self.by_endpoint),
+                'by_caller': dict(self.by_caller),
+                'lazy_fetches': dict(self.lazy_fetches),
+                'connections': self.connections,
+            }
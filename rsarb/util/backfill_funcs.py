@@ -0,0 +1,162 @@
+import gzip
+import io
+import json
+import time
+from datetime import datetime, timezone
+
+from .scan_funcs import ENTITY_TEXT_SEPARATOR, match_records
+
+try:
+    import zstandard # type: ignore
+except ImportError:
+    zstandard = None
+
+# Reddit dump files are compressed with a long window, which has to be allowed explicitly when decompressing.
+ZSTD_MAX_WINDOW_SIZE = 2 ** 31
+
+def open_dump(path: str):
+    """
+    Opens a newline-delimited JSON dump for reading as text. Files ending in .gz are read with gzip,
+    files ending in .zst or .zstd with zstandard (which must be installed), anything else as plain text.
+    :param path: str path of the dump.
+    :returns: a text file object.
+    :raises ImportError: if the file is zstd compressed and zstandard is not installed.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    if path.endswith(('.zst', '.zstd')):
+        if zstandard is None:
+            raise ImportError(f"Reading {path} needs the zstandard package. Install it with `pip install zstandard`.")
+        reader = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW_SIZE).stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8', errors='replace')
+    return open(path, 'rt', encoding='utf-8', errors='replace')
+
+def get_dump_record(item: dict):
+    """
+    Takes one decoded line of a comment or submission dump, returns the record scanned for books.
+    Comments are recognised by their body, submissions by their title; anything else is skipped.
+    :param item: dict as found in Reddit dump files.
+    :returns: tuple(fullname, subreddit, created_utc, text) or None. subreddit and text are lower case.
+    """
+    if 'body' in item:
+        kind, text = 't1', item['body'] or ''
+    elif 'title' in item:
+        kind, text = 't3', (item['title'] or '') + ENTITY_TEXT_SEPARATOR + (item.get('selftext') or '')
+    else:
+        return None
+    fullname = item.get('name') or f"{kind}_{item.get('id', '')}"
+    try:
+        created_utc = float(item.get('created_utc') or 0)
+    except (TypeError, ValueError):
+        created_utc = 0.0
+    return fullname, str(item.get('subreddit') or '').lower(), created_utc, text.lower()
+
+def read_dump_records(path: str, errors: list = None):
+    """
+    Streams the records of a dump file, see get_dump_record. Nothing is held in memory beyond the current line.
+    :param path: str path of the dump, see open_dump.
+    :param errors: optional list. The line numbers of lines that are not valid JSON objects are appended to it.
+    :yields: tuple(fullname, subreddit, created_utc, text)
+    """
+    with open_dump(path) as fd:
+        for line_number, line in enumerate(fd, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = None
+            record = get_dump_record(item) if isinstance(item, dict) else None
+            if record is None:
+                if errors is not None:
+                    errors.append(line_number)
+                continue
+            yield record
+
+class BackfillTally:
+    """
+    Aggregated title mentions across a backfill. Its size depends on the catalog and the months covered,
+    not on the number of items scanned.
+    """
+    def __init__(self):
+        self.items = 0
+        self.matched_items = 0
+        self.titles = {} # title -> {'mentions', 'first_utc', 'last_utc', 'by_month', 'by_subreddit'}
+
+    def add(self, subreddit: str, created_utc: float, titles: list) -> None:
+        """
+        Counts one scanned item and the titles found in it.
+        """
+        self.items += 1
+        if not titles:
+            return
+        self.matched_items += 1
+        month = datetime.fromtimestamp(created_utc, timezone.utc).strftime('%Y-%m')
+        for title in titles:
+            tally = self.titles.get(title)
+            if tally is None:
+                tally = self.titles[title] = {'mentions': 0, 'first_utc': created_utc, 'last_utc': created_utc, 'by_month': {}, 'by_subreddit': {}}
+            tally['mentions'] += 1
+            tally['first_utc'] = min(tally['first_utc'], created_utc)
+            tally['last_utc'] = max(tally['last_utc'], created_utc)
+            tally['by_month'][month] = tally['by_month'].get(month, 0) + 1
+            tally['by_subreddit'][subreddit] = tally['by_subreddit'].get(subreddit, 0) + 1
+
+    def as_dict(self) -> dict:
+        return {
+            'items': self.items,
+            'matched_items': self.matched_items,
+            'titles': {title: self.titles[title] for title in sorted(self.titles, key=lambda title: -self.titles[title]['mentions'])}
+        }
+
+def backfill(paths, matcher, pool=None, batch_size: int = 20000, progress=None) -> dict:
+    """
+    Scans dump files for catalog titles with the same matching as scan_entity, and aggregates the mentions.
+    Files are streamed in batches of batch_size records, so memory use is bounded by the batch size and the catalog.
+    :param paths: iterable of dump file paths, see open_dump.
+    :param matcher: TitleMatcher used when matching in this process.
+    :param pool: optional ScanPool. Batches are matched across its worker processes.
+    :param batch_size: number of records matched at a time.
+    :param progress: optional callable, called after each batch with (items scanned so far, seconds elapsed).
+    :returns: dict with keys items, matched_items, invalid_lines, seconds, items_per_second and titles,
+        where titles is dict[title] = {'mentions', 'first_utc', 'last_utc', 'by_month', 'by_subreddit'}, most mentioned first.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1.")
+
+    tally = BackfillTally()
+    invalid_lines = {}
+    start = time.perf_counter()
+
+    def scan_batch(batch):
+        # the author is not needed for a backfill, but is part of the record format the pool expects.
+        records = [(fullname, '', text) for fullname, subreddit, created_utc, text in batch]
+        results = pool.scan(records) if pool is not None else match_records(records, matcher)
+        for (fullname, subreddit, created_utc, text), (_, titles) in zip(batch, results):
+            tally.add(subreddit, created_utc, titles)
+        if progress is not None:
+            progress(tally.items, time.perf_counter() - start)
+
+    for path in paths:
+        errors = []
+        invalid = 0
+        batch = []
+        for record in read_dump_records(path, errors):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                scan_batch(batch)
+                batch = []
+                invalid += len(errors)
+                errors.clear()
+        if batch:
+            scan_batch(batch)
+        invalid += len(errors)
+        if invalid:
+            invalid_lines[path] = invalid_lines.get(path, 0) + invalid
+
+    seconds = time.perf_counter() - start
+    result = tally.as_dict()
+    result['invalid_lines'] = invalid_lines
+    result['seconds'] = seconds
+    result['items_per_second'] = tally.items / seconds if seconds > 0 else 0.0
+    return result
@@ -0,0 +1,84 @@
+import logging
+import time
+
+from .metrics_funcs import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_TRIPS_TOTAL = REGISTRY.counter('rsarb_circuit_breaker_trips_total', 'Times a circuit was opened after repeated failures, by endpoint.', ('endpoint',))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """
+    Tracks failures per target, e.g. ('comments', subreddit), so that a failing target stops being called.
+    A circuit opens after failure_threshold failures in a row. Calls to an open circuit are refused until
+    reset_seconds have passed, then a single probe call is let through (half open): if it succeeds the circuit
+    closes, if it fails the circuit opens again for another reset_seconds.
+    """
+    def __init__(self, failure_threshold: int = 3, reset_seconds: float = 300, clock=time.monotonic):
+        """
+        :param failure_threshold: int failures in a row that open a circuit. 0 disables the breaker, every call is allowed.
+        :param reset_seconds: float seconds a circuit stays open before a probe is let through.
+        :param clock: function returning the current time in seconds.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self._circuits = {} # target -> [state, failures in a row, time opened]
+
+    def allow(self, target) -> bool:
+        """
+        Returns True if target may be called now. Moves an open circuit whose reset_seconds have passed to half open
+        and allows that one call as the probe; further calls are refused until the probe's outcome is recorded,
+        or for another reset_seconds.
+        """
+        circuit = self._circuits.get(target)
+        if circuit is None or circuit[0] == CLOSED:
+            return True
+        now = self.clock()
+        if now - circuit[2] >= self.reset_seconds:
+            # also lets another probe through if the last one's outcome was never recorded.
+            circuit[0] = HALF_OPEN
+            circuit[2] = now
+            logger.info("Probing %s.", target)
+            return True
+        return False
+
+    def record_success(self, target) -> None:
+        """
+        Closes the target's circuit.
+        """
+        circuit = self._circuits.pop(target, None)
+        if circuit is not None and circuit[0] != CLOSED:
+            logger.info("%s recovered, circuit closed.", target)
+
+    def record_failure(self, target) -> None:
+        """
+        Counts a failed call of target, opening its circuit after failure_threshold failures in a row or a failed probe.
+        """
+        if not self.failure_threshold:
+            return
+        circuit = self._circuits.setdefault(target, [CLOSED, 0, 0.0])
+        circuit[1] += 1
+        if circuit[0] == HALF_OPEN or (circuit[0] == CLOSED and circuit[1] >= self.failure_threshold):
+            if circuit[0] == CLOSED:
+                CIRCUIT_TRIPS_TOTAL.inc(endpoint=str(target[0]) if isinstance(target, tuple) else str(target))
+            circuit[0] = OPEN
+            circuit[2] = self.clock()
+            logger.warning("%s failed %d times in a row, circuit open for %gs.", target, circuit[1], self.reset_seconds)
+
+    def get_state(self, target) -> str:
+        """
+        Returns 'closed', 'open' or 'half_open'.
+        """
+        circuit = self._circuits.get(target)
+        return CLOSED if circuit is None else circuit[0]
+
+    def get_open_targets(self) -> list:
+        """
+        Returns the targets whose circuits are not closed.
+        """
+        return [target for target, circuit in self._circuits.items() if circuit[0] != CLOSED]
@@ -0,0 +1,469 @@
+import bisect
+import csv
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import weakref
+import zlib
+from array import array
+
+from .sql_funcs import get_book_db_entries, get_catalog_revision, upsert_books
+
+CATALOG_FIELDS = ('title', 'author', 'isbn', 'uri', 'summary')
+REQUIRED_CATALOG_FIELDS = ('title', 'author', 'isbn', 'summary')
+
+_U32 = struct.Struct('<I')
+
+class CatalogRowError(ValueError):
+    """
+    Raised when a row of a catalog file cannot be imported into the books table.
+    """
+    def __init__(self, line_number: int, message: str):
+        self.line_number = line_number
+        super().__init__(f"Line {line_number}: {message}")
+
+def validate_catalog_row(row: dict, line_number: int) -> tuple:
+    """
+    Takes a dict representing one book and checks it against the books table schema.
+    Leading and trailing whitespace is stripped from every field, empty uri fields become NULL.
+    :param row: dict with (at least) the keys title, author, isbn and summary.
+    :param line_number: the line of the source file the row came from, used in error messages.
+    :returns: tuple(title, author, isbn, uri, summary) ready to be written to the database.
+    :raises CatalogRowError: if a required field is missing or blank.
+    """
+    if not isinstance(row, dict):
+        raise CatalogRowError(line_number, "Row is not a mapping of column names to values.")
+
+    values = {}
+    for field in CATALOG_FIELDS:
+        value = row.get(field)
+        values[field] = None if value is None else str(value).strip()
+
+    for field in REQUIRED_CATALOG_FIELDS:
+        if not values[field]:
+            raise CatalogRowError(line_number, f"Required field '{field}' is missing or empty.")
+
+    if not values['uri']:
+        values['uri'] = None
+
+    return tuple(values[field] for field in CATALOG_FIELDS)
+
+def read_catalog_file(path: str, errors: list = None):
+    """
+    Streams the rows of a CSV or JSONL catalog file, one validated row at a time.
+    The file type is determined by extension: .csv for CSV (with a header row), .jsonl or .ndjson for one JSON object per line.
+    :param path: str path to the catalog file.
+    :param errors: optional list. If given, invalid rows are appended to it as CatalogRowError and skipped,
+                   otherwise the first invalid row raises.
+    :returns: generator of tuple(title, author, isbn, uri, summary).
+    :raises FileNotFoundError: if the file does not exist.
+    :raises ValueError: if the file extension is not a supported catalog format.
+    :raises CatalogRowError: if a row is invalid and no errors list was passed.
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Catalog file {path} not found.")
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        rows = _read_csv_rows(path)
+    elif extension in ('.jsonl', '.ndjson'):
+        rows = _read_jsonl_rows(path)
+    else:
+        raise ValueError(f"Catalog file {path} must be a .csv, .jsonl or .ndjson file.")
+
+    for line_number, row in rows:
+        try:
+            if isinstance(row, CatalogRowError):
+                raise row
+            yield validate_catalog_row(row, line_number)
+        except CatalogRowError as e:
+            if errors is None:
+                raise e
+            errors.append(e)
+
+def import_catalog_file(session, catalog_file: str, batch_size: int = 5000) -> dict:
+    """
+    Bulk loads a CSV or JSONL catalog file into the books table, see read_catalog_file and upsert_books.
+    Existing books (matched on title) are updated, new ones are inserted. Invalid rows are skipped and reported.
+    :param session: sqlite3.Cursor
+    :param catalog_file: str path to a .csv, .jsonl or .ndjson file.
+    :param batch_size: number of rows written per batch.
+    :returns: dict with keys written (int distinct titles), rejected (list[CatalogRowError]), seconds (float) and books_per_second (float).
+    :raises FileNotFoundError: if the catalog file does not exist.
+    :raises sqlite3.* Exceptions: if the rows cannot be written. Nothing is written in that case.
+    """
+    rejected = []
+    start = time.perf_counter()
+    written = upsert_books(session, read_catalog_file(catalog_file, rejected), batch_size)
+    seconds = time.perf_counter() - start
+    return {
+        'written': written,
+        'rejected': rejected,
+        'seconds': seconds,
+        'books_per_second': written / seconds if seconds > 0 else 0.0
+    }
+
+def format_import_result(result: dict) -> str:
+    """
+    Takes the result of import_catalog_file, returns the report printed after an import: one line per skipped row, then a summary.
+    :param result: dict as returned by import_catalog_file.
+    :returns: str
+    """
+    lines = [f"Skipped {error}" for error in result['rejected']]
+    lines.append(f"Imported {result['written']} books in {result['seconds']:.2f}s ({result['books_per_second']:.0f} books/s), skipped {len(result['rejected'])} invalid rows.")
+    return '\n'.join(lines)
+
+def _read_csv_rows(path: str):
+    with open(path, newline='', encoding='utf-8') as fd:
+        reader = csv.DictReader(fd)
+        for row in reader:
+            # line_num is the line the row *ended* on, which is what users see in an editor for multiline rows.
+            yield reader.line_num, row
+
+def _read_jsonl_rows(path: str):
+    with open(path, encoding='utf-8') as fd:
+        for line_number, line in enumerate(fd, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, CatalogRowError(line_number, f"Invalid JSON: {e.msg}")
+
+class TitleMatcher:
+    """
+    Finds every catalog title that occurs as a substring of a piece of text.
+    Gives the same results as checking `title in text` for every title, but only checks titles whose
+    first few characters occur somewhere in the text, so the cost grows with the text rather than the catalog.
+    Titles and text are compared lower case.
+    """
+    KEY_LENGTH = 4
+
+    def __init__(self, titles):
+        self.titles = tuple(sorted({str(title).lower() for title in titles if title}))
+        self._fingerprint = None
+        self.index = {} # first KEY_LENGTH characters of a title -> titles starting with them.
+        self.short_titles = [] # titles shorter than KEY_LENGTH, checked one by one.
+        for title in self.titles:
+            if len(title) < self.KEY_LENGTH:
+                self.short_titles.append(title)
+            else:
+                self.index.setdefault(title[:self.KEY_LENGTH], []).append(title)
+
+    def match(self, text: str) -> list:
+        """
+        Takes a string, returns the titles found in it.
+        :param text: str to scan.
+        :returns: list[str] of matched titles, de-duplicated.
+        """
+        if not text:
+            return []
+        text = text.lower()
+        key_length = self.KEY_LENGTH
+        keys = {text[i:i + key_length] for i in range(len(text) - key_length + 1)}
+
+        found = [title for title in self.short_titles if title in text]
+        for key in keys.intersection(self.index):
+            for title in self.index[key]:
+                if title in text:
+                    found.append(title)
+        return found
+
+    @property
+    def fingerprint(self) -> bytes:
+        """
+        sha256 digest of the titles and key length this matcher was built from.
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha256(_U32.pack(self.KEY_LENGTH))
+            for title in self.titles:
+                digest.update(title.encode('utf-8'))
+                digest.update(b'\x00')
+            self._fingerprint = digest.digest()
+        return self._fingerprint
+
+    def __len__(self):
+        return len(self.titles)
+
+def format_book_entry(book_info: dict) -> str:
+    """
+    Takes a book entry as returned by get_book_db_entry, returns the Reddit Markdown block posted for that book.
+    :param book_info: dict with keys title, author, isbn and uri.
+    :returns: str
+    """
+    return '\n\n'.join([
+        f"Title:  {book_info['title']}",
+        f"Author: {book_info['author']}",
+        f"ISBN:   {book_info['isbn']}",
+        f"URI:    {book_info['uri']}"
+    ])
+
+class CatalogSnapshot:
+    """
+    An immutable copy of the books table and the structures derived from it.
+    A scan holds on to one snapshot from start to finish, so a catalog reload mid-scan cannot change its view of the books.
+    """
+    def __init__(self, version, entries: list):
+        self.version = version
+        self.books = {}
+        for entry in entries: # first entry wins, as with get_book_db_entry.
+            self.books.setdefault(str(entry['title']).lower(), entry)
+        self.titles = list(self.books)
+        self.matcher = TitleMatcher(self.titles)
+
+    def get_book_entry(self, title: str) -> dict:
+        """
+        Accepts a title of a book. Returns the entry for that book, in the format of get_book_db_entry.
+        :param title: str
+        :returns: dict
+        :raises KeyError: If title is not found in the catalog.
+        """
+        try:
+            return self.books[title.lower()]
+        except KeyError:
+            raise KeyError("Title not found in database.") from None
+
+    def get_book_block(self, title: str) -> str:
+        """
+        Accepts a title of a book. Returns the formatted block posted for that book, see format_book_entry.
+        :param title: str
+        :returns: str
+        :raises KeyError: If title is not found in the catalog.
+        """
+        return format_book_entry(self.get_book_entry(title))
+
+def get_entries_fingerprint(entries) -> bytes:
+    """
+    Takes a list of book entries as returned by get_book_db_entries, returns a sha256 digest of their contents.
+    Books tables holding the same books in the same order have the same fingerprint.
+    :param entries: list(dict)
+    :returns: bytes
+    """
+    digest = hashlib.sha256()
+    for entry in entries:
+        digest.update(json.dumps(entry, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.digest()
+
+class CatalogCache:
+    """
+    Shares CatalogSnapshots between BookCatalogs whose books tables hold the same books, so that bots
+    hosted in one process with separate databases keep a single copy of the catalog and its matcher.
+    Snapshots are held weakly and dropped once no BookCatalog uses them.
+    """
+    def __init__(self):
+        self._snapshots = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, entries: list) -> CatalogSnapshot:
+        """
+        Returns the snapshot of entries, building it if no BookCatalog is using one.
+        :param entries: list(dict) as returned by get_book_db_entries.
+        :returns: CatalogSnapshot. Its version is the fingerprint of entries.
+        """
+        key = get_entries_fingerprint(entries)
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is None:
+                snapshot = self._snapshots[key] = CatalogSnapshot(key, entries)
+            return snapshot
+
+    def __len__(self):
+        return len(self._snapshots)
+
+class BookCatalog:
+    """
+    Caches the books table in memory and rebuilds it only when the catalog revision changes.
+    The revision (PRAGMA user_version) is bumped by upsert_books, from any connection or process, while
+    commits to the other tables leave it alone, so bots sharing a database do not rebuild on each other's replies.
+    Changes made to the books table by other means are not seen until the revision is bumped or invalidate() is called.
+    If a CatalogCache is given, snapshots are shared with the other BookCatalogs using it.
+    """
+    def __init__(self, cache: CatalogCache = None):
+        self.cache = cache
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def snapshot(self, session) -> CatalogSnapshot:
+        """
+        Takes a sqlite3 cursor, returns the current CatalogSnapshot, rebuilding it first if the database changed.
+        The new snapshot replaces the old one in a single assignment; callers holding the old one are unaffected.
+        :param session: sqlite3.Cursor
+        :returns: CatalogSnapshot
+        """
+        version = (id(session.connection), get_catalog_revision(session))
+        current = self._snapshot
+        if current is not None and current[0] == version:
+            return current[1]
+
+        with self._lock:
+            if self._snapshot is None or self._snapshot[0] != version:
+                entries = get_book_db_entries(session)
+                if self.cache is not None:
+                    snapshot = self.cache.get(entries)
+                else:
+                    snapshot = CatalogSnapshot(version, entries)
+                self._snapshot = (version, snapshot)
+            return self._snapshot[1]
+
+    def invalidate(self) -> None:
+        """
+        Drops the cached snapshot, forcing a rebuild on the next call to snapshot().
+        """
+        self._snapshot = None
+
+class SharedCatalog:
+    """
+    The title index of a catalog in a shared memory segment, so that scan workers can match text against it
+    without building an index of their own.
+    One process builds it with SharedCatalog.create(), other processes attach to it by name with
+    SharedCatalog.attach() and call match() on it like on a TitleMatcher.
+    The segment holds the lower case titles and the index of TitleMatcher in flat u32 arrays: titles are found by
+    a binary search over the crc32 of their first KEY_LENGTH characters and compared to the text as utf-8 bytes,
+    so a worker only allocates memory for the text it is matching and the titles it finds.
+    """
+    MAGIC = b'RSARBSC\x00'
+    VERSION = 2
+    _HEADER = struct.Struct('<8sII32s4I') # magic, version, key length, fingerprint, short, key, title id and title counts.
+
+    def __init__(self, shm, owner: bool):
+        self._shm = shm
+        self.owner = owner
+        buffer = shm.buf
+        magic, version, self.key_length, self.fingerprint, short_count, key_count, id_count, title_count = \
+            self._HEADER.unpack_from(buffer, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"Shared memory segment {shm.name} does not hold a shared catalog.")
+        lengths = (('_short_ids', short_count), ('_keys', key_count), ('_key_starts', key_count + 1),
+                   ('_title_ids', id_count), ('_title_offsets', title_count + 1))
+        data_start = self._HEADER.size + _U32.size * sum(length for name, length in lengths)
+        segment = memoryview(buffer)
+        words = segment[self._HEADER.size:data_start].cast('I')
+        self._views = [segment, words]
+        position = 0
+        for name, length in lengths:
+            view = words[position:position + length]
+            self._views.append(view)
+            setattr(self, name, view)
+            position += length
+        self._title_data = segment[data_start:data_start + self._title_offsets[title_count]]
+        self._views.append(self._title_data)
+        # Titles shorter than the key length are checked against every text, and are few and short enough to copy.
+        self._short_titles = [(i, self._title_data[self._title_offsets[i]:self._title_offsets[i + 1]].tobytes())
+                              for i in self._short_ids]
+
+    @classmethod
+    def create(cls, catalog, name: str = None):
+        """
+        Copies the title index of a CatalogSnapshot into a new shared memory segment.
+        The creating process owns the segment and should unlink() it once all workers are done with it.
+        :param catalog: CatalogSnapshot
+        :param name: optional name for the segment, one is generated if not given.
+        :returns: SharedCatalog
+        """
+        from multiprocessing import shared_memory
+
+        matcher = catalog.matcher
+        key_length = matcher.KEY_LENGTH
+        titles = matcher.titles
+        blobs = [title.encode('utf-8') for title in titles]
+        title_offsets = array('I', [0])
+        for blob in blobs:
+            title_offsets.append(title_offsets[-1] + len(blob))
+
+        short_ids = array('I')
+        buckets = {}
+        for i, title in enumerate(titles):
+            if len(title) < key_length:
+                short_ids.append(i)
+            else:
+                buckets.setdefault(zlib.crc32(title[:key_length].encode('utf-8')), []).append(i)
+        keys = array('I', sorted(buckets))
+        key_starts = array('I', [0])
+        title_ids = array('I')
+        for key in keys:
+            title_ids.extend(buckets[key])
+            key_starts.append(len(title_ids))
+
+        payload = b''.join([
+            cls._HEADER.pack(cls.MAGIC, cls.VERSION, key_length, matcher.fingerprint,
+                             len(short_ids), len(keys), len(title_ids), len(titles)),
+            short_ids.tobytes(),
+            keys.tobytes(),
+            key_starts.tobytes(),
+            title_ids.tobytes(),
+            title_offsets.tobytes(),
+            b''.join(blobs)
+        ])
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(len(payload), 1))
+        shm.buf[:len(payload)] = payload
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str):
+        """
+        Attaches to a shared catalog created by another process.
+        The creator's resource tracker is inherited by its child processes, so workers started by it can attach
+        without the segment being unlinked when they exit.
+        :param name: str name of the segment, see SharedCatalog.name.
+        :returns: SharedCatalog
+        :raises FileNotFoundError: if no segment with that name exists.
+        """
+        from multiprocessing import shared_memory
+
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def match(self, text: str) -> list:
+        """
+        Takes a string, returns the titles found in it. Gives the same results as TitleMatcher.match.
+        :param text: str to scan.
+        :returns: list[str] of matched titles, de-duplicated.
+        """
+        if not text:
+            return []
+        text = text.lower()
+        encoded = text.encode('utf-8')
+        key_length = self.key_length
+        keys = {text[i:i + key_length] for i in range(len(text) - key_length + 1)}
+
+        data, offsets = self._title_data, self._title_offsets
+        found = [i for i, title in self._short_titles if title in encoded]
+        hashes, starts, title_ids = self._keys, self._key_starts, self._title_ids
+        count = len(hashes)
+        crc32, bisect_left = zlib.crc32, bisect.bisect_left
+        buckets = set()
+        for key in keys:
+            key_hash = crc32(key.encode('utf-8'))
+            position = bisect_left(hashes, key_hash)
+            if position < count and hashes[position] == key_hash:
+                buckets.add(position) # keys with the same crc32 share a bucket, which only needs checking once.
+        for position in buckets:
+            for i in title_ids[starts[position]:starts[position + 1]]:
+                if data[offsets[i]:offsets[i + 1]] in encoded:
+                    found.append(i)
+        return [data[offsets[i]:offsets[i + 1]].tobytes().decode('utf-8') for i in found]
+
+    def __len__(self):
+        return len(self._title_offsets) - 1
+
+    def close(self) -> None:
+        """
+        Detaches this process from the segment.
+        """
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """
+        Destroys the segment. Only the creating process should call this.
+        """
+        self._shm.unlink()
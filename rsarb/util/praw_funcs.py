@@ -1,12 +1,28 @@
-import praw, prawcore # type: ignore
+# praw and prawcore are imported where they are used, so that importing this module stays cheap.
+from .metrics_funcs import REGISTRY
 
-def connect_to_reddit(client_id, client_secret, password, username, user_agent):
+REPLIES_TOTAL = REGISTRY.counter('rsarb_replies_total', 'Replies attempted, by outcome.', ('result',))
+
+def connect_to_reddit(client_id, client_secret, password, username, user_agent, requestor_class=None, requestor_kwargs=None):
+    """
+    Takes reddit credentials, returns a praw.Reddit instance logged in with them.
+    :param requestor_class: optional prawcore Requestor subclass to make requests with, e.g. InstrumentedRequestor.
+    :param requestor_kwargs: optional dict of extra keyword arguments for requestor_class.
+    :returns: praw.Reddit
+    """
+    import praw # type: ignore
+
+    extra_kwargs = {}
+    if requestor_class is not None:
+        extra_kwargs['requestor_class'] = requestor_class
+        extra_kwargs['requestor_kwargs'] = requestor_kwargs or {}
     ph = praw.Reddit(
         client_id = client_id,
         client_secret = client_secret,
         password = password,
         username = username,
-        user_agent = user_agent
+        user_agent = user_agent,
+        **extra_kwargs
     )
     return ph
 
@@ -39,6 +55,22 @@ def get_submission(praw_instance, fullname=None, URI=None):
 
     return submission
 
+def get_entity(praw_instance, fullname: str):
+    """
+    Takes a praw instance and the fullname of a comment or submission.
+    Returns a lazy praw object for it, which can be replied to without fetching it from Reddit first.
+    :param praw_instance: An instance of a praw.Reddit object.
+    :param fullname: the fullname of a comment or submission (e.g. t1_abcdef)
+    :returns: A praw Comment or Submission.
+    :raises ValueError: If fullname is not that of a comment or submission.
+    """
+    type_string, _, reddit_id = fullname.partition('_')
+    if type_string == 't1':
+        return praw_instance.comment(reddit_id)
+    if type_string == 't3':
+        return praw_instance.submission(reddit_id)
+    raise ValueError(f"{fullname} is not a valid submission or comment fullname.")
+
 def get_comments(submission):
     """
     Iterates the comments in a given submission and returns a 
@@ -65,12 +97,13 @@ def get_thread_commenters(submission):
     authors = list({str(author).lower() for author in authors})
     return authors
 
-def scan_entity(entity, books, replied_entries, opted_in_users):
+def scan_entity(entity, books, replied_entries, opted_in_users, matcher=None):
     """
     Scans a given entity (submission, comment) and detects book titles by name
     scans the title of submissions, and the body of submissions and comments
     returns a list of books to reply to a given entity with.
     :param entity: A reddit comment or submission.
+    :param matcher: optional TitleMatcher built from books. If given, it is used instead of checking each book in turn.
     :returns: list[book1, book2, book3, ...]
     :raises ValueError: If entity is not a valid comment or submission.
     """
@@ -81,9 +114,14 @@ def scan_entity(entity, books, replied_entries, opted_in_users):
     if reddit_id in replied_entries:
         return []
 
-    if entity.author not in opted_in_users:
+    if str(entity.author).lower() not in opted_in_users:
         return []
 
+    if matcher is not None:
+        if type_string == 't3':
+            return list(set(matcher.match(entity.title)).union(matcher.match(entity.selftext)))
+        return matcher.match(entity.body)
+
     found_books = []
     for book in books:
 
@@ -110,20 +148,26 @@ def post_comment(reddit, entity, post_body: str) -> bool:
     :returns: True if comment successfully posted, otherwise False.
     :raises: Exception when post does not submit to reddit properly.
     """
+    import prawcore # type: ignore
+
     try:
         result = entity.reply(post_body)
     except prawcore.exceptions.Forbidden as prawForbidden:
         #Replying to a locked or otherwise non-repliable post.
+        REPLIES_TOTAL.inc(result='forbidden')
         return False
 
     if result is None:
         # posting to a non-opted in, quarantined sub
         last_posted_comment = reddit.user.me().comments.new(limit=1)[0] # get most recent comment
         if last_posted_comment.parent_id != entity.fullname: #check if the parent of most recent comment is the post just replied to
+            REPLIES_TOTAL.inc(result='unconfirmed')
             return False
         else:
+            REPLIES_TOTAL.inc(result='posted')
             return True
 
+    REPLIES_TOTAL.inc(result='posted')
     return True
 
 def get_user_replied_entities(reddit) -> list:
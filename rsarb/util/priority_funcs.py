@@ -0,0 +1,51 @@
+import heapq
+import itertools
+import math
+
+def get_priority(created_utc: float, activity: int, now: float, freshness_weight: float = 1.0, activity_weight: float = 0.5,
+                 half_life_seconds: float = 3600) -> float:
+    """
+    Scores a piece of work on a thread, e.g. fetching its comments or replying in it. Higher scores are served first.
+    The score is freshness_weight * freshness + activity_weight * log(1 + activity), where freshness halves every
+    half_life_seconds of age, from 1 for something created at now.
+    :param created_utc: float unix timestamp the submission or comment was created at.
+    :param activity: int comments added to the thread since it was last scanned, or its comment count if it was not.
+    :param now: float unix timestamp to measure age from.
+    :param freshness_weight: float weight of freshness.
+    :param activity_weight: float weight of activity.
+    :param half_life_seconds: float age at which freshness is halved.
+    :returns: float
+    """
+    age = max(0.0, now - created_utc)
+    freshness = 0.5 ** (age / half_life_seconds) if half_life_seconds > 0 else 0.0
+    return freshness_weight * freshness + activity_weight * math.log1p(max(0, activity))
+
+class PriorityQueue:
+    """
+    A max-priority queue. Items of equal priority are popped in the order they were pushed.
+    """
+    def __init__(self):
+        self._heap = []
+        self._order = itertools.count()
+
+    def push(self, item, priority: float) -> None:
+        heapq.heappush(self._heap, (-priority, next(self._order), item))
+
+    def pop(self):
+        """
+        Removes and returns the item with the highest priority.
+        :raises IndexError: if the queue is empty.
+        """
+        return heapq.heappop(self._heap)[2]
+
+    def drain(self) -> list:
+        """
+        Removes and returns every item left, highest priority first.
+        """
+        items = []
+        while self._heap:
+            items.append(self.pop())
+        return items
+
+    def __len__(self) -> int:
+        return len(self._heap)
@@ -0,0 +1,111 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+class CycleProfiler:
+    """
+    Profiles a sample of runs of a recurring job, e.g. every 10th scrape_reddit cycle, so it can stay on in production.
+    Runs that are not sampled only pay for a counter increment. A sampled run is profiled with cProfile and,
+    optionally, tracemalloc (which is only running during sampled runs). Each sampled run writes two files to
+    directory: <name>-<timestamp>.prof, loadable with pstats or snakeviz, and <name>-<timestamp>.txt, a summary
+    of the top functions by cumulative time and the top allocation sites. Only the newest keep runs are kept.
+    """
+    def __init__(self, directory: str, every: int = 0, trace_memory: bool = False, top: int = 25, keep: int = 20):
+        """
+        :param directory: str directory the profiles are written to. Created if it does not exist.
+        :param every: profile every Nth run. 0 only profiles runs requested with request().
+        :param trace_memory: also record allocations with tracemalloc. Slows sampled runs down noticeably.
+        :param top: number of functions and allocation sites listed in the summary.
+        :param keep: number of profiled runs kept in directory. Older ones are deleted.
+        """
+        if every < 0:
+            raise ValueError("every must be 0 or more.")
+        self.directory = directory
+        self.every = every
+        self.trace_memory = trace_memory
+        self.top = top
+        self.keep = keep
+        self.runs = 0
+        self.last_profile = None
+        self._requested = threading.Event()
+
+    def request(self, *args) -> None:
+        """
+        Profiles the next run regardless of every. Takes and ignores any arguments, so it can be used as a signal handler.
+        """
+        self._requested.set()
+
+    def should_sample(self) -> bool:
+        """
+        Counts a run, returns True if it should be profiled.
+        """
+        self.runs += 1
+        if self._requested.is_set():
+            self._requested.clear()
+            return True
+        return self.every > 0 and self.runs % self.every == 0
+
+    @contextmanager
+    def profile(self, name: str):
+        """
+        Context manager wrapping one run of the job called name. Profiles it if it is sampled, see should_sample.
+        The paths written are left in last_profile as tuple(prof_path, summary_path).
+        A profile that cannot be written is logged and dropped; it never fails the run.
+        """
+        if not self.should_sample():
+            yield
+            return
+
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot() if self.trace_memory and tracemalloc.is_tracing() else None
+            if started_tracing:
+                tracemalloc.stop()
+            try:
+                self.last_profile = self._write(name, profiler, snapshot, seconds)
+                self._prune(name)
+            except OSError as e:
+                logger.warning("Could not write the profile of %s to %s: %s", name, self.directory, e)
+
+    def _write(self, name: str, profiler: cProfile.Profile, snapshot, seconds: float) -> tuple:
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"{name}-{time.strftime('%Y%m%dT%H%M%S')}-{self.runs}")
+        profiler.dump_stats(base + '.prof')
+
+        summary = io.StringIO()
+        summary.write(f"{name} run {self.runs} took {seconds:.3f}s\n\n")
+        pstats.Stats(profiler, stream=summary).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        if snapshot is not None:
+            summary.write(f"Top {self.top} allocation sites:\n")
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                summary.write(f"{stat}\n")
+        with open(base + '.txt', 'w') as fd:
+            fd.write(summary.getvalue())
+        return base + '.prof', base + '.txt'
+
+    def _prune(self, name: str) -> None:
+        profiles = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.startswith(name + '-') and entry.name.endswith('.prof')),
+            key=lambda entry: (entry.stat().st_mtime_ns, entry.name)
+        )
+        for entry in profiles[:max(0, len(profiles) - self.keep)]:
+            for path in (entry.path, entry.path[:-len('.prof')] + '.txt'):
+                if os.path.exists(path):
+                    os.remove(path)
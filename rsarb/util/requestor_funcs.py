@@ -0,0 +1,257 @@
+import gzip
+import json
+import threading
+import time
+import zlib
+from collections import defaultdict, deque
+
+import prawcore # type: ignore
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+from .api_stats_funcs import ApiCallStats
+from .metrics_funcs import REGISTRY
+
+HTTP_CONNECTIONS_TOTAL = REGISTRY.counter('rsarb_http_connections_total', 'Connections opened to Reddit, by host.', ('host',))
+
+class InstrumentedRequestor(prawcore.Requestor):
+    """
+    A prawcore Requestor that reports every request it makes to an ApiCallStats.
+    Pass it to praw.Reddit as requestor_class, with requestor_kwargs={'stats': stats}.
+    """
+    def __init__(self, *args, stats: ApiCallStats = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats if stats is not None else ApiCallStats()
+
+    def request(self, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().request(method, url, *args, **kwargs)
+        finally:
+            self.stats.record(method, url, time.perf_counter() - start)
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter that counts the connections it opens. Requests that reuse a kept-alive connection from
+    the pool open none, so comparing the count with the number of requests shows how well connections are reused.
+    """
+    def __init__(self, *args, stats: ApiCallStats = None, **kwargs):
+        """
+        :param stats: optional ApiCallStats the new connections are also counted in, see ApiCallStats.record_connection.
+        Other arguments are passed to HTTPAdapter (pool_connections, pool_maxsize, max_retries, pool_block).
+        """
+        self.stats = stats
+        self.connections = 0
+        self._lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: self._counting_pool_class(pool_class) for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+    def _counting_pool_class(self, pool_class):
+        adapter = self
+
+        class CountingConnectionPool(pool_class):
+            def _new_conn(self):
+                adapter.record_connection(self.host)
+                return super()._new_conn()
+
+        return CountingConnectionPool
+
+    def record_connection(self, host: str) -> None:
+        with self._lock:
+            self.connections += 1
+        HTTP_CONNECTIONS_TOTAL.inc(host=host)
+        if self.stats is not None:
+            self.stats.record_connection()
+
+def configure_http_session(session: requests.Session = None, pool_connections: int = 4, pool_maxsize: int = 10, retries: int = 2,
+                           backoff_factor: float = 0.5, compress: bool = True, stats: ApiCallStats = None) -> requests.Session:
+    """
+    Mounts a PooledHTTPAdapter on a requests Session, so that requests to Reddit reuse kept-alive connections
+    instead of opening (and TLS handshaking) a new one each time.
+    Only failures to connect are retried here: prawcore already retries timeouts and server errors, and a request
+    that reached Reddit is never sent twice by this adapter.
+    :param session: requests.Session to configure, e.g. a RecordingSession. Defaults to a new Session.
+    :param pool_connections: int number of hosts whose pools are kept. praw talks to www.reddit.com and oauth.reddit.com.
+    :param pool_maxsize: int number of connections kept open per host. Should be at least the number of threads making requests.
+    :param retries: int number of times a failed connection attempt is retried.
+    :param backoff_factor: float seconds to wait before the second retry, doubling after each one. The first retry is immediate.
+    :param compress: bool, ask for gzip compressed responses.
+    :param stats: optional ApiCallStats the new connections are counted in.
+    :returns: the configured session.
+    """
+    session = requests.Session() if session is None else session
+    adapter = PooledHTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(total=retries, connect=retries, read=0, status=0, other=0, backoff_factor=backoff_factor),
+        stats=stats
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Accept-Encoding'] = 'gzip, deflate' if compress else 'identity'
+    session.headers['Connection'] = 'keep-alive'
+    return session
+
+CASSETTE_VERSION = 1
+
+# Response fields holding credentials. They are replaced before a response is written to a cassette.
+_SECRET_FIELDS = ('access_token', 'refresh_token')
+# Response headers holding credentials or session cookies, replaced in the same way.
+_SECRET_HEADERS = ('set-cookie', 'authorization')
+
+class CassetteMiss(Exception):
+    """
+    Raised when a replayed request has no recorded response left in the cassette.
+    """
+
+def get_interaction_key(method: str, url: str, params) -> tuple:
+    """
+    Returns the key requests are matched on when replaying: the method, the url without its query, and the query parameters.
+    Request bodies are not part of the key, since they hold credentials and the text of replies.
+    """
+    if isinstance(params, dict):
+        params = params.items()
+    return method.upper(), url.split('?')[0].rstrip('/'), tuple(sorted((str(k), str(v)) for k, v in (params or ())))
+
+def _redact_body(text: str) -> str:
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        return text
+    if not isinstance(payload, dict) or not any(field in payload for field in _SECRET_FIELDS):
+        return text
+    for field in _SECRET_FIELDS:
+        if field in payload:
+            payload[field] = 'redacted'
+    return json.dumps(payload)
+
+def _redact_headers(headers) -> dict:
+    return {name: 'redacted' if name.lower() in _SECRET_HEADERS else value for name, value in headers.items()}
+
+class RecordingSession(requests.Session):
+    """
+    A requests Session that writes every request it makes, and the response, to a gzip compressed JSON lines cassette.
+    Pass it to the requestor as session (requestor_kwargs={'session': RecordingSession(path)}), then replay the cassette
+    with ReplaySession. Request bodies are not recorded, and access and refresh tokens, cookies and authorization
+    headers in responses are redacted.
+    Every line is written as a gzip member of its own, so a cassette cut off by a crash is readable up to its last whole line.
+    """
+    def __init__(self, path: str):
+        """
+        :param path: str path of the cassette. An existing file is overwritten.
+        """
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._write({'cassette': CASSETTE_VERSION, 'recorded_utc': time.time()})
+
+    def request(self, method, url, params=None, *args, **kwargs):
+        start = time.time()
+        response = super().request(method, url, params, *args, **kwargs)
+        self._write({
+            'method': method.upper(),
+            'url': url,
+            'params': sorted([str(k), str(v)] for k, v in (params.items() if isinstance(params, dict) else params or ())),
+            'seconds': time.time() - start,
+            'status': response.status_code,
+            'headers': _redact_headers(response.headers),
+            'body': _redact_body(response.text)
+        })
+        return response
+
+    def _write(self, record: dict) -> None:
+        with self._lock:
+            self._file.write(gzip.compress((json.dumps(record) + '\n').encode('utf-8')))
+            self._file.flush() # keeps the cassette readable if the bot dies mid-run.
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+        super().close()
+
+class ReplaySession:
+    """
+    A stand-in for a requests Session that answers requests from a cassette written by RecordingSession, without any network access.
+    Each request is answered with the next unused response recorded for the same method, url and query parameters.
+    With realtime, every response takes as long as it did when recorded; otherwise responses are immediate, and the
+    rate limit headers are dropped so that prawcore does not wait between requests either.
+    """
+    def __init__(self, path: str, realtime: bool = False):
+        """
+        :param path: str path of the cassette.
+        :param realtime: bool, replay the original response times.
+        :raises ValueError: if the file is not a cassette this version can read.
+        """
+        self.path = path
+        self.realtime = realtime
+        self.headers = CaseInsensitiveDict()
+        self.replayed = 0
+        self._lock = threading.Lock()
+        self._interactions = defaultdict(deque)
+        with gzip.open(path, 'rt', encoding='utf-8') as fd:
+            header = json.loads(fd.readline() or '{}')
+            if header.get('cassette') != CASSETTE_VERSION:
+                raise ValueError(f"{path} is not a version {CASSETTE_VERSION} cassette.")
+            for line in self._read_lines(fd):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break # the recording was cut off mid-line.
+                self._interactions[get_interaction_key(record['method'], record['url'], record['params'])].append(record)
+
+    @staticmethod
+    def _read_lines(fd):
+        # A recording cut off mid-write ends in a partial gzip member. Everything before it is still replayed.
+        try:
+            for line in fd:
+                yield line
+        except (EOFError, OSError, zlib.error):
+            return
+
+    @property
+    def remaining(self) -> int:
+        """
+        Number of recorded responses not replayed yet.
+        """
+        return sum(len(queue) for queue in self._interactions.values())
+
+    def request(self, method, url, params=None, *args, **kwargs) -> requests.Response:
+        """
+        Returns the next recorded response for this request.
+        :raises CassetteMiss: if there is none left.
+        """
+        key = get_interaction_key(method, url, params)
+        with self._lock:
+            queue = self._interactions.get(key)
+            if not queue:
+                raise CassetteMiss(f"No recorded response left for {key[0]} {key[1]} {dict(key[2])}.")
+            record = queue.popleft()
+            self.replayed += 1
+        if self.realtime:
+            time.sleep(record['seconds'])
+
+        response = requests.Response()
+        response.status_code = record['status']
+        response.url = url
+        response.headers = CaseInsensitiveDict(record['headers'])
+        response.headers.pop('Content-Encoding', None) # the body is stored decoded.
+        if not self.realtime:
+            for header in [name for name in response.headers if name.lower().startswith('x-ratelimit')]:
+                del response.headers[header]
+        response._content = record['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        return response
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,195 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .catalog_funcs import SharedCatalog
+
+# Joins the title and selftext of a submission. Titles never contain it, so no title can match across the two.
+ENTITY_TEXT_SEPARATOR = '\x00'
+
+class EntityRecord:
+    """
+    A detached copy of the parts of a reddit comment or submission the bot uses.
+    Built once when the entity is fetched; after that the PRAW object can be released,
+    and nothing downstream can trigger a lazy fetch by touching one of its attributes.
+    Records compare and hash by fullname, so they can be used as dict keys in place of the entity.
+    """
+    __slots__ = ('fullname', 'kind', 'author', 'created_utc', 'text', 'parent_id', 'subreddit', 'fetched_utc')
+
+    def __init__(self, fullname: str, kind: str, author: str, created_utc: float, text: str, parent_id: str = None,
+                 subreddit: str = '', fetched_utc: float = None):
+        """
+        :param fullname: the entity's fullname, e.g. t1_abcdef.
+        :param kind: 't1' for comments, 't3' for submissions.
+        :param author: lower case username of the author.
+        :param created_utc: float unix timestamp the entity was created at.
+        :param text: lower case text scanned for books, see get_entity_text.
+        :param parent_id: fullname of the parent of a comment, None for submissions.
+        :param subreddit: lower case name of the subreddit the entity was posted in.
+        :param fetched_utc: float unix timestamp the bot fetched the entity at. Defaults to now.
+        """
+        self.fullname = fullname
+        self.kind = kind
+        self.author = author
+        self.created_utc = created_utc
+        self.text = text
+        self.parent_id = parent_id
+        self.subreddit = subreddit
+        self.fetched_utc = fetched_utc if fetched_utc is not None else time.time()
+
+    @classmethod
+    def from_entity(cls, entity, fetched_utc: float = None):
+        """
+        Builds a record from a PRAW comment or submission, reading only attributes present on listing results.
+        :param entity: A reddit comment or submission.
+        :param fetched_utc: float unix timestamp the entity was fetched at. Defaults to now.
+        :returns: EntityRecord
+        :raises ValueError: If entity is not a valid comment or submission.
+        """
+        fullname = entity.fullname
+        kind = fullname.partition('_')[0]
+        if kind not in ('t1', 't3'):
+            raise ValueError("Entity submitted is not a valid submission or comment.")
+        subreddit = entity.subreddit
+        return cls(
+            fullname,
+            kind,
+            str(entity.author).lower(),
+            entity.created_utc,
+            get_entity_text(entity, kind).lower(),
+            entity.parent_id if kind == 't1' else None,
+            subreddit.display_name.lower() if subreddit is not None else '',
+            fetched_utc
+        )
+
+    @property
+    def id(self) -> str:
+        return self.fullname.partition('_')[2]
+
+    def __eq__(self, other):
+        return isinstance(other, EntityRecord) and self.fullname == other.fullname
+
+    def __hash__(self):
+        return hash(self.fullname)
+
+    def __repr__(self):
+        return f"EntityRecord({self.fullname})"
+
+def get_entity_text(entity, type_string: str) -> str:
+    """
+    Returns the text of a reddit entity that is scanned for books: title and selftext for submissions, body for comments.
+    :param entity: A reddit comment or submission.
+    :param type_string: the entity's fullname prefix, 't1' or 't3'.
+    :returns: str
+    """
+    if type_string == 't3':
+        return entity.title + ENTITY_TEXT_SEPARATOR + entity.selftext
+    return entity.body
+
+def match_records(records, matcher) -> list:
+    """
+    Runs a TitleMatcher over a batch of scan records in this process.
+    :param records: sequence of tuple(fullname, author, text).
+    :param matcher: TitleMatcher, or SharedCatalog in a scan worker.
+    :returns: list[tuple(fullname, list[title])] in the order of records.
+    """
+    return [(fullname, matcher.match(text)) for fullname, author, text in records]
+
+_worker_catalog = None
+
+def _init_scan_worker(catalog_name: str):
+    global _worker_catalog
+    _worker_catalog = SharedCatalog.attach(catalog_name)
+
+def _match_records_in_worker(records) -> list:
+    return match_records(records, _worker_catalog)
+
+class ScanPool:
+    """
+    Matches large batches of scan records across a pool of worker processes.
+    The title index is placed in shared memory once and each worker matches against it there, see SharedCatalog,
+    so the memory used by a worker does not grow with the size of the catalog.
+    A pool is tied to the titles it was created with (see fingerprint), and must be recreated when they change.
+    """
+    def __init__(self, catalog, workers: int = None, threshold: int = 2000, chunk_size: int = 250):
+        """
+        :param catalog: CatalogSnapshot to match against.
+        :param workers: number of worker processes. Defaults to the number of CPUs.
+        :param threshold: batches smaller than this are matched in the calling process, see scan_records.
+        :param chunk_size: number of records sent to a worker at a time.
+        """
+        self.fingerprint = catalog.matcher.fingerprint
+        self.workers = workers or os.cpu_count() or 1
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+        self._shared_catalog = SharedCatalog.create(catalog)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_scan_worker,
+            initargs=(self._shared_catalog.name,)
+        )
+
+    def scan(self, records) -> list:
+        """
+        Matches records in the worker processes.
+        :param records: sequence of tuple(fullname, author, text).
+        :returns: list[tuple(fullname, list[title])] in the order of records.
+        """
+        chunks = [records[i:i + self.chunk_size] for i in range(0, len(records), self.chunk_size)]
+        results = []
+        for chunk_results in self._executor.map(_match_records_in_worker, chunks):
+            results.extend(chunk_results)
+        return results
+
+    def close(self) -> None:
+        """
+        Stops the worker processes and releases the shared catalog.
+        """
+        self._executor.shutdown()
+        self._shared_catalog.close()
+        self._shared_catalog.unlink()
+
+def scan_records(records, matcher, pool: ScanPool = None) -> dict:
+    """
+    Matches a batch of scan records, in the process pool if one is given and the batch is at least its threshold,
+    otherwise in this process.
+    :param records: sequence of tuple(fullname, author, text).
+    :param matcher: TitleMatcher used when matching in this process.
+    :param pool: optional ScanPool.
+    :returns: dict[fullname] = list[title]
+    """
+    if pool is not None and len(records) >= pool.threshold:
+        return dict(pool.scan(records))
+    return dict(match_records(records, matcher))
+
+def scan_entities(entities, matcher, replied_entries, opted_in_users, pool: ScanPool = None) -> dict:
+    """
+    Batch version of scan_entity. Scans many comments and submissions at once.
+    Entities already replied to or by authors who have not opted in are dropped first, reading only their fullname
+    and author. Only the rest are converted to EntityRecords (records passed in are used as they are) and matched.
+    :param entities: iterable of reddit comments, submissions and/or EntityRecords.
+    :param matcher: TitleMatcher
+    :param replied_entries: collection of reddit ids (without type prefix) already replied to.
+    :param opted_in_users: collection of opted in usernames, lower case.
+    :param pool: optional ScanPool, used if enough entities survive filtering. See scan_records.
+    :returns: dict[fullname] = list[title] for every entity that may be replied to, in the order given.
+    :raises ValueError: If an entity is not a valid comment or submission.
+    """
+    replied_entries = replied_entries if isinstance(replied_entries, (set, frozenset)) else set(replied_entries)
+    opted_in_users = opted_in_users if isinstance(opted_in_users, (set, frozenset)) else set(opted_in_users)
+
+    survivors = []
+    for entity in entities:
+        if isinstance(entity, EntityRecord):
+            record = entity
+            if record.id not in replied_entries and record.author in opted_in_users:
+                survivors.append((record.fullname, record.author, record.text))
+            continue
+        kind, _, entity_id = entity.fullname.partition('_')
+        if kind not in ('t1', 't3'):
+            raise ValueError("Entity submitted is not a valid submission or comment.")
+        if entity_id in replied_entries or str(entity.author).lower() not in opted_in_users:
+            continue
+        record = EntityRecord.from_entity(entity)
+        survivors.append((record.fullname, record.author, record.text))
+    return scan_records(survivors, matcher, pool)
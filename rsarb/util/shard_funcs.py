@@ -0,0 +1,236 @@
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+class HashRing:
+    """
+    Consistent hashing of keys (subreddits) onto nodes (workers).
+    Each node is placed on the ring at replicas points; a key belongs to the node at the first point after the key's hash.
+    Adding or removing a node only moves the keys next to that node's points, about 1/len(nodes) of them.
+    """
+    def __init__(self, nodes=(), replicas: int = 100):
+        """
+        :param nodes: iterable of str node names.
+        :param replicas: number of points per node. More points spread keys more evenly.
+        """
+        self.replicas = replicas
+        self._points = [] # sorted hashes
+        self._owners = {} # hash -> node
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            if point in self._owners: # a collision between nodes, vanishingly rare. Keep the first owner.
+                continue
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node: str) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self._points = [point for point in self._points if self._owners[point] != node]
+        self._owners = {point: owner for point, owner in self._owners.items() if owner != node}
+
+    def get_node(self, key: str) -> str:
+        """
+        Returns the node key belongs to.
+        :raises ValueError: if the ring has no nodes.
+        """
+        if not self._points:
+            raise ValueError("The ring has no nodes.")
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[i]]
+
+    def assign(self, keys) -> dict:
+        """
+        Returns dict[node] = sorted list of the keys belonging to it, with an entry for every node.
+        """
+        shards = {node: [] for node in self.nodes}
+        for key in keys:
+            shards[self.get_node(key)].append(key)
+        return {node: sorted(shard) for node, shard in shards.items()}
+
+def run_worker(config_file: str, name: str, index: int, assignments) -> None:
+    """
+    Process entry point of a coordinated worker: runs a bot that scans the subreddits assigned to name.
+    The assignment is re-read before every cycle, so shards can move without restarting the worker.
+    """
+    from ..RedditScanAndReplyBot import RedditScanAndReplyBot # imported here, the bot module imports this one.
+
+    rb = RedditScanAndReplyBot.from_file(config_file)
+    rb.subreddits_provider = lambda: assignments.get(name, '')
+    if rb.metrics_port is not None: # workers serve their metrics on the ports after the coordinator's.
+        rb.metrics_port += index + 1
+    rb.setup()
+    rb.run()
+
+class Coordinator:
+    """
+    Runs a bot in each of several worker processes, with the subreddits split between them by a HashRing.
+    All workers share the database, so replied entries and reply claims (see claim_reply) are shared.
+    When a worker dies its subreddits move to the surviving workers until it has been restarted.
+    """
+    def __init__(self, config_file: str, subreddits: list, workers: int, replicas: int = 100,
+                 restart_delay: float = 10, target=run_worker, stop_timeout: float = 30):
+        """
+        :param config_file: str path of the config file every worker reads.
+        :param subreddits: list of subreddit names to split.
+        :param workers: number of worker processes.
+        :param replicas: points per worker on the HashRing.
+        :param restart_delay: seconds to wait before restarting a worker that died.
+        :param target: callable run in each worker process with (config_file, name, index, assignments).
+        :param stop_timeout: seconds a worker is given to finish its cycle after SIGTERM before it is killed.
+            Should be longer than the workers' [SHUTDOWN] drain_seconds.
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1.")
+        self.config_file = config_file
+        self.subreddits = list(subreddits)
+        self.replicas = replicas
+        self.restart_delay = restart_delay
+        self.target = target
+        self.stop_timeout = stop_timeout
+        self.stopping = threading.Event()
+        self.names = [f"worker-{i}" for i in range(workers)]
+        self.ring = HashRing(replicas=replicas)
+        self.processes = {}
+        self.restart_at = {}
+        self._manager = None
+        self.assignments = None
+
+    def start(self) -> None:
+        """
+        Starts the workers.
+        """
+        self._manager = multiprocessing.Manager()
+        self.assignments = self._manager.dict()
+        for name in self.names:
+            self.ring.add(name)
+        self.rebalance()
+        for name in self.names:
+            self._spawn(name)
+
+    def _spawn(self, name: str) -> None:
+        process = multiprocessing.Process(
+            target=self.target,
+            args=(self.config_file, name, self.names.index(name), self.assignments),
+            name=name
+        )
+        process.start()
+        self.processes[name] = process
+
+    def rebalance(self) -> dict:
+        """
+        Publishes the subreddits of each worker on the ring, see HashRing.assign.
+        :returns: dict[name] = '+' joined subreddits, as published.
+        """
+        shards = {name: '+'.join(shard) for name, shard in self.ring.assign(self.subreddits).items()} if self.ring.nodes else {}
+        for name in self.names:
+            self.assignments[name] = shards.get(name, '')
+        for name in list(self.assignments.keys()):
+            if name not in self.names:
+                del self.assignments[name]
+        return shards
+
+    def resize(self, workers: int) -> None:
+        """
+        Changes the number of workers. Only the subreddits of added or removed workers change hands.
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1.")
+        names = [f"worker-{i}" for i in range(workers)]
+        for name in self.names[workers:]:
+            self.ring.remove(name)
+            self.restart_at.pop(name, None)
+        added = names[len(self.names):]
+        self.names = names
+        for name in added:
+            self.ring.add(name)
+        self.rebalance()
+        for name in list(self.processes):
+            if name not in self.names:
+                self._stop_process(self.processes.pop(name))
+        for name in added:
+            self._spawn(name)
+
+    def check(self, now: float = None) -> None:
+        """
+        Moves the subreddits of dead workers to the live ones, and restarts dead workers after restart_delay.
+        """
+        now = time.monotonic() if now is None else now
+        changed = False
+        for name, process in list(self.processes.items()):
+            if not process.is_alive():
+                logger.warning("Worker %s exited with code %s. Restarting in %ss.", name, process.exitcode, self.restart_delay)
+                del self.processes[name]
+                self.ring.remove(name)
+                self.restart_at[name] = now + self.restart_delay
+                changed = True
+        for name, restart_at in list(self.restart_at.items()):
+            if restart_at <= now:
+                del self.restart_at[name]
+                self.ring.add(name)
+                changed = True
+                self._spawn(name)
+        if changed:
+            self.rebalance()
+
+    def run(self, check_interval: float = 5) -> None:
+        """
+        Starts the workers and watches over them until interrupted, or until SIGTERM or SIGINT.
+        """
+        self.start()
+        # installed after starting the workers, which set up their own handlers.
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.request_stop)
+        try:
+            while not self.stopping.wait(check_interval):
+                self.check()
+        finally:
+            self.stop()
+
+    def request_stop(self, *args) -> None:
+        """
+        Makes run return. Takes and ignores any arguments, so it can be used as a signal handler.
+        """
+        self.stopping.set()
+
+    def _stop_process(self, process, timeout: float = None) -> None:
+        process.terminate()
+        self._join_process(process, timeout)
+
+    def _join_process(self, process, timeout: float = None) -> None:
+        process.join(self.stop_timeout if timeout is None else timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def stop(self) -> None:
+        """
+        Stops every worker. They are all sent SIGTERM at once and given stop_timeout seconds to finish.
+        """
+        for process in self.processes.values():
+            process.terminate()
+        deadline = time.monotonic() + self.stop_timeout
+        for process in self.processes.values():
+            self._join_process(process, max(0.0, deadline - time.monotonic()))
+        self.processes = {}
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
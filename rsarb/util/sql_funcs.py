@@ -1,7 +1,12 @@
 import sqlite3
 import os
+import time
 from urllib.request import pathname2url
 
+from .metrics_funcs import REGISTRY, get_percentile, timed
+
+SQL_WRITE_SECONDS = REGISTRY.histogram('rsarb_sql_write_seconds', 'Time taken by database writes, including the commit.', ('operation',))
+
 def get_sql_cursor(db_str: str) -> sqlite3.Cursor:
     """
     Takes a db_string. Either an existant database or :memory: is acceptable.
@@ -33,6 +38,17 @@ def get_books(session) -> list:
     books = list({str(book[0]).lower() for book in books})
     return books
 
+def get_book_db_entries(session) -> list:
+    """
+    Takes a sqlite3 cursor, retrieves every book in the books table in insertion order.
+    Entries have the same format as those returned by get_book_db_entry.
+    :param session: sqlite3.Cursor
+    :returns: list(dict) of book entries.
+    :raises sqlite3.ProgrammingError: if table is not found.
+    """
+    session.execute('SELECT title, author, isbn, uri, summary FROM books ORDER BY id')
+    return [{'title': row[0], 'author': row[1], 'isbn': row[2], 'uri': row[3], 'desc': row[4]} for row in session.fetchall()]
+
 def get_opted_in_users(session):
     """ 
     Connects to the sql database and returns a list of opted in users who wish to
@@ -47,6 +63,7 @@ def get_opted_in_users(session):
     opted_in_users = list({str(user[0]).lower() for user in opted_in_users})
     return opted_in_users
 
+@timed(SQL_WRITE_SECONDS, operation='add_opted_in_user')
 def add_opted_in_user(session, username:str):
     """
     Take a cusor and a reddit username, add that username to the opted in users database.
@@ -62,6 +79,7 @@ def add_opted_in_user(session, username:str):
     finally:
         session.connection.commit()
 
+@timed(SQL_WRITE_SECONDS, operation='remove_opted_in_user')
 def remove_opted_in_user(session, username:str):
     """
     Takes a sqlite3 cursor and a reddit username, removes the username from the opted_in_users database if found.
@@ -108,6 +126,30 @@ def get_replied_entries(session):
     already_replied = list({str(entry[0]) for entry in already_replied})
     return already_replied
 
+def get_replied_entries_since(session, last_id: int) -> list:
+    """
+    Takes sqlite3 cursor object and a row id, returns the reddit IDs of the replied entries added after that row.
+    :param session: sqlite3.Cursor
+    :param last_id: int id of the last row already read.
+    :returns: list(str)
+    """
+    session.execute("SELECT reddit_id FROM replied_entries WHERE id > ?", [last_id])
+    return [str(entry[0]) for entry in session.fetchall()]
+
+def get_table_marks(session) -> dict:
+    """
+    Takes a sqlite3 cursor, returns the row count and highest id of the replied_entries and opted_in_users tables.
+    Ids are never reused, so a table whose marks are unchanged has not been written to.
+    :param session: sqlite3.Cursor
+    :returns: dict[table] = tuple(count, max id)
+    """
+    marks = {}
+    for table in ('replied_entries', 'opted_in_users'):
+        session.execute(f"SELECT count(*), coalesce(max(id), 0) FROM {table}")
+        marks[table] = tuple(session.fetchone())
+    return marks
+
+@timed(SQL_WRITE_SECONDS, operation='add_replied_entry')
 def add_replied_entry(session, reddit_id: str, reply_succeeded: bool) -> None:
     """
     Takes a cursor and a reddit post fullname, adds that fullname to the opted in users table if not already present.
@@ -134,6 +176,289 @@ def update_replied_entry_table(session, entries: dict):
         if reddit_id not in current_entries:
             add_replied_entry(session, reddit_id, entries[reddit_id])
 
+def ensure_reply_latency_table(session) -> None:
+    """
+    Takes a sqlite3 cursor, creates the reply_latency table if it does not exist yet.
+    Each row holds the timestamps of one successful reply: when the entity was created on reddit,
+    when the bot fetched it, when the bot started posting the reply and when the reply was posted.
+    :param session: sqlite3.Cursor
+    """
+    session.execute('CREATE TABLE IF NOT EXISTS reply_latency (id integer PRIMARY KEY AUTOINCREMENT, reddit_id TEXT NOT NULL, subreddit TEXT NOT NULL, '
+                    'created_utc real NOT NULL, fetched_utc real NOT NULL, post_started_utc real NOT NULL, posted_utc real NOT NULL);')
+    session.execute('CREATE INDEX IF NOT EXISTS reply_latency_posted ON reply_latency (posted_utc)')
+
+@timed(SQL_WRITE_SECONDS, operation='add_reply_latency')
+def add_reply_latency(session, reddit_id: str, subreddit: str, created_utc: float, fetched_utc: float, post_started_utc: float, posted_utc: float) -> None:
+    """
+    Takes a sqlite3 cursor and the timestamps of one reply, records them in the reply_latency table.
+    :param session: sqlite3.Cursor
+    :param reddit_id: reddit id (without type prefix) of the entity replied to.
+    :param subreddit: str name of the subreddit the entity was posted in.
+    :param created_utc: float unix timestamp the entity was created at.
+    :param fetched_utc: float unix timestamp the bot fetched the entity at.
+    :param post_started_utc: float unix timestamp the bot started posting the reply at.
+    :param posted_utc: float unix timestamp the reply was posted at.
+    """
+    try:
+        ensure_reply_latency_table(session)
+        session.execute('INSERT INTO reply_latency (reddit_id, subreddit, created_utc, fetched_utc, post_started_utc, posted_utc) VALUES (?, ?, ?, ?, ?, ?)',
+                        [reddit_id, subreddit, created_utc, fetched_utc, post_started_utc, posted_utc])
+    finally:
+        session.connection.commit()
+
+def get_reply_latency_report(session, since_utc: float = 0.0, percents=(50, 95, 99)) -> dict:
+    """
+    Takes a sqlite3 cursor, returns percentiles of the reply latency per subreddit, for replies posted since since_utc.
+    The total latency (created to posted) is split into three stages that add up to it:
+    poll (created to fetched: waiting for the next polling cycle), queue (fetched to post started: scanning and
+    earlier replies in the same cycle) and post (post started to posted: the reply request itself).
+    :param session: sqlite3.Cursor
+    :param since_utc: float unix timestamp. Older replies are left out.
+    :param percents: percentiles to report.
+    :returns: dict[subreddit] = {'count': int, 'total'|'poll'|'queue'|'post': dict[percent] = seconds}
+    """
+    ensure_reply_latency_table(session)
+    session.execute('SELECT subreddit, fetched_utc - created_utc, post_started_utc - fetched_utc, posted_utc - post_started_utc, posted_utc - created_utc '
+                    'FROM reply_latency WHERE posted_utc >= ?', [since_utc])
+    stages = {}
+    for subreddit, poll, queue, post, total in session.fetchall():
+        by_stage = stages.setdefault(subreddit, {'total': [], 'poll': [], 'queue': [], 'post': []})
+        by_stage['total'].append(total)
+        by_stage['poll'].append(poll)
+        by_stage['queue'].append(queue)
+        by_stage['post'].append(post)
+
+    report = {}
+    for subreddit in sorted(stages):
+        report[subreddit] = {'count': len(stages[subreddit]['total'])}
+        for stage, values in stages[subreddit].items():
+            values.sort()
+            report[subreddit][stage] = {percent: get_percentile(values, percent) for percent in percents}
+    return report
+
+def ensure_reply_claims_table(session) -> None:
+    """
+    Takes a sqlite3 cursor, creates the reply_claims table if it does not exist yet.
+    A claim row marks an entity one bot process is about to reply to, see claim_reply.
+    :param session: sqlite3.Cursor
+    """
+    session.execute('CREATE TABLE IF NOT EXISTS reply_claims (reddit_id TEXT PRIMARY KEY NOT NULL, owner TEXT NOT NULL, expires_utc real NOT NULL);')
+
+def ensure_replied_entries_index(session) -> None:
+    """
+    Takes a sqlite3 cursor, creates an index on replied_entries.reddit_id if it does not exist yet.
+    claim_reply checks every entity against replied_entries by reddit_id; without the index each check scans the whole table.
+    :param session: sqlite3.Cursor
+    """
+    session.execute('CREATE INDEX IF NOT EXISTS replied_entries_reddit_id ON replied_entries (reddit_id)')
+
+@timed(SQL_WRITE_SECONDS, operation='claim_reply')
+def claim_reply(session, reddit_id: str, owner: str, lease_seconds: float = 600, now: float = None) -> bool:
+    """
+    Takes a sqlite3 cursor and a reddit id, atomically claims the right to reply to that entity for owner.
+    Only one owner can hold a claim at a time, so bot processes sharing a database never reply to the same entity twice.
+    A claim expires after lease_seconds and can then be taken over, in case its owner died before replying.
+    Entities already in replied_entries cannot be claimed.
+    If another process holds the database's write lock for longer than the connection's timeout, the claim is not
+    taken and False is returned, so the entity is looked at again next cycle.
+    The reply_claims table must exist, see ensure_reply_claims_table.
+    :param session: sqlite3.Cursor
+    :param reddit_id: reddit id (without type prefix) of the entity to reply to.
+    :param owner: str identifying the claiming process, e.g. 'host:pid'.
+    :param lease_seconds: float number of seconds the claim is held for.
+    :param now: float unix timestamp to use as the current time. Defaults to time.time().
+    :returns: True if owner now holds the claim (including if it already did), False if another owner does or the entity was replied to.
+    """
+    now = time.time() if now is None else now
+    conn = session.connection
+    try:
+        if not conn.in_transaction:
+            session.execute('BEGIN IMMEDIATE') # takes the write lock now, so no other process can claim in between.
+        session.execute('SELECT 1 FROM replied_entries WHERE reddit_id = ?', [reddit_id])
+        if session.fetchone() is not None:
+            claimed = False
+        else:
+            session.execute('DELETE FROM reply_claims WHERE reddit_id = ? AND (expires_utc < ? OR owner = ?)', [reddit_id, now, owner])
+            session.execute('INSERT OR IGNORE INTO reply_claims (reddit_id, owner, expires_utc) VALUES (?, ?, ?)', [reddit_id, owner, now + lease_seconds])
+            claimed = session.rowcount == 1
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        if 'locked' in str(e) or 'busy' in str(e):
+            return False
+        raise e
+    except Exception as e:
+        conn.rollback()
+        raise e
+    conn.commit()
+    return claimed
+
+@timed(SQL_WRITE_SECONDS, operation='release_reply_claim')
+def release_reply_claim(session, reddit_id: str, owner: str) -> None:
+    """
+    Takes a sqlite3 cursor and a reddit id, drops owner's claim on that entity if it still holds it.
+    Called once the reply is recorded in replied_entries, or when posting failed so that another process may retry.
+    :param session: sqlite3.Cursor
+    :param reddit_id: reddit id (without type prefix).
+    :param owner: str the claim was taken with.
+    """
+    try:
+        session.execute('DELETE FROM reply_claims WHERE reddit_id = ? AND owner = ?', [reddit_id, owner])
+    finally:
+        session.connection.commit()
+
+def ensure_job_leases_table(session) -> None:
+    """
+    Takes a sqlite3 cursor, creates the job_leases table if it does not exist yet.
+    A lease row names the one process allowed to run a singleton job, see acquire_job_lease.
+    The row outlives its leases, so last_run_utc is kept when another process takes the job over.
+    :param session: sqlite3.Cursor
+    """
+    session.execute('CREATE TABLE IF NOT EXISTS job_leases (job TEXT PRIMARY KEY NOT NULL, owner TEXT NOT NULL, expires_utc real NOT NULL, last_run_utc real NOT NULL DEFAULT 0);')
+
+@timed(SQL_WRITE_SECONDS, operation='acquire_job_lease')
+def acquire_job_lease(session, job: str, owner: str, lease_seconds: float = 180, now: float = None) -> bool:
+    """
+    Takes a sqlite3 cursor and a job name, atomically acquires or renews the lease on that job for owner.
+    Only one owner holds a job's lease at a time; the holder renews it (heartbeats) by calling this again before it expires.
+    Once a lease expires, because its owner died or stopped renewing it, the next owner to call this takes the job over.
+    :param session: sqlite3.Cursor
+    :param job: str name of the job.
+    :param owner: str identifying the calling process, e.g. 'host:pid'.
+    :param lease_seconds: float number of seconds the lease is held for.
+    :param now: float unix timestamp to use as the current time. Defaults to time.time().
+    :returns: True if owner now holds the lease, False if another owner does.
+    """
+    now = time.time() if now is None else now
+    conn = session.connection
+    try:
+        ensure_job_leases_table(session)
+        if not conn.in_transaction:
+            session.execute('BEGIN IMMEDIATE') # takes the write lock now, so no other process can acquire in between.
+        session.execute('UPDATE job_leases SET owner = ?, expires_utc = ? WHERE job = ? AND (expires_utc < ? OR owner = ?)', [owner, now + lease_seconds, job, now, owner])
+        if session.rowcount == 1:
+            acquired = True
+        else:
+            session.execute('INSERT OR IGNORE INTO job_leases (job, owner, expires_utc) VALUES (?, ?, ?)', [job, owner, now + lease_seconds])
+            acquired = session.rowcount == 1
+    except Exception as e:
+        conn.rollback()
+        raise e
+    conn.commit()
+    return acquired
+
+@timed(SQL_WRITE_SECONDS, operation='release_job_lease')
+def release_job_lease(session, job: str, owner: str) -> None:
+    """
+    Takes a sqlite3 cursor and a job name, expires owner's lease on that job if it still holds it,
+    so that another process can take the job over straight away instead of waiting for the lease to run out.
+    :param session: sqlite3.Cursor
+    :param job: str name of the job.
+    :param owner: str the lease was acquired with.
+    """
+    try:
+        ensure_job_leases_table(session)
+        session.execute('UPDATE job_leases SET expires_utc = 0 WHERE job = ? AND owner = ?', [job, owner])
+    finally:
+        session.connection.commit()
+
+@timed(SQL_WRITE_SECONDS, operation='record_job_run')
+def record_job_run(session, job: str, owner: str, now: float = None) -> bool:
+    """
+    Takes a sqlite3 cursor and a job name, records that owner finished a run of the job at now.
+    :param session: sqlite3.Cursor
+    :param job: str name of the job.
+    :param owner: str the lease was acquired with.
+    :param now: float unix timestamp of the run. Defaults to time.time().
+    :returns: True if recorded, False if owner no longer holds the job's lease.
+    """
+    now = time.time() if now is None else now
+    try:
+        ensure_job_leases_table(session)
+        session.execute('UPDATE job_leases SET last_run_utc = ? WHERE job = ? AND owner = ?', [now, job, owner])
+        recorded = session.rowcount == 1
+    finally:
+        session.connection.commit()
+    return recorded
+
+def get_job_lease(session, job: str) -> dict:
+    """
+    Takes a sqlite3 cursor and a job name, returns its lease.
+    :param session: sqlite3.Cursor
+    :param job: str name of the job.
+    :returns: dict with keys job, owner, expires_utc and last_run_utc, or None if the job never had a lease.
+    """
+    ensure_job_leases_table(session)
+    session.execute('SELECT job, owner, expires_utc, last_run_utc FROM job_leases WHERE job = ?', [job])
+    row = session.fetchone()
+    if row is None:
+        return None
+    return dict(zip(('job', 'owner', 'expires_utc', 'last_run_utc'), row))
+
+def get_database_stats(session, now: float = None) -> dict:
+    """
+    Takes a sqlite3 cursor, returns row counts and sizes describing the database.
+    Only reads: tables the bot creates on first use (reply_latency, reply_claims, job_leases) are reported as empty
+    if they do not exist yet, rather than created.
+    :param session: sqlite3.Cursor
+    :param now: float unix timestamp used to tell expired claims and leases. Defaults to time.time().
+    :returns: dict with keys books, catalog_revision, replied_entries, failed_replies, opted_in_users,
+        reply_latency_rows, active_claims, expired_claims, job_leases (dict[job] = dict, see get_job_lease) and size_bytes.
+    """
+    now = time.time() if now is None else now
+    session.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = {name for name, in session.fetchall()}
+
+    def count(table, where='', parameters=()):
+        if table not in tables:
+            return 0
+        session.execute(f'SELECT count(*) FROM {table} {where}', parameters)
+        return session.fetchone()[0]
+
+    def pragma(name):
+        session.execute(f'PRAGMA {name}')
+        return session.fetchone()[0]
+
+    stats = {
+        'books': count('books'),
+        'catalog_revision': get_catalog_revision(session),
+        'replied_entries': count('replied_entries'),
+        'failed_replies': count('replied_entries', 'WHERE reply_succeeded_bool = 0'),
+        'opted_in_users': count('opted_in_users'),
+        'reply_latency_rows': count('reply_latency'),
+        'active_claims': count('reply_claims', 'WHERE expires_utc >= ?', [now]),
+        'expired_claims': count('reply_claims', 'WHERE expires_utc < ?', [now]),
+        'job_leases': {}
+    }
+    if 'job_leases' in tables:
+        session.execute('SELECT job, owner, expires_utc, last_run_utc FROM job_leases ORDER BY job')
+        stats['job_leases'] = {row[0]: dict(zip(('job', 'owner', 'expires_utc', 'last_run_utc'), row)) for row in session.fetchall()}
+    stats['size_bytes'] = pragma('page_count') * pragma('page_size')
+    return stats
+
+@timed(SQL_WRITE_SECONDS, operation='prune')
+def prune_database(session, before_utc: float, now: float = None) -> dict:
+    """
+    Takes a sqlite3 cursor, deletes reply latency rows for replies posted before before_utc and reply claims that have expired.
+    Replied entries are never deleted, as the bot would reply to those entities again.
+    :param session: sqlite3.Cursor
+    :param before_utc: float unix timestamp. Latency rows of replies posted before it are deleted.
+    :param now: float unix timestamp used to tell expired claims. Defaults to time.time().
+    :returns: dict with keys reply_latency_rows and expired_claims, the number of rows deleted from each.
+    """
+    now = time.time() if now is None else now
+    try:
+        ensure_reply_latency_table(session)
+        ensure_reply_claims_table(session)
+        session.execute('DELETE FROM reply_latency WHERE posted_utc < ?', [before_utc])
+        latency_rows = session.rowcount
+        session.execute('DELETE FROM reply_claims WHERE expires_utc < ?', [now])
+        expired_claims = session.rowcount
+    except Exception as e:
+        session.connection.rollback()
+        raise e
+    session.connection.commit()
+    return {'reply_latency_rows': latency_rows, 'expired_claims': expired_claims}
+
 def get_book_db_entry(session, title: str) -> dict:
     """
     Accepts a title of a book. Returns the database entry for that book in a formatted block.
@@ -157,6 +482,74 @@ def get_book_db_entry(session, title: str) -> dict:
 
     return book_data
 
+def get_catalog_revision(session) -> int:
+    """
+    Takes a sqlite3 cursor, returns the revision number of the books table.
+    The revision is stored in the database's user_version and is bumped every time the catalog is bulk loaded,
+    so that running bots can tell their cached copy of the catalog is stale.
+    :param session: sqlite3.Cursor
+    :returns: int
+    """
+    session.execute('PRAGMA user_version')
+    return session.fetchone()[0]
+
+def ensure_books_title_index(session) -> None:
+    """
+    Takes a sqlite3 cursor, creates a case insensitive index on books.title if it does not exist yet.
+    Title lookups (get_book_db_entry, upsert_books) use this index instead of scanning the whole table.
+    :param session: sqlite3.Cursor
+    """
+    session.execute('CREATE INDEX IF NOT EXISTS books_title_nocase ON books (title COLLATE NOCASE)')
+
+@timed(SQL_WRITE_SECONDS, operation='upsert_books')
+def upsert_books(session, rows, batch_size: int = 5000) -> int:
+    """
+    Takes a sqlite3 cursor and an iterable of (title, author, isbn, uri, summary) tuples.
+    Inserts books not yet in the books table and updates those already present (matched on title, case insensitive).
+    Rows are written in batches of batch_size with executemany, all inside a single transaction;
+    if any batch fails nothing is written. The catalog revision is bumped on success.
+    When a title appears more than once, the last row wins.
+    :param session: sqlite3.Cursor
+    :param rows: iterable of tuple(title, author, isbn, uri, summary). May be a generator.
+    :param batch_size: number of rows per executemany call.
+    :returns: int count of distinct titles written (case insensitive). Rows repeating a title are not counted again.
+    :raises sqlite3.Error: if the rows cannot be written. The transaction is rolled back.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1.")
+
+    titles = set()
+    conn = session.connection
+    try:
+        if not conn.in_transaction:
+            session.execute('BEGIN')
+        ensure_books_title_index(session)
+        batch = {}
+        for row in rows:
+            batch[row[0].lower()] = row
+            titles.add(row[0].lower())
+            if len(batch) >= batch_size:
+                _write_book_batch(session, list(batch.values()))
+                batch = {}
+        if batch:
+            _write_book_batch(session, list(batch.values()))
+        revision = get_catalog_revision(session)
+        session.execute(f'PRAGMA user_version = {int(revision) + 1}')
+    except Exception as e:
+        conn.rollback()
+        raise e
+    conn.commit()
+    return len(titles)
+
+def _write_book_batch(session, batch: list) -> None:
+    session.executemany(
+        'UPDATE books SET title = ?, author = ?, isbn = ?, uri = ?, summary = ? WHERE title = ? COLLATE NOCASE',
+        [(title, author, isbn, uri, summary, title) for title, author, isbn, uri, summary in batch])
+    session.executemany(
+        'INSERT INTO books (title, author, isbn, uri, summary) SELECT ?, ?, ?, ?, ? '
+        'WHERE NOT EXISTS (SELECT 1 FROM books WHERE title = ? COLLATE NOCASE)',
+        [(title, author, isbn, uri, summary, title) for title, author, isbn, uri, summary in batch])
+
 def create_database(db_str: str):
     """
     Takes a file path and creates a database at that location if the file does not already exist.
@@ -209,7 +602,11 @@ def create_database(db_str: str):
             if not expected_replied_entries == re:
                 raise sqlite3.ProgrammingError("Table 'replied_entries' does not match the expected schema.")
 
-            return #if it already exists and matches the schema, silently do nothing.
+            # databases created before the index and the claims table were added.
+            ensure_replied_entries_index(cur)
+            ensure_reply_claims_table(cur)
+            conn.commit()
+            return #if it already exists and matches the schema, do nothing else.
 
         except Exception as exception:
             raise exception
@@ -220,4 +617,9 @@ def create_database(db_str: str):
         cur.execute('CREATE TABLE books(id integer PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, author text NOT NULL, isbn text NOT NULL, uri text, summary text not null);')
         cur.execute('CREATE TABLE replied_entries (id integer PRIMARY KEY AUTOINCREMENT, reddit_id TEXT NOT NULL, reply_succeeded_bool integer NOT NULL);')
         cur.execute('CREATE TABLE opted_in_users (id integer PRIMARY KEY AUTOINCREMENT, reddit_username TEXT NOT NULL);')
+        ensure_reply_latency_table(cur)
+        ensure_reply_claims_table(cur)
+        ensure_job_leases_table(cur)
+        ensure_books_title_index(cur)
+        ensure_replied_entries_index(cur)
         conn.commit()
\ No newline at end of file
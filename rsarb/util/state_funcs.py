@@ -0,0 +1,135 @@
+import gzip
+import json
+import os
+
+from .sql_funcs import get_catalog_revision, get_opted_in_users, get_replied_entries, get_replied_entries_since, get_table_marks
+
+STATE_SNAPSHOT_VERSION = 2
+STATE_SNAPSHOT_SUFFIX = '.state'
+
+def get_state_snapshot_path(db_path: str) -> str:
+    """
+    Takes the path of a database file, returns the path of the state snapshot stored next to it.
+    :param db_path: str
+    :returns: str
+    """
+    return db_path + STATE_SNAPSHOT_SUFFIX
+
+class BotState:
+    """
+    What the bot keeps in memory between cycles: copies of the replied_entries and opted_in_users tables, and the
+    comment count of each submission when its comments were last scanned, with the time they were fetched, so that
+    submissions without new comments are not fetched again until rescan_seconds have passed (see has_new_comments).
+    The copies follow the database by its table marks (see get_table_marks): new replied entries are read
+    incrementally, any other change reloads the table. The state can be saved to a snapshot file on shutdown
+    and loaded on start if the database has not changed in between.
+    """
+    def __init__(self):
+        self.replied_entries = set()
+        self.opted_in_users = set()
+        self.marks = {}
+        self.catalog_revision = None
+        self.matcher_fingerprint = b''
+        self.comment_counts = {} # submission fullname -> num_comments when its comments were scanned.
+        self.scanned_utc = {} # submission fullname -> unix timestamp its comments were last fetched at.
+
+    def refresh(self, session) -> None:
+        """
+        Takes a sqlite3 cursor, brings the copies of the tables up to date with the database.
+        Changes to the opted in users or the catalog revision drop the comment counts, as older comments may now need a reply.
+        :param session: sqlite3.Cursor
+        """
+        marks = get_table_marks(session)
+        old, new = self.marks.get('replied_entries'), marks['replied_entries']
+        if old != new:
+            added = get_replied_entries_since(session, old[1]) if old is not None else None
+            if added is not None and new[0] - old[0] == len(added):
+                self.replied_entries.update(added)
+            else: # rows were deleted, reload.
+                self.replied_entries = set(get_replied_entries(session))
+        if self.marks.get('opted_in_users') != marks['opted_in_users']:
+            self.opted_in_users = set(get_opted_in_users(session))
+            self.comment_counts = {}
+        self.marks = marks
+
+        revision = get_catalog_revision(session)
+        if revision != self.catalog_revision:
+            self.catalog_revision = revision
+            self.comment_counts = {}
+
+    def check_matcher(self, fingerprint: bytes) -> None:
+        """
+        Drops the comment counts if the catalog's titles changed since they were taken.
+        :param fingerprint: bytes fingerprint of the TitleMatcher scanned with.
+        """
+        if fingerprint != self.matcher_fingerprint:
+            self.matcher_fingerprint = fingerprint
+            self.comment_counts = {}
+
+    def has_new_comments(self, fullname: str, num_comments, now: float = None, rescan_seconds: float = None) -> bool:
+        """
+        Returns False if the submission's comments were scanned when it had num_comments comments, less than
+        rescan_seconds before now, True otherwise.
+        An unchanged count does not prove that nothing changed: an edit adding a title, or a comment deleted and
+        another added, leave it as it was. rescan_seconds bounds how long such changes can go unseen.
+        :param fullname: str fullname of the submission.
+        :param num_comments: int comment count from the listing, or None if unknown.
+        :param now: float unix timestamp of the current cycle. Only needed with rescan_seconds.
+        :param rescan_seconds: float age after which comments are fetched again regardless of the count. None never refetches.
+        """
+        if num_comments is None or self.comment_counts.get(fullname) != num_comments:
+            return True
+        return rescan_seconds is not None and now - self.scanned_utc.get(fullname, 0.0) >= rescan_seconds
+
+    def save(self, path: str) -> None:
+        """
+        Writes the state to a gzip compressed JSON snapshot file.
+        The file is written next to its final location and renamed into place, so readers never see a partial file.
+        :param path: str path of the snapshot file.
+        """
+        state = {
+            'version': STATE_SNAPSHOT_VERSION,
+            'catalog_revision': self.catalog_revision,
+            'marks': self.marks,
+            'matcher_fingerprint': self.matcher_fingerprint.hex(),
+            'replied_entries': sorted(self.replied_entries),
+            'opted_in_users': sorted(self.opted_in_users),
+            'comment_counts': self.comment_counts,
+            'scanned_utc': self.scanned_utc
+        }
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as fd:
+            json.dump(state, fd, separators=(',', ':'))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str, session):
+        """
+        Reads a snapshot written by save, if it still matches the database.
+        PRAGMA data_version only compares within one connection, so the snapshot is checked against
+        the catalog revision (PRAGMA user_version) and the table marks instead.
+        :param path: str path of the snapshot file.
+        :param session: sqlite3.Cursor of the database the snapshot was taken from.
+        :returns: BotState, or None if the file is missing, of another version, corrupt or out of date.
+        """
+        if not os.path.isfile(path):
+            return None
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as fd:
+                snapshot = json.load(fd)
+            if snapshot.get('version') != STATE_SNAPSHOT_VERSION:
+                return None
+            marks = {table: tuple(mark) for table, mark in snapshot['marks'].items()}
+            if marks != get_table_marks(session) or snapshot['catalog_revision'] != get_catalog_revision(session):
+                return None
+            state = cls()
+            state.marks = marks
+            state.catalog_revision = snapshot['catalog_revision']
+            state.matcher_fingerprint = bytes.fromhex(snapshot['matcher_fingerprint'])
+            state.replied_entries = set(snapshot['replied_entries'])
+            state.opted_in_users = set(snapshot['opted_in_users'])
+            state.comment_counts = {fullname: int(count) for fullname, count in snapshot['comment_counts'].items()}
+            state.scanned_utc = {fullname: float(scanned) for fullname, scanned in snapshot['scanned_utc'].items()}
+        except (OSError, EOFError, ValueError, KeyError, TypeError, AttributeError):
+            return None # corrupt or truncated, start from the database.
+        return state
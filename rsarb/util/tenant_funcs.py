@@ -0,0 +1,115 @@
+import functools
+import logging
+import signal
+import threading
+
+import schedule
+
+from .catalog_funcs import BookCatalog, CatalogCache
+from .metrics_funcs import start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+class TenantRuntime:
+    """
+    Hosts several bot accounts (tenants), each with its own config file, in one process.
+    Tenants whose books tables hold the same books share one catalog snapshot and title matcher, see CatalogCache.
+    Each keeps its own Reddit connection and rate limit budget, database, replied entries and opted in users.
+    The tenants' jobs take turns on one scheduler. A job that raises is logged and does not stop the other tenants.
+    """
+    def __init__(self, bots: dict, cache: CatalogCache = None):
+        """
+        :param bots: dict[name] = RedditScanAndReplyBot, not set up yet. name identifies the tenant in logs.
+        :param cache: CatalogCache the tenants share. Defaults to a new one.
+        :raises ValueError: if bots is empty.
+        """
+        if not bots:
+            raise ValueError("At least one bot is needed.")
+        self.cache = CatalogCache() if cache is None else cache
+        self.bots = dict(bots)
+        self.scheduler = schedule.Scheduler()
+        self.stopping = threading.Event()
+        for name, bot in self.bots.items():
+            bot.catalog = BookCatalog(cache=self.cache)
+            if bot.get_option('CLAIMS', 'owner') is None:
+                # the default owner is host:pid, which all tenants share. Tenants sharing a database need distinct owners.
+                bot.worker_id = f"{bot.worker_id}:{name}"
+
+    @classmethod
+    def from_files(cls, config_files, cache: CatalogCache = None):
+        """
+        Reads a bot from each config file, see RedditScanAndReplyBot.from_file. Tenants are named after their Reddit username.
+        :param config_files: iterable of str config file paths.
+        :param cache: optional CatalogCache, see __init__.
+        :raises ValueError: if two config files are for the same username.
+        """
+        from ..RedditScanAndReplyBot import RedditScanAndReplyBot # imported here, the bot module imports this one.
+
+        bots = {}
+        for config_file in config_files:
+            bot = RedditScanAndReplyBot.from_file(config_file)
+            name = bot.configs['PRAW']['username']
+            if name in bots:
+                raise ValueError(f"Account {name} is configured in more than one config file.")
+            bots[name] = bot
+        return cls(bots, cache)
+
+    def setup(self) -> None:
+        """
+        Connects every tenant to its database and Reddit, and adds their periodic tasks to the scheduler.
+        """
+        for name, bot in self.bots.items():
+            bot.setup()
+            scheduled = len(self.scheduler.jobs)
+            bot.schedule_jobs(self.scheduler)
+            for job in self.scheduler.jobs[scheduled:]:
+                job.job_func = self._guard(name, job.job_func)
+                job.tag(name)
+
+    def _guard(self, name: str, function):
+        @functools.wraps(function)
+        def guarded():
+            try:
+                return function()
+            except Exception:
+                logger.exception("Tenant %s: %s failed.", name, getattr(function, 'func', function))
+        return guarded
+
+    def run(self) -> None:
+        """
+        Sets the tenants up and runs their periodic tasks. This is the main loop.
+        The metrics server is started with the [METRICS] settings of the first tenant that has a port set.
+        SIGUSR1 profiles the next cycle of every tenant. SIGTERM and SIGINT stop every tenant, see request_stop.
+        """
+        for bot in self.bots.values():
+            if bot.metrics_port is not None:
+                server = start_metrics_server(bot.metrics_port, bot.get_option('METRICS', 'host', '127.0.0.1'))
+                logger.info("Serving metrics at http://%s:%d/metrics", *server.server_address[:2])
+                break
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.request_profiles)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.request_stop)
+        self.setup()
+        try:
+            while not self.stopping.is_set():
+                self.scheduler.run_pending()
+                self.stopping.wait(1)
+        finally:
+            for bot in self.bots.values():
+                bot.shutdown()
+
+    def request_stop(self, *args) -> None:
+        """
+        Asks every tenant to stop, see RedditScanAndReplyBot.request_stop. Can be used as a signal handler.
+        """
+        for bot in self.bots.values():
+            bot.request_stop()
+        self.stopping.set()
+
+    def request_profiles(self, *args) -> None:
+        """
+        Profiles the next cycle of every tenant, see CycleProfiler.request.
+        """
+        for bot in self.bots.values():
+            bot.profiler.request()
@@ -5,6 +5,7 @@ import praw, prawcore # type: ignore
 import pytest
 import sqlite3
 import os
+import random
 
 ### PRAW MOCKS ###
 @pytest.fixture
@@ -27,7 +28,9 @@ class MockReddit:
         self._next_comment_id = 't1_c1'
         self._next_submission_id = 't3_s1'
         self._next_permalink_id = 1
-        self.setup_reddit()
+        self._comment_index = {} # id -> comment, filled by make_synthetic_reddit so lookups stay fast at scale.
+        if kwargs.get('setup', True):
+            self.setup_reddit()
 
     def setup_reddit(self):
         subreddit1 = MockSubreddit(self, 'mock_subreddit1')
@@ -82,6 +85,11 @@ class MockReddit:
     def submission(self, name=None, url=None):
         return self._subredditForest.submission(name=name, url=url)
 
+    def comment(self, id=None, url=None):
+        if id in self._comment_index:
+            return self._comment_index[id]
+        return self._subredditForest.comment(id=id)
+
     def get_submissions(self):
         return self._subredditForest.get_submissions()
         
@@ -109,6 +117,111 @@ class MockReddit:
         self._next_permalink_id = current_permalink_id + 1
         return current_permalink_id
 
+#### SYNTHETIC REDDIT ####
+class SyntheticReddit:
+    """
+    A large, deterministic MockReddit for load and throughput tests, see make_synthetic_reddit.
+    Besides the reddit itself, it records what a scan of it should find.
+    :ivar reddit: the MockReddit.
+    :ivar titles: list of the book titles that can appear in posts, lower case.
+    :ivar authors: list of every author.
+    :ivar opted_in_users: list of the authors who have opted in.
+    :ivar submissions: list of every MockSubmission.
+    :ivar comments: list of every MockComment, replies included.
+    :ivar hits: dict[fullname] = set(titles) for every entity by an opted in author that mentions a title.
+    """
+    def __init__(self, reddit):
+        self.reddit = reddit
+        self.titles = []
+        self.authors = []
+        self.opted_in_users = []
+        self.submissions = []
+        self.comments = []
+        self.hits = {}
+
+    @property
+    def subreddit_names(self) -> str:
+        """
+        The subreddits joined with '+', as in the PRAW config.
+        """
+        return '+'.join(subreddit.name for subreddit in self.reddit.subreddit())
+
+def make_synthetic_reddit(seed: int = 0, subreddits: int = 4, submissions: int = 100, comments: int = 1000, titles: int = 100,
+                          authors: int = 200, hit_rate: float = 0.05, opted_in_ratio: float = 0.5, max_depth: int = 3,
+                          text_length: int = 30, start_utc: float = 1650000000.0, username: str = 'test_username') -> SyntheticReddit:
+    """
+    Builds a MockReddit with subreddits subreddits, submissions submissions spread evenly across them, and comments comments
+    spread at random across the submissions. Everything is derived from seed, so the same arguments always build the same reddit.
+    :param titles: number of book titles. They never occur in the filler text by accident.
+    :param authors: number of distinct authors.
+    :param hit_rate: chance that a submission or comment mentions a title.
+    :param opted_in_ratio: share of authors who have opted in.
+    :param max_depth: deepest level of reply. 0 makes every comment top level.
+    :param text_length: number of words in each comment body and submission selftext.
+    :param start_utc: created_utc of the first entity. Each following entity is created one second later.
+    :param username: the bot's username.
+    :returns: SyntheticReddit
+    """
+    rng = random.Random(seed)
+    reddit = MockReddit(username=username, setup=False)
+    synthetic = SyntheticReddit(reddit)
+    # Fixed width numbers, so that no title is a prefix of another one.
+    synthetic.titles = [f"synthetic book {i:06d}" for i in range(titles)]
+    synthetic.authors = [f"synthetic_author{i}" for i in range(authors)]
+    synthetic.opted_in_users = [author for author in synthetic.authors if rng.random() < opted_in_ratio]
+    opted_in = set(synthetic.opted_in_users)
+    vocabulary = [f"word{i}" for i in range(500)]
+    clock = iter(range(submissions + comments))
+
+    def make_text(fullname, author):
+        words = rng.choices(vocabulary, k=text_length)
+        if synthetic.titles and rng.random() < hit_rate:
+            title = rng.choice(synthetic.titles)
+            words.insert(rng.randint(0, len(words)), title)
+            if author in opted_in:
+                synthetic.hits.setdefault(fullname, set()).add(title)
+        return ' '.join(words)
+
+    subreddit_list = [MockSubreddit(reddit, f"synthetic_subreddit{i}") for i in range(subreddits)]
+    for subreddit in subreddit_list:
+        reddit._subredditForest.add_subreddit(subreddit)
+
+    threads = [] # per submission, the comments that can still be replied to, with their depth.
+    for i in range(submissions):
+        subreddit = subreddit_list[i % len(subreddit_list)]
+        fullname = reddit.next_submission_id
+        author = rng.choice(synthetic.authors)
+        submission = MockSubmission(reddit, subreddit, fullname, author, f"thread {i}", make_text(fullname, author),
+                                    reddit.next_permalink_id, created_utc=start_utc + next(clock))
+        subreddit.add_submission(submission)
+        synthetic.submissions.append(submission)
+        threads.append([])
+
+    for _ in range(comments):
+        thread = rng.randrange(len(threads))
+        parents = threads[thread]
+        parent, depth = rng.choice(parents) if parents and rng.random() < 0.5 else (synthetic.submissions[thread], -1)
+        fullname = reddit.next_comment_id
+        author = rng.choice(synthetic.authors)
+        comment = MockComment(reddit, parent, fullname, author, make_text(fullname, author), created_utc=start_utc + next(clock))
+        if depth < 0:
+            parent.add_comment(comment)
+        else:
+            parent.replies.add_comment(comment)
+        if depth + 1 < max_depth:
+            threads[thread].append((comment, depth + 1))
+        synthetic.comments.append(comment)
+        reddit._comment_index[comment.id] = comment
+
+    return synthetic
+
+@pytest.fixture
+def synthetic_reddit():
+    """
+    Returns make_synthetic_reddit, for tests that want to pick the scale themselves.
+    """
+    return make_synthetic_reddit
+
 class MockSubredditForest:
     def __init__(self, reddit, subreddits=None, *args, **kwargs):
         self._reddit = reddit
@@ -139,6 +252,13 @@ class MockSubredditForest:
             if subreddit.submission(url=url, name=name) is not None:
                 return subreddit.submission(url=url, name=name)
 
+    def comment(self, id=None):
+        for subreddit in self._subreddits:
+            for submission in subreddit._submissions:
+                for comment in submission.comments._comments:
+                    if comment.id == id:
+                        return comment
+
     def new(self, limit=100):
         i = 0
         submissions_to_return = []
@@ -193,6 +313,10 @@ class MockSubreddit:
                     f"Quarantined: {self.quarantined}"
         return as_string
         
+    @property
+    def display_name(self) -> str:
+        return self.name
+
     @property
     def quarantined(self) -> bool:
         return self._quarantined
@@ -211,6 +335,7 @@ class MockSubmission:
         self._selftext = selftext
         self._shortlink = shortlink
         self._locked = locked
+        self._created_utc = kwargs.get('created_utc', 0.0)
         self._comments = MockCommentForest(self.reddit, self)
 
     def reply(self, reply_body):
@@ -260,6 +385,10 @@ class MockSubmission:
     def comments(self):
         return self._comments
 
+    @property
+    def num_comments(self) -> int:
+        return len(self._comments.list())
+
     @property
     def fullname(self) -> str:
         return self._fullname
@@ -302,6 +431,14 @@ class MockSubmission:
     def locked(self) -> bool:
         return self._locked
 
+    @property
+    def created_utc(self) -> float:
+        return self._created_utc
+
+    @property
+    def subreddit(self):
+        return self._parent
+
     @property
     def reddit(self):
         return self._reddit
@@ -343,6 +480,18 @@ class MockCommentForest:
         else:
             raise StopIteration
 
+    def list(self):
+        """
+        Returns every comment in the forest, replies included, breadth first like praw's CommentForest.list.
+        """
+        flattened = []
+        queue = list(self._comments)
+        while queue:
+            comment = queue.pop(0)
+            flattened.append(comment)
+            queue.extend(comment.replies._comments)
+        return flattened
+
     def new(self, limit=100):
         comments_to_return = []
         i = 0
@@ -368,6 +517,7 @@ class MockComment:
         self._fullname = fullname
         self._body = body
         self._author = author
+        self._created_utc = kwargs.get('created_utc', 0.0)
         self._replies = MockCommentForest(self.reddit, self)
 
     def __eq__(self, other):
@@ -395,11 +545,10 @@ class MockComment:
     def reply(self, reply_body):
 
         # recurse parent until we get to the submission.
-        parent_type = self.parent.fullname.split("_")[0]
         top_level_parent = self.parent
-        while parent_type != 't3':
-            top_level_parent = self.parent.parent
-            parent_type = parent_type = self.parent.fullname.split("_")[0]
+        while top_level_parent.fullname.split("_")[0] != 't3':
+            top_level_parent = top_level_parent.parent
+        parent_type = 't3'
 
         #parent is submission
         if  parent_type == 't3':
@@ -436,6 +585,20 @@ class MockComment:
     def body(self):
         return self._body
 
+    @property
+    def replies(self):
+        return self._replies
+
+    @property
+    def created_utc(self) -> float:
+        return self._created_utc
+
+    @property
+    def subreddit(self):
+        if self.parent is None:
+            return None
+        return self.parent.subreddit
+
     @property
     def reddit(self):
         return self._reddit
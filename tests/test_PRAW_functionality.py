@@ -2,7 +2,7 @@ import pytest
 import prawcore # type: ignore
 import sqlite3
 from tests.conftest import MockComment, MockReddit, MockSubmission # type: ignore
-from rsarb.util.praw_funcs import connect_to_reddit, get_submission, get_submissions, get_comments, get_thread_commenters, get_user_replied_entities, post_comment, scan_entity # type: ignore
+from rsarb.util.praw_funcs import connect_to_reddit, get_entity, get_submission, get_submissions, get_comments, get_thread_commenters, get_user_replied_entities, post_comment, scan_entity # type: ignore
 
 class Test_PRAWFunctionality:
     def test_connect_to_reddit(self, mock_reddit):
@@ -305,3 +305,16 @@ class Test_PRAWFunctionality:
         results = sorted(get_user_replied_entities(p))
         expected_results = ['s1', 's2']
         assert results == expected_results
+
+    def test_get_entity(self, mock_reddit):
+        p = connect_to_reddit(
+            'test_client_id',
+            'test_client_secret',
+            'test_password',
+            'test_username',
+            'test_user_agent'
+        )
+        assert get_entity(p, 't3_s2') == MockSubmission(None, None, 't3_s2', None, None, None, None)
+        assert get_entity(p, 't1_c2') == MockComment(None, None, 't1_c2', None, None)
+        with pytest.raises(ValueError) as context:
+            get_entity(p, 't5_r1')
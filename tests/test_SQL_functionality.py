@@ -2,8 +2,14 @@ from importlib.resources import path
 import os
 import sqlite3
 import pytest 
+from concurrent.futures import ProcessPoolExecutor
 from rsarb.RedditScanAndReplyBot import RedditScanAndReplyBot
-from rsarb.util.sql_funcs import add_opted_in_user, create_database, get_sql_cursor, get_books, get_opted_in_users, get_replied_entries, update_opted_in_users, add_replied_entry, get_book_db_entry, update_replied_entry_table # type: ignore
+from rsarb.util.sql_funcs import add_opted_in_user, create_database, get_sql_cursor, get_books, get_opted_in_users, get_replied_entries, update_opted_in_users, add_replied_entry, get_book_db_entry, update_replied_entry_table, upsert_books, get_catalog_revision, add_reply_latency, get_reply_latency_report, claim_reply, release_reply_claim, ensure_replied_entries_index, ensure_reply_claims_table, acquire_job_lease, release_job_lease, record_job_run, get_job_lease, get_database_stats, prune_database # type: ignore
+
+def claim_all(args):
+    db_path, owner, reddit_ids = args
+    cur = sqlite3.connect(db_path, timeout=30).cursor()
+    return [reddit_id for reddit_id in reddit_ids if claim_reply(cur, reddit_id, owner)]
 
 class Test_SQL_functionality:
     @pytest.mark.usefixtures('setup_test_db')
@@ -245,4 +251,166 @@ class Test_SQL_functionality:
         cur.execute('Select * from opted_in_users')
         results = cur.fetchall()
         expected_results = []
-        assert results == expected_results
\ No newline at end of file
+        assert results == expected_results
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_upsert_books(self, amend_sqlite3_connect):
+        conn = sqlite3.connect('./path')
+        cur = conn.cursor()
+        revision = get_catalog_revision(cur)
+        rows = [
+            ('BOOK1', 'new_author1', 'isbn1', 'url1', 'sum1'),
+            ('book4', 'author4', 'isbn4', None, 'sum4'),
+            ('book5', 'author5', 'isbn5', 'url5', 'sum5'),
+            ('Book5', 'author5b', 'isbn5', 'url5', 'sum5'),
+        ]
+        written = upsert_books(cur, iter(rows), batch_size=2)
+        cur.execute('SELECT title, author FROM books ORDER BY id')
+        results = cur.fetchall()
+        expected_results = [('BOOK1', 'new_author1'),
+                            ('book2', 'author2'),
+                            ('book3', 'author3'),
+                            ('book4', 'author4'),
+                            ('Book5', 'author5b')]
+        assert written == 3 # book5 appears twice.
+        assert results == expected_results
+        assert get_catalog_revision(cur) == revision + 1
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_upsert_books_rolls_back_on_error(self, amend_sqlite3_connect):
+        conn = sqlite3.connect('./path')
+        cur = conn.cursor()
+        rows = [
+            ('book4', 'author4', 'isbn4', None, 'sum4'),
+            ('book5', None, 'isbn5', None, 'sum5'),
+        ]
+        with pytest.raises(sqlite3.IntegrityError) as context:
+            upsert_books(cur, rows, batch_size=1)
+        cur.execute('SELECT count(*) FROM books')
+        assert cur.fetchone() == (3,)
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_reply_latency_report(self, amend_sqlite3_connect):
+        conn = sqlite3.connect('./path')
+        cur = conn.cursor()
+        for i in range(1, 101):
+            add_reply_latency(cur, f'c{i}', 'mock_subreddit1', 1000.0, 1000.0 + i, 1000.0 + i + 2, 1000.0 + i + 3)
+        add_reply_latency(cur, 's1', 'mock_subreddit2', 1000.0, 1060.0, 1061.0, 1062.0)
+        add_reply_latency(cur, 's2', 'mock_subreddit2', 0.0, 10.0, 11.0, 12.0)
+        report = get_reply_latency_report(cur, since_utc=1000.0)
+        assert list(report) == ['mock_subreddit1', 'mock_subreddit2']
+        assert report['mock_subreddit1']['count'] == 100
+        assert report['mock_subreddit1']['total'] == {50: 53.0, 95: 98.0, 99: 102.0}
+        assert report['mock_subreddit1']['poll'] == {50: 50.0, 95: 95.0, 99: 99.0}
+        assert report['mock_subreddit1']['queue'] == {50: 2.0, 95: 2.0, 99: 2.0}
+        assert report['mock_subreddit1']['post'] == {50: 1.0, 95: 1.0, 99: 1.0}
+        assert report['mock_subreddit2']['count'] == 1
+        assert report['mock_subreddit2']['total'] == {50: 62.0, 95: 62.0, 99: 62.0}
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_claim_reply(self, amend_sqlite3_connect):
+        conn = sqlite3.connect('./path')
+        cur = conn.cursor()
+        ensure_reply_claims_table(cur) # done by create_database and the bot's setup.
+        assert claim_reply(cur, 'c2', 'worker1', lease_seconds=60, now=1000.0)
+        assert claim_reply(cur, 'c2', 'worker1', lease_seconds=60, now=1010.0) # renewing your own claim.
+        assert not claim_reply(cur, 'c2', 'worker2', lease_seconds=60, now=1020.0)
+        assert claim_reply(cur, 'c2', 'worker2', lease_seconds=60, now=1071.0) # worker1's lease expired at 1070.
+        assert not claim_reply(cur, 'c1', 'worker1') # already in replied_entries.
+
+        release_reply_claim(cur, 'c2', 'worker1') # no longer worker1's claim, so nothing happens.
+        assert not claim_reply(cur, 'c2', 'worker1', now=1080.0)
+        release_reply_claim(cur, 'c2', 'worker2')
+        assert claim_reply(cur, 'c2', 'worker1', now=1080.0)
+
+    def test_ensure_replied_entries_index(self, tmp_path):
+        db_path = str(tmp_path / 'index.db')
+        create_database(db_path)
+        cur = get_sql_cursor(db_path)
+        plan = cur.execute('EXPLAIN QUERY PLAN SELECT 1 FROM replied_entries WHERE reddit_id = ?', ['c1']).fetchall()
+        assert 'replied_entries_reddit_id' in plan[0][3]
+        cur.execute('DROP INDEX replied_entries_reddit_id')
+        ensure_replied_entries_index(cur) # a database from before the index existed.
+        ensure_replied_entries_index(cur)
+        plan = cur.execute('EXPLAIN QUERY PLAN SELECT 1 FROM replied_entries WHERE reddit_id = ?', ['c1']).fetchall()
+        assert 'replied_entries_reddit_id' in plan[0][3]
+
+    def test_claim_reply_across_processes(self, tmp_path):
+        db_path = str(tmp_path / 'claims.db')
+        conn = sqlite3.connect(db_path)
+        conn.execute('CREATE TABLE replied_entries (id integer PRIMARY KEY AUTOINCREMENT, reddit_id TEXT NOT NULL, reply_succeeded_bool integer NOT NULL)')
+        ensure_reply_claims_table(conn.cursor())
+        conn.commit()
+        conn.close()
+        reddit_ids = [f"c{i}" for i in range(200)]
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            won = list(executor.map(claim_all, [(db_path, f"worker{i}", reddit_ids) for i in range(4)]))
+        assert sorted(reddit_id for claims in won for reddit_id in claims) == sorted(reddit_ids)
+
+    def test_claim_reply_database_locked(self, tmp_path):
+        db_path = str(tmp_path / 'claims.db')
+        create_database(db_path)
+        holder = sqlite3.connect(db_path)
+        holder.execute('BEGIN IMMEDIATE') # another process writing.
+        cur = sqlite3.connect(db_path, timeout=0.1).cursor()
+        assert not claim_reply(cur, 'c2', 'worker1')
+        assert not cur.connection.in_transaction
+        holder.rollback()
+        assert claim_reply(cur, 'c2', 'worker1')
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_job_lease(self, amend_sqlite3_connect):
+        conn = sqlite3.connect('./path')
+        cur = conn.cursor()
+        assert get_job_lease(cur, 'job') is None
+        assert acquire_job_lease(cur, 'job', 'worker1', lease_seconds=60, now=1000.0)
+        assert record_job_run(cur, 'job', 'worker1', now=1005.0)
+        assert acquire_job_lease(cur, 'job', 'worker1', lease_seconds=60, now=1030.0) # heartbeat, expires at 1090.
+        assert not acquire_job_lease(cur, 'job', 'worker2', lease_seconds=60, now=1080.0)
+        assert not record_job_run(cur, 'job', 'worker2', now=1080.0)
+        assert acquire_job_lease(cur, 'job', 'worker2', lease_seconds=60, now=1091.0) # worker1 stopped renewing.
+        assert get_job_lease(cur, 'job') == {'job': 'job', 'owner': 'worker2', 'expires_utc': 1151.0, 'last_run_utc': 1005.0}
+
+        release_job_lease(cur, 'job', 'worker1') # no longer worker1's lease, so nothing happens.
+        assert not acquire_job_lease(cur, 'job', 'worker1', now=1100.0)
+        release_job_lease(cur, 'job', 'worker2')
+        assert acquire_job_lease(cur, 'job', 'worker1', now=1100.0)
+
+    @pytest.mark.usefixtures('setup_test_db')
+    def test_database_stats_and_prune(self, amend_sqlite3_connect):
+        conn = sqlite3.connect('./path')
+        cur = conn.cursor()
+        add_reply_latency(cur, 'c1', 'mock_subreddit1', 100.0, 110.0, 111.0, 112.0)
+        add_reply_latency(cur, 'c2', 'mock_subreddit1', 1000.0, 1010.0, 1011.0, 1012.0)
+        ensure_reply_claims_table(cur)
+        assert claim_reply(cur, 'c8', 'worker1', lease_seconds=60, now=1000.0)
+        assert claim_reply(cur, 'c9', 'worker1', lease_seconds=600, now=1000.0)
+        acquire_job_lease(cur, 'job', 'worker1', lease_seconds=60, now=1000.0)
+
+        stats = get_database_stats(cur, now=1100.0)
+        assert stats['books'] == 3
+        assert stats['opted_in_users'] == 2
+        assert stats['reply_latency_rows'] == 2
+        assert (stats['active_claims'], stats['expired_claims']) == (1, 1)
+        assert stats['job_leases']['job']['owner'] == 'worker1'
+        assert stats['size_bytes'] > 0
+
+        assert prune_database(cur, 500.0, now=1100.0) == {'reply_latency_rows': 1, 'expired_claims': 1}
+        assert prune_database(cur, 500.0, now=1100.0) == {'reply_latency_rows': 0, 'expired_claims': 0}
+        stats = get_database_stats(cur, now=1100.0)
+        assert (stats['reply_latency_rows'], stats['expired_claims'], stats['active_claims']) == (1, 0, 1)
+
+    def test_get_database_stats_runs_no_ddl(self, tmp_path):
+        db_path = str(tmp_path / 'stats.db')
+        conn = sqlite3.connect(db_path)
+        conn.execute('CREATE TABLE books(id integer PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, author text NOT NULL, isbn text NOT NULL, uri text, summary text not null)')
+        conn.execute('CREATE TABLE replied_entries (id integer PRIMARY KEY AUTOINCREMENT, reddit_id TEXT NOT NULL, reply_succeeded_bool integer NOT NULL)')
+        conn.execute('CREATE TABLE opted_in_users (id integer PRIMARY KEY AUTOINCREMENT, reddit_username TEXT NOT NULL)')
+        conn.commit()
+        conn.close()
+        read_only = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True).cursor()
+        stats = get_database_stats(read_only, now=1100.0)
+        assert (stats['reply_latency_rows'], stats['active_claims'], stats['expired_claims']) == (0, 0, 0)
+        assert stats['job_leases'] == {}
+        read_only.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
+        assert read_only.fetchall() == [('books',), ('opted_in_users',), ('replied_entries',)]
@@ -0,0 +1,61 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from rsarb.admin import get_database_name, main # type: ignore
+from rsarb.util.sql_funcs import add_reply_latency, get_sql_cursor # type: ignore
+
+def write_config(tmp_path, db_path):
+    config = tmp_path / 'config.ini'
+    config.write_text(f"[DATABASE]\ndatabase_name = {db_path}\n")
+    return str(config)
+
+class Test_AdminFunctionality:
+    def test_admin_commands(self, tmp_path, capsys):
+        db_path = str(tmp_path / 'admin.db')
+        config = write_config(tmp_path, db_path)
+        catalog = tmp_path / 'books.csv'
+        catalog.write_text("title,author,isbn,uri,summary\nbook1,author1,isbn1,url1,sum1\nbook2,author2,isbn2,url2,sum2\n")
+
+        main(['-c', config, 'init'])
+        main(['-c', config, 'import-catalog', str(catalog)])
+        assert 'Imported 2 books' in capsys.readouterr().out
+
+        cur = get_sql_cursor(db_path)
+        add_reply_latency(cur, 'c1', 'mock_subreddit1', 100.0, 110.0, 111.0, 112.0)
+        cur.connection.close()
+        main(['-c', config, 'stats', '--json'])
+        stats = json.loads(capsys.readouterr().out)
+        assert (stats['books'], stats['reply_latency_rows']) == (2, 1)
+
+        main(['-c', config, 'prune', '--days', '1', '--vacuum'])
+        assert 'Deleted 1 reply latency rows' in capsys.readouterr().out
+        main(['-c', config, 'stats'])
+        assert 'reply_latency_rows  0' in capsys.readouterr().out
+
+    def test_get_database_name(self, tmp_path):
+        assert get_database_name(write_config(tmp_path, './bot.db')) == './bot.db'
+        with pytest.raises(FileNotFoundError):
+            get_database_name(str(tmp_path / 'missing.ini'))
+        config = tmp_path / 'bad.ini'
+        config.write_text("[PRAW]\nusername = bot\n")
+        with pytest.raises(Exception):
+            get_database_name(str(config))
+
+    def test_reddit_stack_is_not_imported(self, tmp_path):
+        # runs in a fresh interpreter, as the test session itself has praw loaded by conftest.
+        config = write_config(tmp_path, str(tmp_path / 'admin.db'))
+        code = (
+            "import sys\n"
+            "from rsarb.admin import main\n"
+            f"main(['-c', {config!r}, 'init'])\n"
+            f"main(['-c', {config!r}, 'stats'])\n"
+            f"main(['-c', {config!r}, 'prune'])\n"
+            "import rsarb.RedditScanAndReplyBot\n"
+            "print(sorted(module for module in ('praw', 'prawcore', 'requests', 'schedule') if module in sys.modules))\n"
+        )
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        assert result.stdout.strip().splitlines()[-1] == '[]'
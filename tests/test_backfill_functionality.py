@@ -0,0 +1,71 @@
+import gzip
+import json
+
+import pytest
+from rsarb.util.backfill_funcs import backfill, get_dump_record, read_dump_records # type: ignore
+from rsarb.util.catalog_funcs import CatalogSnapshot, TitleMatcher # type: ignore
+from rsarb.util.scan_funcs import ScanPool # type: ignore
+
+DUMP_ITEMS = [
+    {'id': 'c1', 'author': 'test_author1', 'subreddit': 'Mock_Subreddit1', 'created_utc': 1640995200, 'body': 'I loved Book1 and book2.'},
+    {'id': 's1', 'author': 'test_author2', 'subreddit': 'mock_subreddit2', 'created_utc': '1643673600', 'title': 'book1', 'selftext': 'no books here'},
+    {'id': 'c2', 'author': 'test_author1', 'subreddit': 'mock_subreddit1', 'created_utc': 1643673601, 'body': 'nothing'},
+    {'id': 'x1', 'author': 'test_author1'},
+]
+
+def write_dump(path, items, opener=open):
+    with opener(path, 'wt') as fd:
+        for item in items:
+            fd.write(json.dumps(item) + '\n')
+        fd.write('not json\n\n')
+
+class Test_BackfillFunctionality:
+    def test_get_dump_record(self):
+        assert get_dump_record(DUMP_ITEMS[0]) == ('t1_c1', 'mock_subreddit1', 1640995200.0, 'i loved book1 and book2.')
+        assert get_dump_record(DUMP_ITEMS[1]) == ('t3_s1', 'mock_subreddit2', 1643673600.0, 'book1\x00no books here')
+        assert get_dump_record({'name': 't1_c9', 'body': None}) == ('t1_c9', '', 0.0, '')
+        assert get_dump_record(DUMP_ITEMS[3]) is None
+
+    def test_read_dump_records_gzip(self, tmp_path):
+        path = str(tmp_path / 'RC_2022-01.gz')
+        write_dump(path, DUMP_ITEMS, gzip.open)
+        errors = []
+        records = list(read_dump_records(path, errors))
+        assert [record[0] for record in records] == ['t1_c1', 't3_s1', 't1_c2']
+        assert errors == [4, 5]
+
+    def test_read_dump_records_zstd(self, tmp_path):
+        zstandard = pytest.importorskip('zstandard')
+        path = str(tmp_path / 'RC_2022-01.zst')
+        with open(path, 'wb') as fd:
+            fd.write(zstandard.ZstdCompressor().compress(''.join(json.dumps(item) + '\n' for item in DUMP_ITEMS[:2]).encode('utf-8')))
+        assert [record[0] for record in read_dump_records(path)] == ['t1_c1', 't3_s1']
+
+    def test_backfill(self, tmp_path):
+        path = str(tmp_path / 'dump.ndjson')
+        write_dump(path, DUMP_ITEMS)
+        progress = []
+        result = backfill([path, path], TitleMatcher(['book1', 'book2', 'book3']), batch_size=2, progress=lambda items, seconds: progress.append(items))
+        assert result['items'] == 6
+        assert result['matched_items'] == 4
+        assert result['invalid_lines'] == {path: 4}
+        assert progress == [2, 3, 5, 6]
+        assert list(result['titles']) == ['book1', 'book2']
+        assert result['titles']['book1'] == {
+            'mentions': 4, 'first_utc': 1640995200.0, 'last_utc': 1643673600.0,
+            'by_month': {'2022-01': 2, '2022-02': 2}, 'by_subreddit': {'mock_subreddit1': 2, 'mock_subreddit2': 2}
+        }
+        assert result['items_per_second'] > 0
+
+    def test_backfill_with_pool_matches_serial(self, tmp_path):
+        path = str(tmp_path / 'dump.ndjson')
+        write_dump(path, DUMP_ITEMS * 50)
+        catalog = CatalogSnapshot(0, [{'title': title, 'author': 'a', 'isbn': 'i', 'uri': None, 'desc': 'd'} for title in ('book1', 'book2')])
+        serial = backfill([path], catalog.matcher, batch_size=40)
+        pool = ScanPool(catalog, workers=2, threshold=1, chunk_size=10)
+        try:
+            pooled = backfill([path], catalog.matcher, pool, batch_size=40)
+        finally:
+            pool.close()
+        assert pooled['titles'] == serial['titles']
+        assert pooled['items'] == serial['items'] == 150
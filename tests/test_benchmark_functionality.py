@@ -0,0 +1,37 @@
+import json
+
+from benchmarks.run_benchmarks import bench_http_requests, bench_scan_entities, bench_scrape_reddit, compare_results, get_scenarios # type: ignore
+
+class Test_BenchmarkFunctionality:
+    def test_result_format(self):
+        result = bench_scan_entities(titles=10, comments=50, replied=10, repeats=2)
+        assert result['benchmark'] == 'scan_entities'
+        assert result['params'] == {'titles': 10, 'comments': 50, 'replied': 10}
+        assert result['repeats'] == 2
+        assert result['items'] == 50
+        assert 0 <= result['min_seconds'] <= result['median_seconds']
+        json.dumps(result)
+        assert bench_scan_entities(titles=10, comments=50, replied=10, repeats=1, opted_in_ratio=0.1)['params']['opted_in_ratio'] == 0.1
+
+    def test_scrape_reddit_cycle(self, tmp_path):
+        result = bench_scrape_reddit(comments=200, titles=20, directory=str(tmp_path), hit_rate=0.2)
+        assert result['items'] == 300
+        assert list(tmp_path.iterdir()) == []
+
+    def test_http_requests(self):
+        for pooled in (False, True):
+            result = bench_http_requests(pooled=pooled, fetchers=2, requests_made=20, repeats=1)
+            assert result['params'] == {'pooled': pooled, 'fetchers': 2}
+            assert result['items'] == 20
+
+    def test_quick_scenarios_are_a_subset(self, tmp_path):
+        quick = get_scenarios(True, str(tmp_path))
+        full = get_scenarios(False, str(tmp_path))
+        assert len(quick) < len(full)
+        assert all(scenario in full for scenario in quick)
+
+    def test_compare_results(self):
+        previous = {'results': [{'benchmark': 'scan_entities', 'params': {'titles': 10}, 'median_seconds': 2.0}]}
+        current = {'results': [{'benchmark': 'scan_entities', 'params': {'titles': 10}, 'median_seconds': 1.0},
+                               {'benchmark': 'scan_entities', 'params': {'titles': 100}, 'median_seconds': 1.0}]}
+        assert compare_results(previous, current) == [('scan_entities', {'titles': 10}, 2.0, 1.0, 0.5)]
@@ -1,12 +1,16 @@
 import os
 import re
+import signal
+import time
 from unittest.mock import Mock
 import pytest
+import schedule
 import sqlite3
+import rsarb.RedditScanAndReplyBot as bot_module
 from rsarb.util.praw_funcs import get_submission, get_submissions 
-from rsarb.RedditScanAndReplyBot import RedditScanAndReplyBot
+from rsarb.RedditScanAndReplyBot import ITEMS_TOTAL, RedditScanAndReplyBot
 from conftest import MockComment, MockCommentForest, MockReddit
-from rsarb.util.sql_funcs import create_database, get_opted_in_users, get_replied_entries
+from rsarb.util.sql_funcs import claim_reply, create_database, get_opted_in_users, get_replied_entries
 
 class Test_BotFunctionality:
 
@@ -146,6 +150,7 @@ class Test_BotFunctionality:
         rb.setup()
         pre_scrape_replied_entries = get_replied_entries(rb.cur)
         pre_scrape_user_posts = rb.reddit.user.me().comments.new()
+        pre_scrape_items = {stage: ITEMS_TOTAL.get(stage=stage) for stage in ('matched', 'posted', 'failed')}
 
         rb.scrape_reddit()
         post_scrape_1_replied_entries = get_replied_entries(rb.cur)
@@ -161,6 +166,12 @@ class Test_BotFunctionality:
                             }
         assert expected_post_diff == user_post_diff
         assert expected_replied_diff == replied_diff
+        assert ITEMS_TOTAL.get(stage='matched') - pre_scrape_items['matched'] == 5
+        assert ITEMS_TOTAL.get(stage='posted') - pre_scrape_items['posted'] == 3
+        assert ITEMS_TOTAL.get(stage='failed') - pre_scrape_items['failed'] == 2
+        latency_report = rb.get_latency_report(days=1)
+        assert sum(stages['count'] for stages in latency_report.values()) == 3
+        assert set(latency_report) <= {'mock_subreddit1', 'mock_subreddit2', 'quarantined_subreddit'}
         rb.scrape_reddit()
 
         post_scrape_2_replied_entries = get_replied_entries(rb.cur)
@@ -171,6 +182,120 @@ class Test_BotFunctionality:
         assert len(replied_diff_2) == 0
         assert len(user_post_diff_2) == 0
 
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_scrape_reddit_skips_claimed_entries(self, mock_reddit, amend_sqlite3_connect, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open):
+        rb = RedditScanAndReplyBot(options={'CLAIMS': {'owner': 'worker1'}})
+        rb._praw_config = {
+            'client_id' : 'test_client_id',
+            'client_secret': 'test_client_secret',
+            'password':'test_password',
+            'username':'test_username',
+            'user_agent':'test_user_agent',
+            'subreddits':'mock_subreddit1+mock_subreddit2+quarantined_subreddit',
+            'bot_subreddit': 'mock_botsubreddit'
+            }
+        rb._database_config = {'database_name':'./path'}
+        rb.setup()
+        assert rb.worker_id == 'worker1'
+        assert claim_reply(rb.cur, 'c3', 'worker2')
+        pre_scrape_replied_entries = set(get_replied_entries(rb.cur))
+
+        rb.scrape_reddit()
+        replied_diff = set(get_replied_entries(rb.cur)).difference(pre_scrape_replied_entries)
+        assert replied_diff == {'s3', 'c5', 'c4', 'c6'}
+        rb.cur.execute('SELECT reddit_id, owner FROM reply_claims')
+        assert rb.cur.fetchall() == [('c3', 'worker2')]
+
+    def make_bot(self, options=None):
+        rb = RedditScanAndReplyBot(options=options)
+        rb._praw_config = {
+            'client_id' : 'test_client_id',
+            'client_secret': 'test_client_secret',
+            'password':'test_password',
+            'username':'test_username',
+            'user_agent':'test_user_agent',
+            'subreddits':'mock_subreddit1+mock_subreddit2+quarantined_subreddit',
+            'bot_subreddit': 'mock_botsubreddit'
+            }
+        rb._database_config = {'database_name':'./path'}
+        rb.setup()
+        return rb
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_scan_pool_off_by_default_and_closed_on_shutdown(self, mock_reddit, amend_sqlite3_connect, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open):
+        rb = self.make_bot({'STATE': {'snapshot': 'false'}})
+        catalog = rb.catalog.snapshot(rb.cur)
+        assert rb.get_scan_pool(catalog, 100000) is None
+
+        rb = self.make_bot({'STATE': {'snapshot': 'false'}, 'SCANNING': {'pool_workers': '2', 'pool_threshold': '10'}})
+        pool = rb.get_scan_pool(catalog, 10)
+        assert pool is not None
+        closed = []
+        close = pool.close
+        pool.close = lambda: closed.append(close())
+        rb.shutdown()
+        assert closed == [None]
+        assert rb._scan_pool is None
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_scrape_reddit_fetches_nothing_once_stopping(self, mock_reddit, amend_sqlite3_connect, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open):
+        rb = self.make_bot()
+        pre_scrape_replied_entries = set(get_replied_entries(rb.cur))
+        fetched = ITEMS_TOTAL.get(stage='fetched')
+        rb.request_stop()
+        rb.scrape_reddit()
+        assert ITEMS_TOTAL.get(stage='fetched') == fetched
+        assert set(get_replied_entries(rb.cur)) == pre_scrape_replied_entries
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_scrape_reddit_drains_after_stop(self, mock_reddit, amend_sqlite3_connect, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open, monkeypatch):
+        rb = self.make_bot()
+        pre_scrape_replied_entries = set(get_replied_entries(rb.cur))
+        scan_entities = bot_module.scan_entities
+
+        def stop_while_scanning(*args, **kwargs):
+            rb.request_stop()
+            return scan_entities(*args, **kwargs)
+        monkeypatch.setattr(bot_module, 'scan_entities', stop_while_scanning)
+
+        rb.scrape_reddit()
+        replied_diff = set(get_replied_entries(rb.cur)).difference(pre_scrape_replied_entries)
+        assert replied_diff == {'s3', 'c3', 'c5', 'c4', 'c6'}
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_scrape_reddit_defers_replies_past_drain_deadline(self, mock_reddit, amend_sqlite3_connect, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open, monkeypatch):
+        rb = self.make_bot()
+        pre_scrape_replied_entries = set(get_replied_entries(rb.cur))
+        scan_entities = bot_module.scan_entities
+
+        def stop_while_scanning(*args, **kwargs):
+            rb.request_stop()
+            rb.stop_deadline = time.monotonic() - 1
+            return scan_entities(*args, **kwargs)
+        monkeypatch.setattr(bot_module, 'scan_entities', stop_while_scanning)
+
+        deferred = ITEMS_TOTAL.get(stage='deferred')
+        rb.scrape_reddit()
+        assert ITEMS_TOTAL.get(stage='deferred') - deferred == 5
+        assert set(get_replied_entries(rb.cur)) == pre_scrape_replied_entries
+        assert claim_reply(rb.cur, 'c3', 'worker2') # deferred entities are left unclaimed.
+        assert rb.state.comment_counts == {'t3_s2': 0} # threads with deferred replies are fetched again after the restart.
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_run_stops_on_sigterm(self, mock_reddit, amend_sqlite3_connect, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open):
+        rb = self.make_bot({'STATE': {'snapshot': 'false'}})
+        rb.schedule_jobs = lambda scheduler: scheduler.every(1).seconds.do(os.kill, os.getpid(), signal.SIGTERM)
+        rb.shutdown = Mock(wraps=rb.shutdown)
+        previous = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1)}
+        try:
+            rb.run()
+        finally:
+            schedule.clear()
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        assert rb.stopping.is_set()
+        rb.shutdown.assert_called_once()
+
     @pytest.mark.usefixtures("setup_test_db")
     def test_update_opted_in_users(self, mock_reddit, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open, amend_sqlite3_connect, amend_configparser_read):
         rb = RedditScanAndReplyBot()
@@ -291,6 +416,69 @@ class Test_BotFunctionality:
         assert before_reply == after_reply
         assert diff == [(3, 's2', 1)]
 
+    @pytest.mark.usefixtures('setup_test_db')
+    def test_run_singleton_jobs(self, mock_reddit, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open, amend_sqlite3_connect, amend_configparser_read):
+        bots = []
+        for owner in ('worker1', 'worker2'):
+            rb = RedditScanAndReplyBot(options={'CLAIMS': {'owner': owner}, 'LEASES': {'lease_seconds': '180', 'repopulate_replied_entries': '600'}})
+            rb._database_config = {'database_name':'./path'}
+            rb.cur = './path'
+            calls = []
+            rb.singleton_jobs = {job: (lambda job=job, calls=calls: calls.append(job), interval) for job, (_, interval) in rb.singleton_jobs.items()}
+            bots.append((rb, calls))
+        (rb1, calls1), (rb2, calls2) = bots
+        start = 1700000000.0
+
+        assert rb1.run_singleton_jobs(now=start) == ['repopulate_opted_in_users', 'repopulate_replied_entries']
+        assert rb2.run_singleton_jobs(now=start + 10) == []
+        assert rb1.run_singleton_jobs(now=start + 60) == [] # renews the leases, nothing is due yet.
+        assert rb1.run_singleton_jobs(now=start + 700) == ['repopulate_replied_entries']
+        # worker1 stops heartbeating, worker2 takes over once the leases expire and runs what is due.
+        assert rb2.run_singleton_jobs(now=start + 800) == []
+        assert rb2.run_singleton_jobs(now=start + 3700) == ['repopulate_opted_in_users', 'repopulate_replied_entries']
+        assert calls1 == ['repopulate_opted_in_users', 'repopulate_replied_entries', 'repopulate_replied_entries']
+        assert calls2 == ['repopulate_opted_in_users', 'repopulate_replied_entries']
+
+        rb2.release_job_leases()
+        assert rb1.run_singleton_jobs(now=start + 3710) == []
+        assert rb1.cur.execute("SELECT owner FROM job_leases").fetchall() == [('worker1',), ('worker1',)]
+
+    @pytest.mark.usefixtures('setup_test_db')
+    def test_singleton_job_leases_renewed_and_failures_isolated(self, mock_reddit, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open, amend_sqlite3_connect, amend_configparser_read):
+        bots = []
+        for owner in ('worker1', 'worker2'):
+            rb = RedditScanAndReplyBot(options={'CLAIMS': {'owner': owner}, 'LEASES': {'lease_seconds': '180', 'repopulate_replied_entries': '600'}})
+            rb._database_config = {'database_name':'./path'}
+            rb.cur = './path'
+            bots.append(rb)
+        rb1, rb2 = bots
+        calls = []
+
+        def failing_job():
+            calls.append('repopulate_opted_in_users')
+            raise Exception("Reddit is down.")
+
+        rb1.singleton_jobs = {
+            'repopulate_opted_in_users': (failing_job, 3600),
+            'repopulate_replied_entries': (lambda: calls.append('repopulate_replied_entries'), 600)
+            }
+        start = 1700000000.0
+
+        assert rb1.run_singleton_jobs(now=start) == ['repopulate_opted_in_users', 'repopulate_replied_entries']
+        assert calls == ['repopulate_opted_in_users', 'repopulate_replied_entries']
+        assert rb1.cur.execute("SELECT last_run_utc FROM job_leases WHERE job = 'repopulate_opted_in_users'").fetchone() == (start,)
+        assert rb1.held_job_leases == {'repopulate_opted_in_users', 'repopulate_replied_entries'}
+
+        # a long cycle keeps rb1 from calling run_singleton_jobs, but the heartbeat keeps its leases alive.
+        rb1.renew_job_leases(now=start + 150)
+        assert rb2.run_singleton_jobs(now=start + 300) == []
+        rb1.release_job_leases()
+        assert rb1.held_job_leases == set()
+        assert rb2.run_singleton_jobs(now=start + 3700) == ['repopulate_opted_in_users', 'repopulate_replied_entries']
+        rb1.held_job_leases.add('repopulate_opted_in_users')
+        rb1.renew_job_leases(now=start + 3710)
+        assert rb1.held_job_leases == set()
+
     @pytest.mark.usefixtures('setup_test_db')
     def test_repopulate_replied_entries_deleted_reply(self, mock_reddit, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open, amend_sqlite3_connect, amend_configparser_read):
         rb = RedditScanAndReplyBot()
@@ -386,4 +574,95 @@ class Test_BotFunctionality:
         expected_entries_pragma = [(0, 'id', 'integer', 0, None, 1), 
                                 (1, 'reddit_id', 'TEXT', 1, None, 0), 
                                 (2, 'reply_succeeded_bool', 'integer', 1, None, 0)]
-        assert entries_pragma == expected_entries_pragma
\ No newline at end of file
+        assert entries_pragma == expected_entries_pragma
+
+    def test_scan_config_file_optional_sections(self, tmp_path):
+        config = tmp_path / 'config.ini'
+        with open('./tests/example_config.ini') as fd:
+            config.write_text(fd.read() + '\n\n[SCANNING]\npool_workers = 4\npool_threshold = abc\n')
+        rb = RedditScanAndReplyBot.from_file(str(config))
+        assert rb.get_option('SCANNING', 'pool_workers', 1, int) == 4
+        assert rb.get_option('SCANNING', 'not_set', 10, int) == 10
+        assert rb.get_option('NOT_A_SECTION', 'pool_workers') is None
+        with pytest.raises(Exception) as context:
+            rb.get_option('SCANNING', 'pool_threshold', 2000, int)
+
+    def test_get_requestor_kwargs_network_options(self):
+        rb = RedditScanAndReplyBot(options={'NETWORK': {'pool_maxsize': '3', 'retries': '1', 'compress': 'false', 'read_timeout': '30'}})
+        requestor_kwargs = rb.get_requestor_kwargs()
+        adapter = requestor_kwargs['session'].get_adapter('https://oauth.reddit.com')
+        assert adapter._pool_maxsize == 3
+        assert adapter.max_retries.connect == 1
+        assert adapter.stats is rb.api_stats
+        assert requestor_kwargs['session'].headers['Accept-Encoding'] == 'identity'
+        assert requestor_kwargs['timeout'] == (5.0, 30.0)
+        assert rb.get_requestor_kwargs()['session'] is requestor_kwargs['session']
+
+        replay = Mock()
+        rb.session = replay
+        assert rb.get_requestor_kwargs()['session'] is replay
+        assert not replay.mount.called
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_scrape_reddit_skips_failing_subreddit(self, mock_reddit, amend_sqlite3_connect, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open, monkeypatch):
+        rb = self.make_bot({'BREAKER': {'failure_threshold': '1', 'reset_seconds': '300'}, 'STATE': {'snapshot': 'false'}})
+        pre_scrape_replied_entries = set(get_replied_entries(rb.cur))
+        get_comments = bot_module.get_comments
+        calls = []
+
+        def failing_get_comments(submission):
+            calls.append(submission.subreddit.display_name)
+            if submission.subreddit.display_name == 'mock_subreddit2':
+                raise ConnectionError('mock_subreddit2 is down')
+            return get_comments(submission)
+        monkeypatch.setattr(bot_module, 'get_comments', failing_get_comments)
+
+        rb.scrape_reddit()
+        replied_diff = set(get_replied_entries(rb.cur)).difference(pre_scrape_replied_entries)
+        assert replied_diff == {'s3', 'c3', 'c6'} # the comments of the locked submission in mock_subreddit2 are not fetched.
+        assert rb.breaker.get_state(('comments', 'mock_subreddit2')) == 'open'
+        assert 't3_s4' not in rb.state.comment_counts
+
+        calls.clear()
+        circuit_open = ITEMS_TOTAL.get(stage='circuit_open')
+        rb.scrape_reddit()
+        assert 'mock_subreddit2' not in calls
+        assert ITEMS_TOTAL.get(stage='circuit_open') - circuit_open == 1
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_scrape_reddit_cycle_budget(self, mock_reddit, amend_sqlite3_connect, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open, monkeypatch):
+        rb = self.make_bot({'NETWORK': {'cycle_seconds': '0.5'}, 'STATE': {'snapshot': 'false'}})
+        pre_scrape_replied_entries = set(get_replied_entries(rb.cur))
+        get_comments = bot_module.get_comments
+
+        def slow_get_comments(submission):
+            time.sleep(1)
+            return get_comments(submission)
+        monkeypatch.setattr(bot_module, 'get_comments', slow_get_comments)
+
+        fetched = ITEMS_TOTAL.get(stage='fetched')
+        rb.scrape_reddit()
+        assert ITEMS_TOTAL.get(stage='fetched') - fetched == 8 # the listing, then the most active thread with its three comments.
+        assert set(get_replied_entries(rb.cur)) == pre_scrape_replied_entries # replies past the budget are deferred.
+        assert rb.state.comment_counts == {}
+
+    @pytest.mark.usefixtures("setup_test_db")
+    def test_scrape_reddit_serves_busiest_threads_first(self, mock_reddit, amend_sqlite3_connect, amend_os_path_isfile, amend_os_path_getsize, amend_builtins_open, monkeypatch):
+        rb = self.make_bot({'SCHEDULING': {'freshness_weight': '1', 'activity_weight': '1'}, 'STATE': {'snapshot': 'false'}})
+        get_comments = bot_module.get_comments
+        post_comment = bot_module.post_comment
+        fetched, posted = [], []
+
+        def recording_get_comments(submission):
+            fetched.append(submission.fullname)
+            return get_comments(submission)
+
+        def recording_post_comment(reddit, entity, post_body):
+            posted.append(entity.fullname)
+            return post_comment(reddit, entity, post_body)
+        monkeypatch.setattr(bot_module, 'get_comments', recording_get_comments)
+        monkeypatch.setattr(bot_module, 'post_comment', recording_post_comment)
+
+        rb.scrape_reddit()
+        assert fetched == ['t3_s1', 't3_s4', 't3_s5', 't3_s2', 't3_s3'] # by comment count, then in listing order.
+        assert posted == ['t1_c3', 't1_c4', 't1_c5', 't1_c6', 't3_s3']
@@ -0,0 +1,57 @@
+import pytest
+from rsarb.util.breaker_funcs import CIRCUIT_TRIPS_TOTAL, CircuitBreaker # type: ignore
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class Test_BreakerFunctionality:
+    def test_circuit_opens_and_recovers(self):
+        clock = Clock()
+        breaker = CircuitBreaker(failure_threshold=3, reset_seconds=60, clock=clock)
+        target = ('comments', 'mock_subreddit1')
+        trips = CIRCUIT_TRIPS_TOTAL.get(endpoint='comments')
+        breaker.record_failure(target)
+        breaker.record_success(target) # failures must be in a row.
+        for _ in range(3):
+            assert breaker.allow(target)
+            breaker.record_failure(target)
+        assert breaker.get_state(target) == 'open'
+        assert CIRCUIT_TRIPS_TOTAL.get(endpoint='comments') - trips == 1
+        assert not breaker.allow(target)
+        assert breaker.allow(('comments', 'mock_subreddit2'))
+        assert breaker.get_open_targets() == [target]
+
+        clock.now += 60
+        assert breaker.allow(target) # the probe.
+        assert breaker.get_state(target) == 'half_open'
+        assert not breaker.allow(target)
+        breaker.record_failure(target)
+        assert breaker.get_state(target) == 'open'
+        assert not breaker.allow(target)
+
+        clock.now += 60
+        assert breaker.allow(target)
+        breaker.record_success(target)
+        assert breaker.get_state(target) == 'closed'
+        assert breaker.get_open_targets() == []
+
+    def test_unanswered_probe_is_retried(self):
+        clock = Clock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60, clock=clock)
+        breaker.record_failure('listing')
+        clock.now += 60
+        assert breaker.allow('listing') # its outcome is never recorded.
+        clock.now += 30
+        assert not breaker.allow('listing')
+        clock.now += 30
+        assert breaker.allow('listing')
+
+    def test_disabled_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=0)
+        for _ in range(10):
+            breaker.record_failure('listing')
+        assert breaker.allow('listing')
@@ -0,0 +1,124 @@
+import json
+import sqlite3
+import pytest
+from rsarb.util.catalog_funcs import BookCatalog, CatalogRowError, SharedCatalog, TitleMatcher, format_import_result, read_catalog_file, validate_catalog_row # type: ignore
+from rsarb.util.sql_funcs import add_replied_entry, create_database, get_sql_cursor, upsert_books # type: ignore
+
+class Test_CatalogFunctionality:
+    def test_validate_catalog_row(self):
+        row = {'title': ' book1 ', 'author': 'author1', 'isbn': 'isbn1', 'uri': '', 'summary': 'sum1'}
+        result = validate_catalog_row(row, 1)
+        expected_result = ('book1', 'author1', 'isbn1', None, 'sum1')
+        assert result == expected_result
+
+    def test_validate_catalog_row_missing_field(self):
+        row = {'title': 'book1', 'author': 'author1', 'uri': 'url1', 'summary': 'sum1'}
+        with pytest.raises(CatalogRowError) as context:
+            validate_catalog_row(row, 3)
+        assert context.value.line_number == 3
+
+    def test_read_catalog_file_csv(self, tmp_path):
+        catalog = tmp_path / 'books.csv'
+        catalog.write_text('title,author,isbn,uri,summary\nbook1,author1,isbn1,url1,sum1\nbook2,author2,isbn2,,"sum2\nsecond line"\n')
+        result = list(read_catalog_file(str(catalog)))
+        expected_result = [('book1', 'author1', 'isbn1', 'url1', 'sum1'), ('book2', 'author2', 'isbn2', None, 'sum2\nsecond line')]
+        assert result == expected_result
+
+    def test_read_catalog_file_jsonl_skips_invalid_rows(self, tmp_path):
+        catalog = tmp_path / 'books.jsonl'
+        lines = [
+            json.dumps({'title': 'book1', 'author': 'author1', 'isbn': 'isbn1', 'uri': 'url1', 'summary': 'sum1'}),
+            '{not json',
+            json.dumps({'title': '', 'author': 'author2', 'isbn': 'isbn2', 'summary': 'sum2'}),
+            ''
+        ]
+        catalog.write_text('\n'.join(lines))
+        errors = []
+        result = list(read_catalog_file(str(catalog), errors))
+        assert result == [('book1', 'author1', 'isbn1', 'url1', 'sum1')]
+        assert [error.line_number for error in errors] == [2, 3]
+
+    def test_read_catalog_file_unsupported_extension(self, tmp_path):
+        catalog = tmp_path / 'books.txt'
+        catalog.write_text('book1')
+        with pytest.raises(ValueError) as context:
+            list(read_catalog_file(str(catalog)))
+
+    def test_read_catalog_file_not_found(self):
+        with pytest.raises(FileNotFoundError) as context:
+            list(read_catalog_file('./tests/not_a_catalog.csv'))
+
+    def test_format_import_result(self):
+        result = {'written': 2, 'rejected': [CatalogRowError(3, "Required field 'isbn' is missing or empty.")], 'seconds': 0.5, 'books_per_second': 4.0}
+        assert format_import_result(result).split('\n') == [
+            "Skipped Line 3: Required field 'isbn' is missing or empty.",
+            "Imported 2 books in 0.50s (4 books/s), skipped 1 invalid rows."
+            ]
+
+    def test_title_matcher_matches_substrings(self):
+        books = ['book1', 'book', 'bo', 'ook1 and', 'the long book', 'missing']
+        matcher = TitleMatcher(books)
+        text = 'I read The Long Book1 and bo'
+        result = sorted(matcher.match(text))
+        expected_result = sorted([book for book in books if book in text.lower()])
+        assert result == expected_result
+
+    def test_title_matcher_no_titles(self):
+        matcher = TitleMatcher([])
+        assert matcher.match('book1') == []
+
+    @pytest.mark.usefixtures('setup_test_db')
+    def test_book_catalog_cached(self, amend_sqlite3_connect):
+        conn = sqlite3.connect('./path')
+        cur = conn.cursor()
+        catalog = BookCatalog()
+        first = catalog.snapshot(cur)
+        second = catalog.snapshot(cur)
+        assert first is second
+        assert sorted(first.titles) == ['book1', 'book2', 'book3']
+        assert first.get_book_entry('BOOK1') == {'title': 'book1', 'author': 'author1', 'isbn': 'isbn1', 'uri': 'url1', 'desc': 'sum1'}
+
+    @pytest.mark.usefixtures('setup_test_db')
+    def test_book_catalog_reloads_after_import(self, amend_sqlite3_connect):
+        conn = sqlite3.connect('./path')
+        cur = conn.cursor()
+        catalog = BookCatalog()
+        first = catalog.snapshot(cur)
+        upsert_books(cur, [('book4', 'author4', 'isbn4', None, 'sum4')])
+        second = catalog.snapshot(cur)
+        assert first is not second
+        assert 'book4' not in first.titles
+        assert 'book4' in second.titles
+
+    @pytest.mark.usefixtures('setup_test_db')
+    def test_book_catalog_follows_catalog_revision_of_other_connections(self, amend_sqlite3_connect):
+        cur = sqlite3.connect('./path').cursor()
+        other_cur = sqlite3.connect('./path').cursor()
+        catalog = BookCatalog()
+        first = catalog.snapshot(cur)
+        add_replied_entry(other_cur, 'c9', True)
+        other_cur.connection.commit()
+        assert catalog.snapshot(cur) is first
+
+        upsert_books(other_cur, [('book4', 'author4', 'isbn4', 'url4', 'sum4')])
+        second = catalog.snapshot(cur)
+        assert 'book4' in second.titles
+
+    @pytest.mark.usefixtures('setup_test_db')
+    def test_shared_catalog(self, amend_sqlite3_connect):
+        cur = sqlite3.connect('./path').cursor()
+        cur.execute('INSERT INTO books (title, author, isbn, uri, summary) VALUES (?,?,?,?,?)', ('Book Ü', 'author4', 'isbn4', None, 'sum4'))
+        cur.connection.commit()
+        snapshot = BookCatalog().snapshot(cur)
+        shared = SharedCatalog.create(snapshot)
+        try:
+            attached = SharedCatalog.attach(shared.name)
+            assert len(attached) == 4
+            assert attached.fingerprint == snapshot.matcher.fingerprint
+            assert sorted(attached.match('book ü and BOOK3')) == ['book ü', 'book3']
+            assert attached.match('nothing here') == []
+            assert attached.match('') == []
+            attached.close()
+        finally:
+            shared.close()
+            shared.unlink()
@@ -0,0 +1,60 @@
+import urllib.request
+import urllib.error
+
+import pytest
+from rsarb.util.metrics_funcs import MetricsRegistry, start_metrics_server, timed # type: ignore
+
+class Test_MetricsFunctionality:
+    def test_counter(self):
+        registry = MetricsRegistry()
+        counter = registry.counter('test_items_total', 'Items.', ('stage',))
+        counter.inc(stage='fetched')
+        counter.inc(2, stage='fetched')
+        assert counter.get(stage='fetched') == 3
+        assert counter.get(stage='posted') == 0
+        assert registry.counter('test_items_total', 'Items.', ('stage',)) is counter
+        with pytest.raises(ValueError):
+            counter.inc(-1, stage='fetched')
+        with pytest.raises(ValueError):
+            counter.inc(result='posted')
+        with pytest.raises(ValueError):
+            registry.histogram('test_items_total', 'Items.')
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('test_seconds', 'Durations.', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value)
+        assert histogram.get() == (4, 6.05)
+        lines = registry.render().splitlines()
+        assert lines[:2] == ['# HELP test_seconds Durations.', '# TYPE test_seconds histogram']
+        assert 'test_seconds_bucket{le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{le="1.0"} 3' in lines
+        assert 'test_seconds_bucket{le="+Inf"} 4' in lines
+        assert 'test_seconds_count 4' in lines
+
+    def test_timed(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('test_write_seconds', 'Writes.', ('operation',))
+
+        @timed(histogram, operation='write')
+        def write():
+            return 'written'
+
+        assert write() == 'written'
+        assert histogram.get(operation='write')[0] == 1
+
+    def test_metrics_server(self):
+        registry = MetricsRegistry()
+        registry.counter('test_replies_total', 'Replies.', ('result',)).inc(result='posted')
+        server = start_metrics_server(0, registry=registry)
+        try:
+            host, port = server.server_address[:2]
+            with urllib.request.urlopen(f"http://{host}:{port}/metrics") as response:
+                assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+                assert 'test_replies_total{result="posted"} 1' in response.read().decode('utf-8')
+            with pytest.raises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"http://{host}:{port}/other")
+        finally:
+            server.shutdown()
+            server.server_close()
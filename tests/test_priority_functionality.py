@@ -0,0 +1,24 @@
+import pytest
+from rsarb.util.priority_funcs import PriorityQueue, get_priority # type: ignore
+
+class Test_PriorityFunctionality:
+    def test_get_priority(self):
+        now = 1700000000.0
+        assert get_priority(now, 0, now) == pytest.approx(1.0)
+        assert get_priority(now - 3600, 0, now) == pytest.approx(0.5)
+        assert get_priority(now + 60, 0, now) == pytest.approx(1.0) # clock skew counts as brand new.
+        assert get_priority(now - 3600, 10, now) > get_priority(now, 0, now) # a busy thread beats a quiet new one.
+        assert get_priority(now, -5, now) == get_priority(now, 0, now) # comments deleted since the last cycle.
+        assert get_priority(now - 3600, 10, now, activity_weight=0) < get_priority(now, 0, now, activity_weight=0)
+        assert get_priority(now, 10, now, freshness_weight=0, half_life_seconds=0) > 0
+
+    def test_priority_queue(self):
+        queue = PriorityQueue()
+        for item, priority in (('old', 0.1), ('first', 1.0), ('second', 1.0), ('busy', 2.0)):
+            queue.push(item, priority)
+        assert len(queue) == 4
+        assert queue.pop() == 'busy'
+        assert queue.drain() == ['first', 'second', 'old']
+        assert not queue
+        with pytest.raises(IndexError):
+            queue.pop()
@@ -0,0 +1,64 @@
+import os
+import pstats
+
+import pytest
+from rsarb.util.profile_funcs import CycleProfiler # type: ignore
+
+def busy_cycle():
+    return sorted(str(i) for i in range(2000))
+
+class Test_ProfileFunctionality:
+    def test_profiles_every_nth_run(self, tmp_path):
+        profiler = CycleProfiler(str(tmp_path), every=3, top=5)
+        written = []
+        for _ in range(6):
+            with profiler.profile('scrape_reddit'):
+                busy_cycle()
+            written.append(profiler.last_profile)
+            profiler.last_profile = None
+        assert [paths is not None for paths in written] == [False, False, True, False, False, True]
+        prof_path, summary_path = written[2]
+        assert 'busy_cycle' in str(pstats.Stats(prof_path).stats)
+        with open(summary_path) as fd:
+            summary = fd.read()
+        assert summary.startswith('scrape_reddit run 3 took')
+        assert 'busy_cycle' in summary
+
+    def test_disabled_until_requested(self, tmp_path):
+        profiler = CycleProfiler(str(tmp_path / 'profiles'))
+        with profiler.profile('scrape_reddit'):
+            busy_cycle()
+        assert profiler.last_profile is None
+        assert not os.path.exists(tmp_path / 'profiles')
+
+        profiler.request(10, None) # called as a signal handler.
+        with profiler.profile('scrape_reddit'):
+            busy_cycle()
+        assert profiler.last_profile is not None
+        with profiler.profile('scrape_reddit'):
+            pass
+        assert len(os.listdir(tmp_path / 'profiles')) == 2
+
+    def test_tracemalloc_summary_and_pruning(self, tmp_path):
+        profiler = CycleProfiler(str(tmp_path), every=1, trace_memory=True, top=3, keep=2)
+        for _ in range(4):
+            with profiler.profile('scrape_reddit'):
+                busy_cycle()
+        with open(profiler.last_profile[1]) as fd:
+            assert 'Top 3 allocation sites:' in fd.read()
+        assert len([name for name in os.listdir(tmp_path) if name.endswith('.prof')]) == 2
+        assert len(os.listdir(tmp_path)) == 4
+
+    def test_unwritable_directory_does_not_fail_the_run(self, tmp_path, caplog):
+        blocker = tmp_path / 'not_a_directory'
+        blocker.write_text('')
+        profiler = CycleProfiler(str(blocker / 'profiles'), every=1)
+        with profiler.profile('scrape_reddit'):
+            result = busy_cycle()
+        assert len(result) == 2000
+        assert profiler.last_profile is None
+        assert 'Could not write the profile of scrape_reddit' in caplog.text
+
+    def test_invalid_every(self, tmp_path):
+        with pytest.raises(ValueError):
+            CycleProfiler(str(tmp_path), every=-1)
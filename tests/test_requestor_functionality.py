@@ -0,0 +1,195 @@
+import gzip
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import praw # type: ignore
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from rsarb.util.api_stats_funcs import ApiCallStats, get_endpoint # type: ignore
+from rsarb.util.requestor_funcs import CassetteMiss, InstrumentedRequestor, PooledHTTPAdapter, RecordingSession, ReplaySession, configure_http_session # type: ignore
+
+class MockSession:
+    def __init__(self):
+        self.headers = {}
+        self.requests = []
+
+    def request(self, method, url, *args, **kwargs):
+        self.requests.append((method, url, kwargs))
+        return 'response'
+
+    def close(self):
+        pass
+
+class MockRedditAdapter(BaseAdapter):
+    """
+    Answers the requests praw makes to log in and list a subreddit, so sessions can be recorded without network access.
+    """
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        response.headers['Content-Type'] = 'application/json'
+        response.headers['x-ratelimit-remaining'] = '0'
+        response.headers['x-ratelimit-used'] = '600'
+        response.headers['x-ratelimit-reset'] = '300'
+        response.headers['Set-Cookie'] = 'session_tracker=secret_cookie'
+        if '/api/v1/access_token' in request.url:
+            body = {'access_token': 'secret_token', 'expires_in': 3600, 'scope': '*', 'token_type': 'bearer'}
+        else:
+            children = [{'kind': 't3', 'data': {'id': f's{i}', 'name': f't3_s{i}', 'title': f'book{i}', 'selftext': '', 'subreddit': 'mock_subreddit1',
+                                                 'author': 'test_author1', 'created_utc': 1650000000.0 + i}} for i in (1, 2)]
+            body = {'kind': 'Listing', 'data': {'children': children, 'after': None, 'before': None}}
+        response._content = json.dumps(body).encode('utf-8')
+        return response
+
+    def close(self):
+        pass
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keeps connections open between requests.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = json.dumps({'path': self.path, 'accept_encoding': self.headers.get('Accept-Encoding')}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def local_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def connect(session):
+    return praw.Reddit(client_id='test_client_id', client_secret='test_client_secret', username='test_username', password='test_password',
+                       user_agent='test_user_agent', requestor_class=InstrumentedRequestor, requestor_kwargs={'session': session})
+
+def fetch_listing(requestor):
+    return requestor.request('GET', 'https://oauth.reddit.com/r/mock_subreddit1/new')
+
+class Test_RequestorFunctionality:
+    def test_get_endpoint(self):
+        assert get_endpoint('get', 'https://oauth.reddit.com/r/mock_subreddit1/new?limit=100') == 'GET /r/{subreddit}/new'
+        assert get_endpoint('GET', 'https://oauth.reddit.com/comments/abc123/') == 'GET /comments/{id}'
+        assert get_endpoint('GET', '/user/test_username/comments') == 'GET /user/{username}/comments'
+        assert get_endpoint('POST', 'https://oauth.reddit.com/api/comment/') == 'POST /api/comment'
+
+    def test_instrumented_requestor_counts_requests(self):
+        stats = ApiCallStats()
+        session = MockSession()
+        requestor = InstrumentedRequestor(user_agent='test_user_agent', session=session, stats=stats)
+        assert fetch_listing(requestor) == 'response'
+        fetch_listing(requestor)
+        summary = stats.summary()
+        assert summary['total'] == 2
+        assert summary['by_endpoint'] == {'GET /r/{subreddit}/new': 2}
+        assert summary['by_caller'] == {'test_requestor_functionality.fetch_listing': 2}
+        assert summary['lazy_fetches'] == {}
+
+    def test_instrumented_requestor_flags_lazy_fetches(self):
+        stats = ApiCallStats()
+        requestor = InstrumentedRequestor(user_agent='test_user_agent', session=MockSession(), stats=stats)
+        with stats.scanning():
+            requestor.request('GET', 'https://oauth.reddit.com/comments/abc123/')
+        requestor.request('GET', 'https://oauth.reddit.com/comments/abc123/')
+        summary = stats.summary()
+        assert summary['lazy_fetches'] == {'test_requestor_functionality.test_instrumented_requestor_flags_lazy_fetches GET /comments/{id}': 1}
+        stats.reset()
+        assert stats.summary()['total'] == 0
+
+    def test_record_and_replay(self, tmp_path):
+        cassette = str(tmp_path / 'cassette.jsonl.gz')
+        recording = RecordingSession(cassette)
+        recording.mount('https://', MockRedditAdapter())
+        recorded = [submission.title for submission in connect(recording).subreddit('mock_subreddit1').new(limit=2)]
+        recording.close()
+        assert recorded == ['book1', 'book2']
+        with gzip.open(cassette, 'rt') as fd:
+            contents = fd.read()
+        assert 'secret_token' not in contents
+        assert 'test_password' not in contents
+        assert 'secret_cookie' not in contents
+
+        replay = ReplaySession(cassette)
+        assert replay.remaining == 2
+        replayed = [submission.title for submission in connect(replay).subreddit('mock_subreddit1').new(limit=2)]
+        assert replayed == recorded
+        assert replay.remaining == 0
+        with pytest.raises(CassetteMiss):
+            replay.request('GET', 'https://oauth.reddit.com/r/mock_subreddit1/new', params={'limit': 2, 'raw_json': 1})
+
+    def test_replay_realtime_keeps_rate_limit_headers(self, tmp_path):
+        cassette = str(tmp_path / 'cassette.jsonl.gz')
+        recording = RecordingSession(cassette)
+        recording.mount('https://', MockRedditAdapter())
+        recording.request('GET', 'https://oauth.reddit.com/r/mock_subreddit1/new', params={'limit': 2})
+        recording.request('GET', 'https://oauth.reddit.com/r/mock_subreddit1/new', params={'limit': 2})
+        recording.close()
+
+        response = ReplaySession(cassette).request('GET', 'https://oauth.reddit.com/r/mock_subreddit1/new', params={'limit': '2'})
+        assert response.json()['data']['children'][0]['data']['title'] == 'book1'
+        assert 'x-ratelimit-remaining' not in response.headers
+        assert ReplaySession(cassette, realtime=True).request('GET', 'https://oauth.reddit.com/r/mock_subreddit1/new', params={'limit': 2}).headers['x-ratelimit-remaining'] == '0'
+
+    def test_replay_reads_cut_off_cassette(self, tmp_path):
+        cassette = str(tmp_path / 'cassette.jsonl.gz')
+        recording = RecordingSession(cassette)
+        recording.mount('https://', MockRedditAdapter())
+        for _ in range(3):
+            recording.request('GET', 'https://oauth.reddit.com/r/mock_subreddit1/new', params={'limit': 2})
+        with open(cassette, 'rb') as fd:
+            contents = fd.read()
+        with open(cassette, 'wb') as fd:
+            fd.write(contents[:-10]) # as if the bot died while writing the last response.
+        recording.close()
+
+        replay = ReplaySession(cassette)
+        assert replay.remaining == 2
+
+    def test_replay_rejects_other_files(self, tmp_path):
+        path = str(tmp_path / 'not_a_cassette.jsonl.gz')
+        with gzip.open(path, 'wt') as fd:
+            fd.write('{}\n')
+        with pytest.raises(ValueError):
+            ReplaySession(path)
+
+    def test_configure_http_session(self):
+        recording = requests.Session()
+        session = configure_http_session(recording, pool_connections=2, pool_maxsize=8, retries=3, compress=False)
+        assert session is recording
+        adapter = session.get_adapter('https://oauth.reddit.com/r/mock_subreddit1/new')
+        assert isinstance(adapter, PooledHTTPAdapter)
+        assert adapter._pool_maxsize == 8
+        assert adapter.max_retries.connect == 3
+        assert adapter.max_retries.read == 0 # prawcore retries timeouts itself, and a reply must never be posted twice.
+        assert session.headers['Accept-Encoding'] == 'identity'
+        assert configure_http_session().headers['Accept-Encoding'] == 'gzip, deflate'
+
+    def test_connections_are_reused(self, local_server):
+        stats = ApiCallStats()
+        session = configure_http_session(stats=stats)
+        for i in range(5):
+            assert session.get(f"{local_server}/r/mock_subreddit1/new", timeout=5).json()['accept_encoding'] == 'gzip, deflate'
+        adapter = session.get_adapter(local_server)
+        assert adapter.connections == 1
+        assert stats.summary()['connections'] == 1
+
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda i: session.get(f"{local_server}/comments/{i}", timeout=5), range(40)))
+        assert adapter.connections <= 4 # at most one connection per concurrent fetcher.
+        stats.reset()
+        assert stats.summary()['connections'] == 0
@@ -0,0 +1,128 @@
+import pytest
+from tests.conftest import MockComment, MockRedditor, MockSubmission, make_synthetic_reddit # type: ignore
+from rsarb.util.catalog_funcs import CatalogSnapshot, TitleMatcher # type: ignore
+from rsarb.util.scan_funcs import EntityRecord, ScanPool, match_records, scan_entities, scan_records # type: ignore
+from rsarb.util.praw_funcs import scan_entity # type: ignore
+
+class Test_ScanFunctionality:
+    def test_scan_records(self):
+        matcher = TitleMatcher(['book1', 'book2'])
+        records = [('t3_s1', 'test_author1', 'Book1\x00book2'), ('t1_c1', 'test_author1', 'nothing here')]
+        result = scan_records(records, matcher)
+        assert sorted(result['t3_s1']) == ['book1', 'book2']
+        assert result['t1_c1'] == []
+
+    def test_scan_pool_matches_serial_scan(self):
+        entries = [{'title': f'book{i}', 'author': 'a', 'isbn': 'i', 'uri': None, 'desc': 'd'} for i in range(20)]
+        catalog = CatalogSnapshot(None, entries)
+        records = [(f't1_c{i}', 'test_author1', f'I liked book{i} and book{i * 3}') for i in range(40)]
+        pool = ScanPool(catalog, workers=2, threshold=1, chunk_size=7)
+        try:
+            result = scan_records(records, catalog.matcher, pool)
+        finally:
+            pool.close()
+        expected_result = match_records(records, catalog.matcher)
+        assert [(fullname, sorted(books)) for fullname, books in result.items()] == [(fullname, sorted(books)) for fullname, books in expected_result]
+
+    def test_scan_entities_matches_scan_entity(self):
+        books = ['book1', 'book2']
+        submission = MockSubmission(None, None, 't3_s1', 'test_author1', 'book1', 'selftext', None)
+        entities = [
+            submission,
+            MockSubmission(None, None, 't3_s2', 'test_author1', 'title', 'book1 book2', None),
+            MockSubmission(None, None, 't3_s3', 'test_author2', 'book1', 'selftext', None),
+            MockComment(None, submission, 't1_c1', 'test_author1', 'book2'),
+            MockComment(None, submission, 't1_c2', 'test_author1', 'book2'),
+            MockComment(None, submission, 't1_c3', 'test_author1', 'nothing'),
+        ]
+        replied_entries = ['c1']
+        opted_in_users = ['test_author1']
+        result = scan_entities(entities, TitleMatcher(books), replied_entries, opted_in_users)
+        expected_result = {}
+        for entity in entities:
+            if entity.id not in replied_entries and entity.author in opted_in_users:
+                expected_result[entity.fullname] = sorted(scan_entity(entity, books, replied_entries, opted_in_users))
+        assert {fullname: sorted(titles) for fullname, titles in result.items()} == expected_result
+        assert list(result) == ['t3_s1', 't3_s2', 't1_c2', 't1_c3']
+
+    def test_scan_entities_redditor_author(self):
+        submission = MockSubmission(None, None, 't3_s1', 'test_author1', 'title', 'selftext', None)
+        entities = [
+            MockComment(None, submission, 't1_c1', MockRedditor(None, 'Test_Author1'), 'book1'),
+            MockComment(None, submission, 't1_c2', MockRedditor(None, 'test_author2'), 'book1'),
+        ]
+        result = scan_entities(entities, TitleMatcher(['book1']), set(), {'test_author1'})
+        assert result == {'t1_c1': ['book1']}
+        assert scan_entity(entities[0], ['book1'], set(), {'test_author1'}) == ['book1']
+        assert scan_entity(entities[1], ['book1'], set(), {'test_author1'}) == []
+
+    def test_scan_entities_skips_before_reading_text(self, monkeypatch):
+        submission = MockSubmission(None, None, 't3_s1', 'test_author1', 'title', 'selftext', None)
+        entities = [
+            MockComment(None, submission, 't1_c1', 'test_author1', 'book1'),
+            MockComment(None, submission, 't1_c2', 'test_author2', 'book1'),
+            MockComment(None, submission, 't1_c3', 'test_author1', 'book1'),
+        ]
+        converted = []
+        from_entity = EntityRecord.from_entity
+        monkeypatch.setattr(EntityRecord, 'from_entity', lambda entity: converted.append(entity.fullname) or from_entity(entity))
+        result = scan_entities(entities, TitleMatcher(['book1']), {'c1'}, {'test_author1'})
+        assert result == {'t1_c3': ['book1']}
+        assert converted == ['t1_c3']
+
+    def test_scan_entities_invalid_entity(self):
+        entities = [MockComment(None, None, 't5_r1', 'test_author1', 'book1')]
+        with pytest.raises(ValueError) as context:
+            scan_entities(entities, TitleMatcher(['book1']), [], ['test_author1'])
+
+    def test_entity_record_from_submission(self):
+        entity = MockSubmission(None, None, 't3_s1', 'Test_Author1', 'Book1', 'Selftext', None, created_utc=1650000000.0)
+        record = EntityRecord.from_entity(entity)
+        assert (record.fullname, record.kind, record.id, record.author, record.created_utc, record.text, record.parent_id) == \
+            ('t3_s1', 't3', 's1', 'test_author1', 1650000000.0, 'book1\x00selftext', None)
+        assert not hasattr(record, '__dict__')
+
+    def test_entity_record_from_comment(self):
+        parent = MockSubmission(None, None, 't3_s1', 'test_author1', 'title', 'selftext', None)
+        entity = MockComment(None, parent, 't1_c1', 'test_author1', 'Book1')
+        record = EntityRecord.from_entity(entity)
+        assert (record.kind, record.text, record.parent_id) == ('t1', 'book1', 't3_s1')
+        assert record == EntityRecord('t1_c1', 't1', 'someone', 0.0, '')
+        assert {record: True}[EntityRecord.from_entity(entity)]
+
+    def test_scan_entities_accepts_records(self):
+        records = [EntityRecord('t1_c1', 't1', 'test_author1', 0.0, 'book1'), EntityRecord('t1_c2', 't1', 'test_author2', 0.0, 'book1')]
+        result = scan_entities(records, TitleMatcher(['book1']), set(), {'test_author1'})
+        assert result == {'t1_c1': ['book1']}
+
+class Test_SyntheticReddit:
+    def test_same_seed_builds_same_reddit(self):
+        first = make_synthetic_reddit(seed=7, submissions=20, comments=300)
+        second = make_synthetic_reddit(seed=7, submissions=20, comments=300)
+        other = make_synthetic_reddit(seed=8, submissions=20, comments=300)
+        assert [comment.body for comment in first.comments] == [comment.body for comment in second.comments]
+        assert first.hits == second.hits
+        assert [comment.body for comment in first.comments] != [comment.body for comment in other.comments]
+
+    def test_shape(self):
+        synthetic = make_synthetic_reddit(subreddits=3, submissions=30, comments=600, max_depth=2, text_length=12)
+        assert synthetic.subreddit_names == 'synthetic_subreddit0+synthetic_subreddit1+synthetic_subreddit2'
+        assert len(synthetic.submissions) == 30
+        assert len(synthetic.comments) == 600
+        assert sum(len(submission.comments.list()) for submission in synthetic.submissions) == 600
+        depths = set()
+        for comment in synthetic.comments:
+            depth, parent = 0, comment.parent
+            while parent.fullname.startswith('t1_'):
+                depth, parent = depth + 1, parent.parent
+            depths.add(depth)
+        assert depths == {0, 1, 2}
+        assert len(synthetic.comments[0].body.split(' ')) in (12, 12 + 3)
+
+    def test_scan_finds_exactly_the_hits(self):
+        synthetic = make_synthetic_reddit(seed=3, submissions=50, comments=2000, hit_rate=0.1, opted_in_ratio=0.3)
+        entities = synthetic.submissions + synthetic.comments
+        result = scan_entities(entities, TitleMatcher(synthetic.titles), set(), set(synthetic.opted_in_users))
+        found = {fullname: set(titles) for fullname, titles in result.items() if titles}
+        assert found == synthetic.hits
+        assert 0.01 < len(found) / len(entities) < 0.1
@@ -0,0 +1,146 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+from rsarb.util.catalog_funcs import CatalogSnapshot # type: ignore
+from rsarb.util.scan_funcs import ScanPool, scan_records # type: ignore
+from rsarb.util.shard_funcs import Coordinator, HashRing, run_worker # type: ignore
+
+SUBREDDITS = [f"subreddit{i}" for i in range(1000)]
+
+def idle_worker(config_file, name, index, assignments):
+    while True:
+        time.sleep(1)
+
+def draining_worker(directory, name, index, assignments):
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopping.set())
+    while not stopping.wait(0.05):
+        pass
+    time.sleep(0.5) # finishing a cycle.
+    with open(os.path.join(directory, name), 'w') as fd:
+        fd.write('drained')
+
+def pooled_scan_worker(directory, name, index, assignments):
+    catalog = CatalogSnapshot(1, [{'title': title, 'author': 'a', 'isbn': 'i', 'uri': None, 'desc': 'd'} for title in ('book1', 'book2')])
+    records = [(f't1_c{i}', 'test_author1', 'i liked book1' if i % 2 else 'nothing here') for i in range(100)]
+    pool = ScanPool(catalog, workers=2, threshold=10, chunk_size=25)
+    try:
+        matches = scan_records(records, catalog.matcher, pool)
+    finally:
+        pool.close()
+    with open(os.path.join(directory, name), 'w') as fd:
+        fd.write(str(sum(1 for titles in matches.values() if titles)))
+    while True:
+        time.sleep(1)
+
+def owners(ring):
+    return {subreddit: ring.get_node(subreddit) for subreddit in SUBREDDITS}
+
+class Test_HashRing:
+    def test_assign_covers_every_key_once(self):
+        ring = HashRing(['worker-0', 'worker-1', 'worker-2', 'worker-3'])
+        shards = ring.assign(SUBREDDITS)
+        assert sorted(subreddit for shard in shards.values() for subreddit in shard) == sorted(SUBREDDITS)
+        assert all(100 < len(shard) < 400 for shard in shards.values())
+        assert HashRing(['worker-3', 'worker-2', 'worker-1', 'worker-0']).assign(SUBREDDITS) == shards
+
+    def test_adding_a_node_only_moves_keys_to_it(self):
+        ring = HashRing(['worker-0', 'worker-1', 'worker-2', 'worker-3'])
+        before = owners(ring)
+        ring.add('worker-4')
+        after = owners(ring)
+        moved = [subreddit for subreddit in SUBREDDITS if before[subreddit] != after[subreddit]]
+        assert all(after[subreddit] == 'worker-4' for subreddit in moved)
+        assert 100 < len(moved) < 300
+
+    def test_removing_a_node_only_moves_its_keys(self):
+        ring = HashRing(['worker-0', 'worker-1', 'worker-2', 'worker-3'])
+        before = owners(ring)
+        ring.remove('worker-1')
+        after = owners(ring)
+        assert 'worker-1' not in after.values()
+        assert all(before[subreddit] == after[subreddit] for subreddit in SUBREDDITS if before[subreddit] != 'worker-1')
+
+    def test_empty_ring(self):
+        with pytest.raises(ValueError):
+            HashRing().get_node('subreddit0')
+
+class Test_Coordinator:
+    def test_dead_worker_shard_moves_and_comes_back(self):
+        coordinator = Coordinator('./config.ini', SUBREDDITS[:40], workers=3, restart_delay=5, target=idle_worker)
+        coordinator.start()
+        try:
+            initial = dict(coordinator.assignments)
+            assert sorted('+'.join(initial.values()).split('+')) == sorted(SUBREDDITS[:40])
+
+            coordinator.processes['worker-1'].kill()
+            coordinator.processes['worker-1'].join()
+            coordinator.check(now=0)
+            degraded = dict(coordinator.assignments)
+            assert degraded['worker-1'] == ''
+            for name in ('worker-0', 'worker-2'):
+                assert set(initial[name].split('+')) <= set(degraded[name].split('+'))
+            assert sorted('+'.join(degraded.values()).strip('+').replace('++', '+').split('+')) == sorted(SUBREDDITS[:40])
+
+            coordinator.check(now=5)
+            assert coordinator.processes['worker-1'].is_alive()
+            assert dict(coordinator.assignments) == initial
+        finally:
+            coordinator.stop()
+        assert coordinator.processes == {}
+
+    def test_resize(self):
+        coordinator = Coordinator('./config.ini', SUBREDDITS[:100], workers=2, target=idle_worker)
+        coordinator.start()
+        try:
+            initial = dict(coordinator.assignments)
+            coordinator.resize(3)
+            assert sorted(coordinator.processes) == ['worker-0', 'worker-1', 'worker-2']
+            grown = dict(coordinator.assignments)
+            for name in ('worker-0', 'worker-1'):
+                assert set(grown[name].split('+')) <= set(initial[name].split('+'))
+            coordinator.resize(2)
+            assert sorted(coordinator.processes) == ['worker-0', 'worker-1']
+            assert dict(coordinator.assignments) == initial
+        finally:
+            coordinator.stop()
+
+    def test_workers_can_scan_in_a_process_pool(self, tmp_path):
+        coordinator = Coordinator(str(tmp_path), SUBREDDITS[:10], workers=1, target=pooled_scan_worker)
+        coordinator.start()
+        try:
+            deadline = time.time() + 30
+            while not os.path.exists(tmp_path / 'worker-0') and coordinator.processes['worker-0'].is_alive() and time.time() < deadline:
+                time.sleep(0.1)
+            assert (tmp_path / 'worker-0').read_text() == '50'
+        finally:
+            coordinator.stop()
+
+    def test_run_stops_workers_gracefully(self, tmp_path):
+        coordinator = Coordinator(str(tmp_path), SUBREDDITS[:10], workers=2, target=draining_worker, stop_timeout=10)
+        timer = threading.Timer(1, coordinator.request_stop)
+        timer.start()
+        previous = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            coordinator.run(check_interval=0.1)
+        finally:
+            timer.cancel()
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        assert coordinator.processes == {}
+        assert sorted(os.listdir(tmp_path)) == ['worker-0', 'worker-1']
+
+    def test_run_worker_serves_metrics_after_the_coordinator_port(self, monkeypatch):
+        from rsarb.RedditScanAndReplyBot import RedditScanAndReplyBot # type: ignore
+        started = []
+        bot = RedditScanAndReplyBot(options={'METRICS': {'port': '9100'}})
+        monkeypatch.setattr(RedditScanAndReplyBot, 'from_file', classmethod(lambda cls, config_file: bot))
+        monkeypatch.setattr(bot, 'setup', lambda: None)
+        monkeypatch.setattr(bot, 'run', lambda: started.append(bot.metrics_port))
+        run_worker('./path', 'worker-2', 2, {'worker-2': 'subreddit1'})
+        assert started == [9103]
+        assert bot.get_option('METRICS', 'port') == '9100'
+        assert bot.get_subreddits() == 'subreddit1'
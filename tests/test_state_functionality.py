@@ -0,0 +1,180 @@
+import gzip
+
+import rsarb.RedditScanAndReplyBot as bot_module # type: ignore
+from rsarb.RedditScanAndReplyBot import ITEMS_TOTAL, RedditScanAndReplyBot
+from rsarb.util.sql_funcs import add_opted_in_user, add_replied_entry, create_database, get_sql_cursor, upsert_books # type: ignore
+from rsarb.util.requestor_funcs import RecordingSession # type: ignore
+from rsarb.util.state_funcs import BotState # type: ignore
+
+def make_database(path):
+    create_database(path)
+    cur = get_sql_cursor(path)
+    upsert_books(cur, [('book1', 'author1', 'isbn1', 'url1', 'sum1')])
+    add_replied_entry(cur, 'c1', True)
+    add_opted_in_user(cur, 'test_author1')
+    return cur
+
+def make_bot(db_path, options=None):
+    praw_config = {
+        'client_id' : 'test_client_id',
+        'client_secret': 'test_client_secret',
+        'password':'test_password',
+        'username':'test_username',
+        'user_agent':'test_user_agent',
+        'subreddits':'mock_subreddit1+mock_subreddit2',
+        'bot_subreddit': 'mock_botsubreddit',
+        'opt_in_thread': 'https://www.mockreddit.com/r/mock_botsubreddit/comments/8/opt_in_thread/'
+        }
+    return RedditScanAndReplyBot(praw_config, {'database_name': db_path}, options)
+
+class Test_StateFunctionality:
+    def test_refresh_follows_database(self, tmp_path):
+        cur = make_database(str(tmp_path / 'state.db'))
+        state = BotState()
+        state.refresh(cur)
+        assert state.replied_entries == {'c1'}
+        assert state.opted_in_users == {'test_author1'}
+
+        add_replied_entry(cur, 's1', True)
+        state.comment_counts = {'t3_s2': 1}
+        state.refresh(cur)
+        assert state.replied_entries == {'c1', 's1'}
+        assert state.comment_counts == {'t3_s2': 1}
+
+        cur.execute("DELETE FROM replied_entries WHERE reddit_id = 'c1'")
+        add_replied_entry(cur, 's2', True)
+        state.refresh(cur)
+        assert state.replied_entries == {'s1', 's2'}
+
+        add_opted_in_user(cur, 'test_author2')
+        state.refresh(cur)
+        assert state.opted_in_users == {'test_author1', 'test_author2'}
+        assert state.comment_counts == {} # the new user's older comments may need replies.
+
+    def test_check_matcher(self):
+        state = BotState()
+        state.check_matcher(b'first')
+        state.comment_counts = {'t3_s1': 2}
+        state.check_matcher(b'first')
+        assert not state.has_new_comments('t3_s1', 2)
+        assert state.has_new_comments('t3_s1', 3)
+        assert state.has_new_comments('t3_s1', None)
+        state.scanned_utc = {'t3_s1': 1000.0}
+        assert not state.has_new_comments('t3_s1', 2, 1500.0, 600)
+        assert state.has_new_comments('t3_s1', 2, 1600.0, 600)
+        state.check_matcher(b'second')
+        assert state.has_new_comments('t3_s1', 2)
+
+    def test_snapshot_round_trip(self, tmp_path):
+        cur = make_database(str(tmp_path / 'state.db'))
+        path = str(tmp_path / 'state.db.state')
+        state = BotState()
+        state.refresh(cur)
+        state.check_matcher(b'\x01\x02')
+        state.comment_counts = {'t3_s1': 4}
+        state.scanned_utc = {'t3_s1': 100.0}
+        state.save(path)
+
+        loaded = BotState.load(path, cur)
+        assert loaded.replied_entries == state.replied_entries
+        assert loaded.opted_in_users == state.opted_in_users
+        assert loaded.matcher_fingerprint == b'\x01\x02'
+        assert loaded.comment_counts == {'t3_s1': 4}
+        assert loaded.scanned_utc == {'t3_s1': 100.0}
+
+        add_replied_entry(cur, 's1', True)
+        assert BotState.load(path, cur) is None # the database changed after the snapshot was taken.
+        assert BotState.load(str(tmp_path / 'missing.state'), cur) is None
+
+    def test_snapshot_corrupt(self, tmp_path):
+        cur = make_database(str(tmp_path / 'state.db'))
+        path = str(tmp_path / 'state.db.state')
+        with open(path, 'wb') as fd:
+            fd.write(b'not a snapshot')
+        assert BotState.load(path, cur) is None
+        with gzip.open(path, 'wt') as fd:
+            fd.write('{"version": 0}')
+        assert BotState.load(path, cur) is None
+
+    def test_unchanged_submissions_are_not_fetched_again(self, tmp_path, mock_reddit):
+        db_path = str(tmp_path / 'state.db')
+        make_database(db_path)
+        rb = make_bot(db_path)
+        rb.setup()
+        rb.scrape_reddit()
+        assert rb.state.comment_counts
+        first_requests = rb.last_cycle_api_stats['total']
+
+        unchanged = ITEMS_TOTAL.get(stage='unchanged_submission')
+        rb.scrape_reddit()
+        assert ITEMS_TOTAL.get(stage='unchanged_submission') - unchanged == len(rb.state.comment_counts)
+        assert rb.last_cycle_api_stats['total'] <= first_requests
+
+    def test_unchanged_submissions_are_fetched_again_after_rescan_seconds(self, tmp_path, mock_reddit):
+        db_path = str(tmp_path / 'state.db')
+        make_database(db_path)
+        rb = make_bot(db_path, {'STATE': {'rescan_seconds': '0'}})
+        rb.setup()
+        rb.scrape_reddit()
+        assert rb.state.scanned_utc.keys() == rb.state.comment_counts.keys()
+
+        unchanged = ITEMS_TOTAL.get(stage='unchanged_submission')
+        rb.scrape_reddit()
+        assert ITEMS_TOTAL.get(stage='unchanged_submission') == unchanged
+
+    def test_failed_listing_keeps_comment_counts(self, tmp_path, mock_reddit, monkeypatch):
+        db_path = str(tmp_path / 'state.db')
+        make_database(db_path)
+        rb = make_bot(db_path)
+        rb.setup()
+        rb.scrape_reddit()
+        counts = dict(rb.state.comment_counts)
+        assert counts
+
+        def failing_get_submissions(*args, **kwargs):
+            raise ConnectionError('listing is down')
+            yield
+        get_submissions = bot_module.get_submissions
+        monkeypatch.setattr(bot_module, 'get_submissions', failing_get_submissions)
+        rb.scrape_reddit()
+        assert rb.state.comment_counts == counts
+
+        monkeypatch.setattr(bot_module, 'get_submissions', get_submissions)
+        unchanged = ITEMS_TOTAL.get(stage='unchanged_submission')
+        rb.scrape_reddit()
+        assert ITEMS_TOTAL.get(stage='unchanged_submission') - unchanged == len(counts)
+
+    def test_warm_start(self, tmp_path, mock_reddit):
+        db_path = str(tmp_path / 'state.db')
+        make_database(db_path)
+        rb = make_bot(db_path)
+        rb.setup()
+        rb.scrape_reddit()
+        rb.save_state()
+        assert (tmp_path / 'state.db.state').is_file()
+
+        restarted = make_bot(db_path)
+        restarted.setup()
+        assert restarted.state.replied_entries == rb.state.replied_entries
+        assert restarted.state.comment_counts == rb.state.comment_counts
+        assert restarted.state.scanned_utc == rb.state.scanned_utc
+
+        disabled = make_bot(db_path, {'STATE': {'snapshot': 'false'}})
+        assert disabled.get_state_path() is None
+        assert not disabled.load_state()
+
+    def test_replay_leaves_database_untouched(self, tmp_path, mock_reddit):
+        db_path = str(tmp_path / 'state.db')
+        cur = make_database(db_path)
+        cassette = str(tmp_path / 'cassette.jsonl.gz')
+        RecordingSession(cassette).close()
+        rb = make_bot(db_path)
+        rb.setup_replay(cassette)
+        rb.scrape_reddit()
+        rb.cur.execute('SELECT count(*) FROM replied_entries')
+        assert rb.cur.fetchone()[0] > 1
+        rb.save_state()
+        assert rb.get_state_path() is None
+        assert not (tmp_path / 'state.db.state').exists()
+        cur.execute('SELECT reddit_id FROM replied_entries')
+        assert cur.fetchall() == [('c1',)]
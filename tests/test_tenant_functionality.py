@@ -0,0 +1,90 @@
+import logging
+
+import pytest
+from rsarb.RedditScanAndReplyBot import RedditScanAndReplyBot
+from rsarb.util.catalog_funcs import BookCatalog, CatalogCache # type: ignore
+from rsarb.util.sql_funcs import create_database, get_sql_cursor, upsert_books # type: ignore
+from rsarb.util.tenant_funcs import TenantRuntime # type: ignore
+
+BOOKS = [('book1', 'author1', 'isbn1', 'url1', 'sum1'), ('book2', 'author2', 'isbn2', 'url2', 'sum2')]
+
+def make_database(path, books=BOOKS):
+    create_database(path)
+    cur = get_sql_cursor(path)
+    upsert_books(cur, books)
+    return cur
+
+def make_bot(db_path, username, options=None):
+    praw_config = {
+        'client_id' : 'test_client_id',
+        'client_secret': 'test_client_secret',
+        'password':'test_password',
+        'username': username,
+        'user_agent':'test_user_agent',
+        'subreddits':'mock_subreddit1+mock_subreddit2',
+        'bot_subreddit': 'mock_botsubreddit',
+        'opt_in_thread': 'https://www.mockreddit.com/r/mock_botsubreddit/comments/8/opt_in_thread/'
+        }
+    return RedditScanAndReplyBot(praw_config, {'database_name': db_path}, options)
+
+class Test_TenantFunctionality:
+    def test_catalog_cache_shares_identical_catalogs(self, tmp_path):
+        cache = CatalogCache()
+        first_cur = make_database(str(tmp_path / 'first.db'))
+        second_cur = make_database(str(tmp_path / 'second.db'))
+        other_cur = make_database(str(tmp_path / 'other.db'), BOOKS[:1])
+
+        first = BookCatalog(cache=cache).snapshot(first_cur)
+        second = BookCatalog(cache=cache).snapshot(second_cur)
+        other = BookCatalog(cache=cache).snapshot(other_cur)
+        assert first is second
+        assert first.matcher is second.matcher
+        assert other is not first
+        assert other.titles == ['book1']
+        assert BookCatalog().snapshot(first_cur) is not first
+        assert len(cache) == 2
+
+    def test_catalog_cache_follows_changes(self, tmp_path):
+        cache = CatalogCache()
+        first_cur = make_database(str(tmp_path / 'first.db'))
+        second_cur = make_database(str(tmp_path / 'second.db'))
+        first_catalog = BookCatalog(cache=cache)
+        second_catalog = BookCatalog(cache=cache)
+        shared = first_catalog.snapshot(first_cur)
+        assert second_catalog.snapshot(second_cur) is shared
+
+        upsert_books(first_cur, [('book3', 'author3', 'isbn3', 'url3', 'sum3')])
+        changed = first_catalog.snapshot(first_cur)
+        assert 'book3' in changed.titles
+        assert second_catalog.snapshot(second_cur) is shared
+
+    def test_tenant_runtime(self, tmp_path, mock_reddit, caplog):
+        bots = {}
+        for name, options in (('account1', {}), ('account2', {'CLAIMS': {'owner': 'account2-owner'}})):
+            db_path = str(tmp_path / f"{name}.db")
+            make_database(db_path)
+            bots[name] = make_bot(db_path, name, dict(options, LEASES={'repopulate_opted_in_users': '0'}))
+        runtime = TenantRuntime(bots)
+        assert bots['account1'].worker_id.endswith(':account1')
+        assert bots['account2'].worker_id == 'account2-owner'
+
+        runtime.setup()
+        assert sorted(tag for job in runtime.scheduler.jobs for tag in job.tags) == ['account1', 'account1', 'account2', 'account2']
+        runtime.scheduler.run_all()
+        assert bots['account1'].catalog.snapshot(bots['account1'].cur) is bots['account2'].catalog.snapshot(bots['account2'].cur)
+        assert bots['account1'].reddit is not bots['account2'].reddit
+
+        def fail():
+            raise RuntimeError('account1 is down')
+        bots['account1'].scrape_reddit = fail
+        bots['account2'].last_cycle_api_stats = None
+        runtime.scheduler.clear()
+        runtime.setup()
+        with caplog.at_level(logging.ERROR):
+            runtime.scheduler.run_all()
+        assert 'Tenant account1' in caplog.text
+        assert bots['account2'].last_cycle_api_stats is not None
+
+    def test_tenant_runtime_needs_bots(self):
+        with pytest.raises(ValueError):
+            TenantRuntime({})